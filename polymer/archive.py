@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Direct access to the files of zipped products (SAFE), without extracting
+the whole archive
+'''
+
+from __future__ import print_function, division, absolute_import
+import os
+import tempfile
+import zipfile
+from fnmatch import fnmatch
+from pathlib import PurePosixPath
+from shutil import rmtree
+from threading import Lock
+
+
+def is_zip(filename):
+    '''
+    whether filename is a zip archive (and not a directory)
+    '''
+    return os.path.isfile(str(filename)) and zipfile.is_zipfile(str(filename))
+
+
+def glob_paths(paths, pattern):
+    '''
+    returns the sorted list of paths (PurePosixPath) matching pattern
+    (fnmatch pattern, matched component-wise)
+    '''
+    parts = PurePosixPath(pattern).parts
+    return sorted([p for p in paths
+                   if (len(p.parts) == len(parts))
+                   and all([fnmatch(a, b) for (a, b) in zip(p.parts, parts)])])
+
+
+class ZipProduct(object):
+    '''
+    A product in a zip archive
+
+    The member files are accessed by their path in the archive (as a string
+    or PurePosixPath), starting with the product root directory (attribute
+    root, for example 'S3A_OL_1_EFR____...SEN3').
+
+    The members can be read in memory (read), opened as seekable file
+    objects (open), or extracted individually to a temporary directory
+    (extract) for the libraries which require a filename. The extracted
+    files are removed by close().
+
+    tmpdir: base directory for the extracted files (default: system
+        temporary directory)
+    '''
+    def __init__(self, filename, tmpdir=None):
+        self.filename = str(filename)
+        self.zipfile = zipfile.ZipFile(self.filename)
+        self.tmpdir = tmpdir
+        self.extractdir = None
+        self.extracted = {}
+        self.lock = Lock()
+
+        # all the paths in the archive, including the implicit directories
+        self.paths = set()
+        for name in self.zipfile.namelist():
+            p = PurePosixPath(name)
+            self.paths.add(p)
+            self.paths.update(p.parents)
+        self.paths.discard(PurePosixPath('.'))
+
+        roots = set([p.parts[0] for p in self.paths])
+        if len(roots) == 1:
+            self.root = PurePosixPath(roots.pop())
+        else:
+            self.root = PurePosixPath('')
+
+    def exists(self, name):
+        return PurePosixPath(name) in self.paths
+
+    def glob(self, pattern):
+        '''
+        returns the sorted list of the paths matching pattern
+        (fnmatch pattern, matched component-wise)
+        '''
+        return glob_paths(self.paths, pattern)
+
+    def read(self, name):
+        '''
+        returns the content of member name
+        '''
+        with self.lock:
+            return self.zipfile.read(str(name))
+
+    def open(self, name):
+        '''
+        returns a (seekable) file object for member name
+        '''
+        with self.lock:
+            return self.zipfile.open(str(name))
+
+    def extract(self, name):
+        '''
+        extracts member name to the temporary directory (once), and returns
+        its filename
+        '''
+        name = str(name)
+        with self.lock:
+            if name not in self.extracted:
+                if self.extractdir is None:
+                    self.extractdir = tempfile.mkdtemp(dir=self.tmpdir,
+                                                       prefix='polymer_zip_')
+                print('Extracting {}'.format(os.path.basename(name)))
+                self.extracted[name] = self.zipfile.extract(name, self.extractdir)
+            return self.extracted[name]
+
+    def close(self):
+        self.zipfile.close()
+        if self.extractdir is not None:
+            rmtree(self.extractdir)
+            self.extractdir = None
+            self.extracted = {}
+
+    def __del__(self):
+        if getattr(self, 'extractdir', None) is not None:
+            rmtree(self.extractdir, ignore_errors=True)
@@ -2,68 +2,279 @@
 # encoding: utf-8
 
 from __future__ import print_function, division, absolute_import
+import numpy as np
 from numpy import cos, sqrt, pi, arccos
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+
+# declared block datasets: name -> (nominal dtype, spectral)
+# The spectral datasets have the shape (ysize, xsize, nbands), the other ones
+# the shape of the block (ysize, xsize). The declarations provide the default
+# shape and dtype of Block.buffer ; other datasets can be stored in the
+# block without declaration.
+DatasetSpec = namedtuple('DatasetSpec', ['dtype', 'spectral'])
+
+DATASETS = OrderedDict()
+for _names, _dtype, _spectral in [
+        (['latitude', 'longitude', 'sza', 'vza', 'saa', 'vaa',
+          'ozone', 'wind_speed', 'surf_press', 'altitude',
+          'Rgli', 'Rnir', 'logchl', 'fa', 'logfb', 'SPM', 'eps',
+          'logchl_unc', 'logfb_unc',
+          '_raa', '_mus', '_muv', '_air_mass', '_scat_angle'], 'float32', False),
+        (['bitmask'], 'uint16', False),
+        (['niter'], 'uint32', False),
+        (['Ltoa', 'Rtoa'], 'float64', True),
+        (['F0', 'wavelen', 'Rtoa_gc', 'Rprime', 'Rprime_noglint',
+          'Rmol', 'Rmolgli', 'Tmol', 'Rw', 'Ratm', 'Rwmod',
+          'rho_w_unc', 'Rtoa_var'], 'float32', True),
+        ]:
+    for _name in _names:
+        DATASETS[_name] = DatasetSpec(_dtype, _spectral)
+
+# derived geometry: cached in the block on first access, and not transferred
+# between processes (recomputed when needed)
+DERIVED = ['_mus', '_muv', '_air_mass', '_scat_angle']
+
+
+class BufferPool(object):
+    '''
+    A pool of the block arrays, keyed by (name, shape, dtype)
+
+    The arrays are allocated through Block.buffer, and returned to the pool
+    by release(block) once the block has been written by the level2: the
+    next blocks of the same size reuse them instead of allocating new
+    arrays. The block should not be used after it has been released.
+
+    maxfree: maximum number of free arrays kept for each key
+    '''
+    def __init__(self, maxfree=4):
+        self.maxfree = maxfree
+        self.free = {}
+        self.lock = Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def get(self, name, shape, dtype='float32', fill=np.NaN):
+        '''
+        returns an array of the given shape and dtype, filled with fill
+        (if not None)
+        '''
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            if self.free.get(key):
+                A = self.free[key].pop()
+                self.reused += 1
+            else:
+                A = None
+                self.allocated += 1
+        if A is None:
+            A = np.empty(shape, dtype=dtype)
+        if fill is not None:
+            A.fill(fill)
+        return A
+
+    def release(self, block):
+        '''
+        returns the buffers of block to the pool
+        '''
+        buffers = block._buffers or []
+        block._buffers = None
+        with self.lock:
+            for key, A in buffers:
+                free = self.free.setdefault(key, [])
+                if len(free) < self.maxfree:
+                    free.append(A)
+
+    def __str__(self):
+        return 'buffer pool: {} arrays allocated, {} reused'.format(
+            self.allocated, self.reused)
+
 
 class Block(object):
+    '''
+    A block of data: the datasets of a window of size (ysize, xsize) at
+    offset (yoffset, xoffset) in the level1, for the list of bands
+
+    The datasets are accessed as attributes (block.Rtoa) or items
+    (block['Rtoa']), and listed by datasets(). Their shape and dtype are
+    declared in DATASETS (see also buffer).
+    '''
+    __slots__ = ['size', 'offset', 'bands', 'attributes',
+                 '_data', '_pool', '_buffers']
 
-    def __init__(self, size, offset=None, bands=None):
+    def __init__(self, size, offset=None, bands=None, pool=None):
 
+        self._data = OrderedDict()
         self.size = size
         self.offset = offset
         self.bands = bands
         self.attributes = OrderedDict()
+        self._pool = pool
+        self._buffers = [] if pool is not None else None
+
+    def __getattr__(self, name):
+        # called for the names which are not slots or properties: datasets
+        try:
+            return object.__getattribute__(self, '_data')[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in Block.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            self._data[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self._data[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getstate__(self):
+        # the buffer pool is not shared between processes, and the derived
+        # geometry is not transferred
+        data = OrderedDict([(k, v) for (k, v) in self._data.items()
+                            if k not in DERIVED])
+        return (self.size, self.offset, self.bands, self.attributes, data)
+
+    def __setstate__(self, state):
+        (size, offset, bands, attributes, data) = state
+        self.__init__(size, offset, bands)
+        self.attributes = attributes
+        self._data.update(data)
+
+    def buffer(self, name, shape=None, dtype=None, fill=np.NaN):
+        '''
+        returns a new array of the given shape and dtype, filled with fill
+        (if not None), taken from the buffer pool of the block if any
+        (see BufferPool)
+
+        shape and dtype default to the declaration of name in DATASETS
+        (dtype defaults to float32 for the other datasets)
+        '''
+        spec = DATASETS.get(name)
+        if shape is None:
+            if spec is None:
+                raise Exception('The shape of undeclared dataset "{}" should be provided'.format(name))
+            shape = tuple(self.size)
+            if spec.spectral:
+                shape += (self.nbands,)
+        if dtype is None:
+            dtype = 'float32' if spec is None else spec.dtype
+
+        if self._pool is None:
+            A = np.empty(shape, dtype=dtype)
+            if fill is not None:
+                A.fill(fill)
+            return A
+        A = self._pool.get(name, shape, dtype, fill)
+        self._buffers.append(((name, tuple(shape), np.dtype(dtype).str), A))
+        return A
 
     def datasets(self):
         '''
         returns a list of the datasets of the block
         '''
-        return self.__dict__.keys()
+        return self._data.keys()
 
     def __getitem__(self, name):
-        return self.__dict__[name]
+        return self._data[name]
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def lookup(self, name):
+        '''
+        finds the output dataset name in the block
+
+        Returns (name, None) if name is a 2-dimensional or 3-dimensional
+        dataset of the block, (dataset, iband) if name is the band
+        bands[iband] of a 3-dimensional dataset (for example 'Rw412' for the
+        band 412 of Rw), or None if not found.
+        '''
+        x = self._data.get(name)
+        if getattr(x, 'ndim', None) in [2, 3]:
+            return (name, None)
+        for iband, b in enumerate(self.bands or []):
+            b = str(b)
+            if name.endswith(b):
+                x = self._data.get(name[:-len(b)])
+                if getattr(x, 'ndim', None) == 3:
+                    return (name[:-len(b)], iband)
+        return None
+
+    def memory(self):
+        '''
+        returns the memory used by each array of the block, in bytes
+        (OrderedDict, by decreasing size)
+        '''
+        mem = [(k, v.nbytes) for (k, v) in self._data.items()
+               if hasattr(v, 'nbytes')]
+        return OrderedDict(sorted(mem, key=lambda x: -x[1]))
+
+    def nbytes(self):
+        '''
+        returns the total memory used by the arrays of the block, in bytes
+        '''
+        return sum(self.memory().values())
+
+    def memory_report(self):
+        '''
+        returns a report of the memory used by the block (string)
+        '''
+        lines = ['{}: {:.2f} MB'.format(self, self.nbytes()/1e6)]
+        for k, n in self.memory().items():
+            x = self._data[k]
+            lines.append('    {:<16}{:>14} {:<8}{:8.2f} MB'.format(
+                k, 'x'.join([str(i) for i in x.shape]), str(x.dtype), n/1e6))
+        return '\n'.join(lines)
 
     def __str__(self):
         return 'block: size {}, offset {}'.format(self.size, self.offset)
 
+    def _derived(self, name, func):
+        '''
+        returns the derived dataset name, computed by func on first access
+        '''
+        data = self._data
+        if name not in data:
+            data[name] = func()
+        return data[name]
+
     @property
     def raa(self):
         ''' relative azimuth angle, in degrees '''
-        if '_raa' not in self.datasets():
+        def func():
             raa = self.saa - self.vaa
             raa[raa<0.] += 360
             raa[raa>360.] -= 360
             raa[raa>180.] = 360. - raa[raa>180.]
-            self._raa = raa
-        return self._raa
+            return raa
+        return self._derived('_raa', func)
 
     @property
     def mus(self):
-        if '_mus' not in self.datasets():
-            self._mus = cos(self.sza*pi/180.)
-        return self._mus
+        return self._derived('_mus', lambda: cos(self.sza*pi/180.))
 
     @property
     def air_mass(self):
-        if '_air_mass' not in self.datasets():
-            self._air_mass = 1/self.muv + 1/self.mus
-        return self._air_mass
+        return self._derived('_air_mass', lambda: 1/self.muv + 1/self.mus)
 
     @property
     def muv(self):
-        if '_muv' not in self.datasets():
-            self._muv = cos(self.vza*pi/180.)
-        return self._muv
+        return self._derived('_muv', lambda: cos(self.vza*pi/180.))
 
     @property
     def scattering_angle(self):
-        if '_scat_angle' not in self.datasets():
+        def func():
             mu_s = self.mus
             mu_v = self.muv
             phi = self.raa
             sa = -mu_s*mu_v - sqrt( (1.-mu_s*mu_s)*(1.-mu_v*mu_v) ) * cos(phi*pi/180.)
-            self._scat_angle = arccos(sa)*180./pi
-        return self._scat_angle
+            return arccos(sa)*180./pi
+        return self._derived('_scat_angle', func)
 
     @property
     def nbands(self):
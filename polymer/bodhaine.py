@@ -109,3 +109,71 @@ def rod(lam, co2=400., lat=45., z=0., P=1013.25):
     G = g(lat, z)
     return raycrs(lam, co2) * P*1e3 * Avogadro/ma(co2)/G
 
+
+
+class RayleighODTable(object):
+    """
+    Rayleigh optical depth, with the spectral dependency precomputed:
+
+        tau_ray = coef * P / g(lat, z)
+
+    where coef (one per band) only depends on the wavelength, and the surface
+    pressure and altitude dependency is shared across bands.
+
+        wav : wavelengths in nm, either per band (nbands,) or per pixel
+              (..., nbands)
+        co2 : ppm
+        lat : deg (scalar)
+
+    Example:
+        rodt = RayleighODTable([443., 865.])
+        tau_ray = rodt.tau_ray(surf_press, altitude)    # shape (..., 2)
+    """
+    def __init__(self, wav, co2=400., lat=45.):
+        wav = np.array(wav, dtype='float64')
+        if wav.ndim > 1:
+            # reduce to one wavelength per band if possible
+            w = wav.reshape(-1, wav.shape[-1])
+            if len(w) and (w == w[0]).all():
+                wav = w[0]
+        Avogadro = value('Avogadro constant')
+        self.lat = lat
+        self.coef = raycrs(wav/1000., co2) * 1e3*Avogadro/ma(co2)
+
+    @classmethod
+    def from_reference(cls, tau_ref, P0=1013.):
+        """
+        Table from reference optical depths tau_ref (per band) at pressure
+        P0, scaled by the surface pressure only (as in SeaDAS):
+
+            tau_ray = tau_ref * P / P0
+        """
+        rodt = cls.__new__(cls)
+        rodt.lat = None
+        rodt.coef = np.array(tau_ref, dtype='float64')/P0
+        return rodt
+
+    def factor(self, surf_press, altitude=0.):
+        """
+        pressure and altitude dependency of tau_ray, common to all bands
+            surf_press : hPa
+            altitude : m
+        """
+        if self.lat is None:
+            return surf_press
+        return surf_press/g(self.lat, altitude)
+
+    def band(self, iband, factor):
+        """
+        Rayleigh optical depth of band iband, from the pressure factor (see
+        method factor)
+        """
+        return self.coef[..., iband] * factor
+
+    def tau_ray(self, surf_press, altitude=0., dtype='float32'):
+        """
+        Rayleigh optical depth for all bands
+        returns an array of shape surf_press.shape + (nbands,)
+        """
+        f = np.asarray(self.factor(surf_press, altitude))
+        return (self.coef * f[..., None]).astype(dtype)
@@ -5,7 +5,13 @@ from __future__ import print_function, division, absolute_import
 from os.path import basename, join
 import numpy as np
 from itertools import product
+from fractions import Fraction
+from math import gcd, ceil
 from glob import glob
+from collections import OrderedDict
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from polymer.remote import is_url
 
 
 
@@ -19,17 +25,28 @@ class Level1(object):
     the 'with' block
 
     ARGUMENTS:
-    filename: path to level 1
+    filename: path to level 1 (OLCI and MSI products can also be zip
+        archives of the SAFE directories)
+        OLCI and MSI products, and the VIIRS, MODIS, SeaWiFS files can also
+        be given as HTTP(S) URLs, which are read with range requests (see
+        remote.py)
     sensor: sensor name
+    roi: region of interest, either as a bounding box
+        (lon_min, lat_min, lon_max, lat_max), or as a polygon [(lon, lat), ...]
+        The processing is restricted to the minimal pixel window containing
+        the roi, and to the blocks intersecting it (see Level1_base.init_roi).
+        Supported for olci, viirs, modis, seawifs, msi and landsat8.
     other kwargs are passed to the Level1_* constructor
     '''
 
-    def __init__(self, filename, sensor=None, **kwargs):
+    def __init__(self, filename, sensor=None, roi=None, **kwargs):
 
         self.sensor = sensor
         self.filename = filename
-        self.basename = basename(filename)
+        self.basename = basename(str(filename).rstrip('/'))
         self.kwargs = kwargs
+        if roi is not None:
+            self.kwargs['roi'] = roi
         self.level1 = None
 
         if sensor is None:
@@ -42,7 +59,8 @@ class Level1(object):
         if (b.startswith('MER_RR') or b.startswith('MER_FR')) and b.endswith('.N1'):
             self.sensor = 'meris'
 
-        elif (b.startswith('S3A_OL_1') or b.startswith('S3B_OL_1')) and b.endswith('.SEN3'):
+        elif ((b.startswith('S3A_OL_1') or b.startswith('S3B_OL_1'))
+              and (b.endswith('.SEN3') or b.endswith('.zip'))):
             self.sensor = 'olci'
 
         elif b.startswith('V') and '.L1C' in b:
@@ -65,6 +83,9 @@ class Level1(object):
 
 
     def detect_msi(self):
+        if self.basename.endswith('.zip') or is_url(self.filename):
+            # zipped or remote SAFE product
+            return '_MSIL1C_' in self.basename
         xmlfiles = glob(join(self.filename, '*MTD*_TL*.xml'))
         return len(xmlfiles) == 1
 
@@ -123,6 +144,18 @@ class Level1_base(object):
     Base class for Level1 objects
     '''
 
+    # buffer pool for the block arrays (see block.BufferPool), set by
+    # run_atm_corr if params.buffer_pool
+    pool = None
+
+    # print the block layout reports (see block_layout), set by run_atm_corr
+    # from params.verbose
+    verbose = False
+
+    # alignment of the windows passed to read_block (their boundaries are
+    # multiples of align in the product grid)
+    align = 1
+
     def init_shape(self, totalheight, totalwidth,
                    sline=0, eline=-1,
                    scol=0, ecol=-1):
@@ -156,29 +189,640 @@ class Level1_base(object):
         self.shape = (self.height, self.width)
 
 
-    def blocks(self, bands_read):
+    def block_tiles(self, bands_read):
+        '''
+        returns the tiling of the files to read for bands_read, as a list of
+        tile (or chunk) sizes (ty, tx) in the grid of the level1 (can be
+        fractional), or None if the level1 is not tiled
+
+        Block boundaries are aligned with these tiles (see plan_chunked_blocks)
+        '''
+        return None
+
+    def block_layout(self, bands_read, verbose=False):
+        '''
+        returns the list of (size, offset) of the blocks:
+            * if blocksize is an integer, blocks of blocksize full lines
+            * if blocksize is a tuple (ysize, xsize), 2-dimensional blocks
+
+        Block boundaries are aligned with the chunks of the datasets (see
+        block_tiles and plan_chunked_blocks)
+
+        verbose: print the layout report (see layout_report)
+        '''
+        chunks = self.block_tiles(bands_read)
+        origin = (self.sline, self.scol)
+        blocks = plan_chunked_blocks(self.height, self.width, self.blocksize,
+                                     chunks=chunks, origin=origin)
+        if chunks and verbose:
+            print(layout_report(blocks, chunks, origin=origin))
+
+        return blocks
+
+    def split_period(self, bands_read):
+        '''
+        returns the period of the rows (in the product grid) at which the
+        blocks of block_layout can be split (see schedule_blocks), or None if
+        they can be split at any row
+
+        The default keeps the block boundaries aligned with the chunks of
+        the datasets (see block_tiles).
+        '''
+        chunks = self.block_tiles(bands_read)
+        if not chunks:
+            return None
+        if isinstance(self.blocksize, int):
+            blocksize = self.blocksize
+        else:
+            blocksize = self.blocksize[0]
+        return axis_period(blocksize, [c[0] for c in chunks if c[0] <= blocksize])
+
+    def coarse_latlon(self):
+        '''
+        returns a coarse (subsampled or tie point) geolocation of the whole
+        product, as (latitude, longitude, rows, cols), where rows and cols
+        are the (increasing) positions of the samples in the product grid
+        '''
+        raise NotImplementedError(
+            'Region of interest is not supported by {}'.format(
+                self.__class__.__name__))
+
+    def init_roi(self, roi, align=1):
+        '''
+        Restrict the processing window to the region of interest roi (see
+        roi_mask), using the coarse geolocation of the product (coarse_latlon)
+
+        The window is the minimal window containing all the samples in the
+        roi and their neighbours. The roi should therefore be larger than the
+        sampling of the coarse geolocation.
+        The window boundaries are multiples of align.
+        To be called after init_shape, and before the initializations
+        depending on the window.
+        '''
+        self.roi = roi
+        if roi is None:
+            return
+
+        latitude, longitude, rows, cols = self.coarse_latlon()
+        inside = roi_mask(roi, latitude, longitude)
+        if not inside.any():
+            raise Exception('The region of interest does not intersect the product')
+
+        # extent of each sample, up to its neighbours
+        self.roi_cells = (inside,
+                          sample_cells(rows, self.totalheight),
+                          sample_cells(cols, self.totalwidth))
+        (_, (ylo, yhi), (xlo, xhi)) = self.roi_cells
+        iy = np.where(inside.any(axis=1))[0]
+        ix = np.where(inside.any(axis=0))[0]
+
+        sline = max(align*(ylo[iy[0]]//align), self.sline)
+        eline = min(align*(yhi[iy[-1]]//align + 1), self.totalheight,
+                    self.sline+self.height)
+        scol = max(align*(xlo[ix[0]]//align), self.scol)
+        ecol = min(align*(xhi[ix[-1]]//align + 1), self.totalwidth,
+                   self.scol+self.width)
+        if (eline <= sline) or (ecol <= scol):
+            raise Exception('The region of interest does not intersect the '
+                            'processing window')
+
+        self.init_shape(self.totalheight, self.totalwidth,
+                        sline=int(sline), eline=int(eline),
+                        scol=int(scol), ecol=int(ecol))
+        print('Region of interest: lines {}-{}, columns {}-{} ({}x{})'.format(
+            self.sline, self.sline+self.height, self.scol, self.scol+self.width,
+            self.height, self.width))
+
+    def roi_blocks(self, layout):
+        '''
+        returns the blocks of layout which intersect the region of interest
+        '''
+        if getattr(self, 'roi', None) is None:
+            return layout
+
+        (inside, (ylo, yhi), (xlo, xhi)) = self.roi_cells
+        blocks = []
+        for size, offset in layout:
+            y0 = self.sline + offset[0]
+            x0 = self.scol + offset[1]
+            sy = (ylo < y0+size[0]) & (yhi >= y0)
+            sx = (xlo < x0+size[1]) & (xhi >= x0)
+            if inside[np.ix_(sy, sx)].any():
+                blocks.append((size, offset))
+
+        if len(blocks) < len(layout):
+            print('Processing {} blocks out of {} intersecting the region '
+                  'of interest'.format(len(blocks), len(layout)))
+
+        return blocks
+
+    def block_valid(self, size, offset):
+        '''
+        returns the pixels of the block (size, offset) which can be processed
+        (not flagged as invalid or land by the level1, and at daytime), read
+        without the spectral bands, or None if not implemented by the level1
+
+        Level1 which implement block_valid accept the argument read_bands
+        in read_block: if False, the spectral bands are not read (and left
+        to NaN).
+        '''
+        return None
+
+    def valid_profiles(self, layout):
+        '''
+        returns, for each block of layout, the number of valid pixels in each
+        of its rows (see block_valid), or None if unknown
+        '''
+        profiles = []
+        for size, offset in layout:
+            valid = self.block_valid(size, offset)
+            profiles.append(None if valid is None else np.sum(valid, axis=1))
+        return profiles
+
+    def prescan(self, layout, profiles=None):
+        '''
+        First phase of the two-phase read: reads the valid pixels of all
+        blocks in layout (see block_valid)
 
-        nblocks_h = int(np.ceil(float(self.height)/self.blocksize[0]))
-        nblocks_w = int(np.ceil(float(self.width)/self.blocksize[1]))
+        Returns the number of valid pixels in each block (None if unknown),
+        and stores a coverage summary in self.coverage
 
-        for (iblock_h, iblock_w) in product(range(nblocks_h), range(nblocks_w)):
+        profiles: the valid pixels per row, if already read (see
+            valid_profiles)
+        '''
+        if profiles is None:
+            profiles = self.valid_profiles(layout)
+        nvalid = [None if p is None else int(np.sum(p)) for p in profiles]
+
+        known = [(n, size) for (n, (size, _)) in zip(nvalid, layout)
+                 if n is not None]
+        if not known:
+            self.coverage = None
+            return nvalid
+
+        self.coverage = OrderedDict()
+        self.coverage['blocks'] = len(known)
+        self.coverage['empty_blocks'] = sum([n == 0 for (n, _) in known])
+        self.coverage['pixels'] = sum([size[0]*size[1] for (_, size) in known])
+        self.coverage['valid_pixels'] = sum([n for (n, _) in known])
+        print('Coverage: {} valid pixels out of {} ({:.1f}%), '
+              'bands not read for {} blocks out of {}'.format(
+                  self.coverage['valid_pixels'],
+                  self.coverage['pixels'],
+                  100.*self.coverage['valid_pixels']/max(self.coverage['pixels'], 1),
+                  self.coverage['empty_blocks'],
+                  self.coverage['blocks']))
+
+        return nvalid
+
+    def blocks(self, bands_read, prescan=False, nworkers=None, split=4):
+        '''
+        Iterate over the blocks (see block_layout)
+
+        prescan: two-phase read. The valid pixels of all blocks are read
+            first (see prescan), and the spectral bands are not read for the
+            blocks without any valid pixel.
+        nworkers: cost-aware scheduling for nworkers parallel workers
+            (implies prescan). The blocks are iterated by decreasing
+            estimated cost, and the most expensive ones are split (see
+            schedule_blocks). The estimated cost is stored in
+            block.estimated_cost.
+        split: see schedule_blocks
+        '''
+        layout = self.roi_blocks(self.block_layout(bands_read, verbose=self.verbose))
+        if nworkers:
+            profiles = self.valid_profiles(layout)
+            self.prescan(layout, profiles)
+            schedule = schedule_blocks(layout, profiles, nworkers, split=split,
+                                       period=self.split_period(bands_read),
+                                       origin=self.sline)
+            print('Scheduling {} blocks ({} after splitting) for {} workers'.format(
+                len(layout), len(schedule), nworkers))
+            for size, offset, n, cost in schedule:
+                if n == 0:
+                    block = self.read_block(size, offset, bands_read, read_bands=False)
+                else:
+                    block = self.read_block(size, offset, bands_read)
+                block.estimated_cost = cost
+                yield block
+            return
+
+        if prescan:
+            nvalid = self.prescan(layout)
+        else:
+            nvalid = [None]*len(layout)
 
-            # determine block size
-            if iblock_h == nblocks_h-1:
-                ysize = self.height-(nblocks_h-1)*self.blocksize[0]
+        for (size, offset), n in zip(layout, nvalid):
+            if n == 0:
+                yield self.read_block(size, offset, bands_read, read_bands=False)
             else:
-                ysize = self.blocksize[0]
-            if iblock_w == nblocks_w-1:
-                xsize = self.width-(nblocks_w-1)*self.blocksize[1]
+                yield self.read_block(size, offset, bands_read)
+
+
+def roi_mask(roi, latitude, longitude):
+    '''
+    returns whether the pixels (latitude, longitude) are in the region of
+    interest roi:
+        * a bounding box (lon_min, lat_min, lon_max, lat_max), which may
+          cross the antimeridian (lon_min > lon_max)
+        * or a polygon [(lon, lat), ...]
+    '''
+    roi = np.array(roi, dtype='float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if roi.ndim == 1:
+            assert len(roi) == 4
+            (lon_min, lat_min, lon_max, lat_max) = roi
+            inside = (latitude >= lat_min) & (latitude <= lat_max)
+            if lon_min <= lon_max:
+                inside &= (longitude >= lon_min) & (longitude <= lon_max)
             else:
-                xsize = self.blocksize[1]
-            size = (ysize, xsize)
+                inside &= (longitude >= lon_min) | (longitude <= lon_max)
+            return inside
+
+        # even-odd rule
+        assert (roi.ndim == 2) and (roi.shape[1] == 2)
+        inside = np.zeros(np.shape(latitude), dtype='bool')
+        for i in range(len(roi)):
+            (x0, y0), (x1, y1) = roi[i-1], roi[i]
+            cross = (y0 > latitude) != (y1 > latitude)
+            x = x0 + (latitude - y0)*(x1 - x0)/(y1 - y0)
+            inside ^= cross & (longitude < x)
+
+    return inside
+
+
+def sample_cells(positions, n):
+    '''
+    returns the extent (lo, hi) of the samples at positions (increasing
+    positions along an axis of length n), up to the neighbouring samples
+    and to the edges of the axis
+    '''
+    positions = np.array(positions)
+    lo = np.append([0], positions[:-1])
+    hi = np.append(positions[1:], [n-1])
+    return lo, hi
+
+
+def lcm_fractions(values):
+    '''
+    least common multiple of a list of positive Fractions
+    '''
+    den = 1
+    for v in values:
+        den = den*v.denominator//gcd(den, v.denominator)
+    num = 1
+    for v in values:
+        n = int(v*den)
+        num = num*n//gcd(num, n)
+    return Fraction(num, den)
+
+
+def axis_period(blocksize, periods=None, align=1):
+    '''
+    returns the period of the block boundaries along one axis (see
+    plan_axis), or None if the boundaries are not constrained
+
+    The period is the common period of all tilings (so that each tile is
+    decoded exactly once per file), or, if larger than blocksize, the
+    period of the coarsest tiling smaller than blocksize. If all tiles are
+    larger than blocksize, the finest tiling is used regardless of
+    blocksize. The period is a multiple of align.
+    '''
+    if (not periods) and (align == 1):
+        return None
+    periods = [Fraction(p) for p in (periods or [])]
+    align = Fraction(align)
+    candidates = [lcm_fractions(periods)] if periods else []
+    candidates += sorted(periods, reverse=True)
+    if align > 1:
+        candidates = [lcm_fractions([p, align]) for p in candidates] or [align]
+    for p in candidates:
+        if p <= blocksize:
+            return p
+    return min(candidates)
+
+
+def plan_axis(length, origin, blocksize, periods=None, align=1):
+    '''
+    returns the list of (size, offset) of the blocks along one axis
+
+    length: number of pixels to process
+    origin: position of the first pixel in the product
+    blocksize: nominal block size
+    periods: tile sizes (one per tiled file) in the product grid
+    align: block boundaries are multiples of align in the product grid
+
+    Without tiling, blocks have a size of blocksize.
+    With tiling, block boundaries are multiples of the period given by
+    axis_period, and blocks are up to blocksize when possible.
+    '''
+    period = axis_period(blocksize, periods, align)
+    if period is None:
+        bounds = list(range(0, length, blocksize)) + [length]
+    else:
+        step = period*max(blocksize//period, 1)
+
+        # boundaries in the product grid, falling in the processed area
+        k0 = int(origin//step) + 1
+        k1 = int((origin+length)//step)
+        bounds = [0] + [int(k*step) - origin for k in range(k0, k1+1)] + [length]
+        bounds = sorted(set([b for b in bounds if 0 <= b <= length]))
 
-            # determine the block offset
-            yoffset = iblock_h * self.blocksize[0]
-            xoffset = iblock_w * self.blocksize[1]
-            offset = (yoffset, xoffset)
+    return [(b1-b0, b0) for (b0, b1) in zip(bounds[:-1], bounds[1:])]
 
-            yield self.read_block(size, offset, bands_read)
 
+def plan_blocks(height, width, blocksize, tiles=None, origin=(0, 0),
+                align=(1, 1)):
+    '''
+    returns a list of (size, offset) of the blocks covering an area of
+    (height, width) pixels
+
+    blocksize: nominal block size (ysize, xsize)
+    tiles: list of tile sizes (ty, tx) in the product grid, one per tiled
+           file, or None (see plan_axis)
+    origin: position (sline, scol) of the area in the product
+    align: block boundaries are multiples of align (ay, ax) in the product
+    '''
+    if tiles is None:
+        tiles = []
+    rows = plan_axis(height, origin[0], blocksize[0],
+                     [t[0] for t in tiles], align[0])
+    cols = plan_axis(width, origin[1], blocksize[1],
+                     [t[1] for t in tiles], align[1])
+
+    return [((ysize, xsize), (yoffset, xoffset))
+            for ((ysize, yoffset), (xsize, xoffset)) in product(rows, cols)]
+
+
+def schedule_blocks(layout, profiles, nworkers=1, split=4, min_rows=16,
+                    overhead=0.05, period=None, origin=0):
+    '''
+    returns the blocks of layout in their order of processing, as a list of
+    (size, offset, nvalid, cost), by decreasing estimated cost
+
+    The processing time of a block is dominated by the minimization of its
+    valid pixels: land, cloud-free... blocks without valid pixels are
+    almost free. Dispatching the most expensive blocks first avoids that a
+    few workers are still processing large blocks when the others are idle.
+
+    profiles: number of valid pixels in each row of each block (see
+        Level1_base.valid_profiles), or None if unknown (all pixels are
+        assumed valid)
+    nworkers: number of parallel workers
+    split: the blocks whose cost exceeds 1/(split*nworkers) of the total cost
+        are split along the rows, down to min_rows rows (0: no splitting).
+        The blocks of unknown cost are not split.
+    overhead: cost of an invalid pixel (reading, preprocessing), relative to
+        a valid pixel
+    period: the blocks are split only at the rows which are multiples of
+        period in the product grid (see Level1_base.split_period), or
+        anywhere if None. A block is not split if no such row falls at
+        least min_rows away from its edges.
+    origin: position of the first row of the layout in the product
+    nvalid is the number of valid pixels in the block (None if unknown)
+    '''
+    blocks = []
+    for (size, offset), profile in zip(layout, profiles):
+        if profile is None:
+            costs = np.zeros(size[0]) + size[1]
+        else:
+            profile = np.asarray(profile)
+            costs = profile.astype('float64')
+        blocks.append((tuple(size), tuple(offset), profile,
+                       costs + overhead*size[1]))
+
+    total = sum([costs.sum() for (_, _, _, costs) in blocks])
+    maxcost = total/(split*nworkers) if split else np.inf
+
+    def bisect(size, offset, profile, costs):
+        if ((profile is None) or (costs.sum() <= maxcost)
+                or (size[0] < 2*min_rows)):
+            return [(size, offset, profile, costs)]
+        # allowed split rows
+        rows = np.arange(min_rows, size[0]-min_rows+1)
+        if period is not None:
+            y0 = origin + offset[0]
+            k = np.arange(int(y0//period)+1, int((y0+size[0])//period)+1)
+            bounds = np.array([int(x*period) for x in k], dtype='int') - y0
+            rows = np.intersect1d(rows, bounds)
+        if len(rows) == 0:
+            return [(size, offset, profile, costs)]
+        # split at the allowed row closest to half of the cost
+        cum = np.cumsum(costs)
+        i = int(np.searchsorted(cum, cum[-1]/2.)) + 1
+        i = int(rows[np.argmin(np.abs(rows - i))])
+        return (bisect((i, size[1]), offset,
+                       None if profile is None else profile[:i], costs[:i])
+                + bisect((size[0]-i, size[1]), (offset[0]+i, offset[1]),
+                         None if profile is None else profile[i:], costs[i:]))
+
+    schedule = []
+    for b in blocks:
+        for (size, offset, profile, costs) in bisect(*b):
+            nvalid = None if profile is None else int(np.sum(profile))
+            schedule.append((size, offset, nvalid, float(costs.sum())))
+
+    return sorted(schedule, key=lambda x: -x[3])
+
+
+def chunk_shape(var, axes=(0, 1)):
+    '''
+    returns the chunk shape (cy, cx) of a netCDF4 variable or h5py dataset
+    var along its row and column axes, or None if var is not chunked
+    '''
+    if hasattr(var, 'chunking'):  # netCDF4
+        chunks = var.chunking()
+        if chunks == 'contiguous':
+            return None
+    else:  # h5py
+        chunks = var.chunks
+        if chunks is None:
+            return None
+
+    return tuple([chunks[i] for i in axes])
+
+
+def plan_chunked_blocks(height, width, blocksize, chunks=None, origin=(0, 0)):
+    '''
+    returns a list of (size, offset) of the blocks covering an area of
+    (height, width) pixels
+
+    blocksize: an integer (blocks of blocksize full lines), or a tuple
+               (ysize, xsize) for 2-dimensional blocks
+    chunks: list of chunk shapes (cy, cx) in the product grid, one per
+            dataset, or None
+    origin: position (sline, scol) of the area in the product
+
+    Along each axis, block sizes are multiples of the chunks which are not
+    larger than the blocks (see plan_axis), so that each of these chunks is
+    decompressed once. Larger chunks do not increase the size of the blocks.
+    '''
+    if chunks is None:
+        chunks = []
+
+    if isinstance(blocksize, int):
+        rows = plan_axis(height, origin[0], blocksize,
+                         [c[0] for c in chunks if c[0] <= blocksize])
+        cols = [(width, 0)]
+    else:
+        rows = plan_axis(height, origin[0], blocksize[0],
+                         [c[0] for c in chunks if c[0] <= blocksize[0]])
+        cols = plan_axis(width, origin[1], blocksize[1],
+                         [c[1] for c in chunks if c[1] <= blocksize[1]])
+
+    return [((ysize, xsize), (yoffset, xoffset))
+            for ((ysize, yoffset), (xsize, xoffset)) in product(rows, cols)]
+
+
+def chunk_passes(blocks, chunk, origin=(0, 0)):
+    '''
+    returns the average number of times that the chunks of shape
+    chunk=(cy, cx) overlapping the blocks are decompressed, when reading the
+    blocks (1 when each chunk is decompressed once)
+    '''
+    def span(start, size, c):
+        return int(start//c), int(ceil((start+size)/c))
+
+    # number of chunks read per block
+    nread = 0
+    for ((ysize, xsize), (yoffset, xoffset)) in blocks:
+        (r0, r1) = span(origin[0]+yoffset, ysize, chunk[0])
+        (c0, c1) = span(origin[1]+xoffset, xsize, chunk[1])
+        nread += (r1-r0)*(c1-c0)
+
+    # number of chunks in the area
+    height = max([yoffset+ysize for ((ysize, _), (yoffset, _)) in blocks])
+    width = max([xoffset+xsize for ((_, xsize), (_, xoffset)) in blocks])
+    (r0, r1) = span(origin[0], height, chunk[0])
+    (c0, c1) = span(origin[1], width, chunk[1])
+
+    return nread/((r1-r0)*(c1-c0))
+
+
+def layout_report(blocks, chunks, origin=(0, 0)):
+    '''
+    returns a description of the block layout, and the number of
+    decompression passes for each chunk shape (see chunk_passes)
+    '''
+    sizes = set([size for (size, _) in blocks])
+    ysize = max([s[0] for s in sizes])
+    xsize = max([s[1] for s in sizes])
+    report = '{} blocks of up to {}x{} pixels'.format(len(blocks), ysize, xsize)
+    for chunk in sorted(set([tuple(c) for c in chunks])):
+        report += ', chunks {}x{}: {:.2f} pass(es)'.format(
+            chunk[0], chunk[1], chunk_passes(blocks, chunk, origin=origin))
+
+    return report
+
+
+def detector_table(columns, coef=1.):
+    '''
+    returns a dense float32 table (n_detectors, n_bands) of a detector
+    dependent quantity (solar irradiance, detector wavelength...), built once
+    per product
+
+    columns: list of the per-detector arrays, one per band (or 2-dimensional
+        array (n_bands, n_detectors))
+    coef: multiplicative coefficient (such as the sun-earth distance
+        coefficient)
+    '''
+    return (np.stack([np.asarray(c) for c in columns], axis=1)*coef).astype('float32')
+
+
+def gather_detectors(table, detector_index, columns, out=None):
+    '''
+    returns the values of table (see detector_table) at each pixel of
+    detector_index, for the list of band indices columns, as a float32 array
+    (ysize, xsize, len(columns)) filled in a single gather
+
+    The values of the invalid detector indices (negative, such as the fill
+    value -1, or beyond the number of detectors) are NaN.
+
+    out: optional output array (for example from Block.buffer)
+    '''
+    detector_index = np.asarray(detector_index)
+    if out is None:
+        out = np.empty(detector_index.shape + (len(columns),), dtype='float32')
+    np.take(table[:, columns], detector_index, axis=0, out=out, mode='clip')
+    invalid = (detector_index < 0) | (detector_index >= table.shape[0])
+    if invalid.any():
+        out[invalid] = np.NaN
+    return out
+
+
+class ConcurrentReader(object):
+    '''
+    Reads the datasets of a block concurrently in a thread pool
+
+    threads: number of threads (None: one per dataset, 1: no threading)
+
+    The netcdf and HDF5 libraries are not thread-safe: all calls to these
+    libraries are serialized through the lock, so that the work done outside
+    of it (scaling, conversions, copy to the block) runs concurrently.
+    '''
+    def __init__(self, threads=None):
+        self.threads = threads
+        self.executor = None
+        self.lock = Lock()
+
+    def read_nc(self, var, rows, cols):
+        '''
+        returns var[rows, cols] for a netCDF4 variable var
+
+        When masking is disabled, the raw data is read under the lock, and
+        scale_factor and add_offset are applied outside of it, like netCDF4.
+        '''
+        with self.lock:
+            attrs = dict([(k, var.getncattr(k)) for k in var.ncattrs()])
+            split = var.scale and (not var.mask) and ('_Unsigned' not in attrs)
+            if split:
+                var.set_auto_scale(False)
+            try:
+                data = var[rows, cols]
+            finally:
+                if split:
+                    var.set_auto_scale(True)
+
+        if split:
+            if 'scale_factor' in attrs:
+                data = data*attrs['scale_factor']
+            if 'add_offset' in attrs:
+                data = data + attrs['add_offset']
+
+        return data
+
+    def map(self, func, items):
+        '''
+        returns the list [func(x) for x in items], evaluated concurrently
+        '''
+        if (self.threads == 1) or (len(items) < 2):
+            return [func(x) for x in items]
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads or len(items))
+        return list(self.executor.map(func, items))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def band_runs(indices):
+    '''
+    groups indices (distinct integers, in any order) in runs of consecutive
+    values, to read the bands of a cube in contiguous hyperslabs
+
+    returns a list of (start, stop, positions), where positions are the
+    positions in indices of the values start, ..., stop-1
+    '''
+    position = dict([(int(i), p) for (p, i) in enumerate(indices)])
+    runs = []
+    for i in sorted(position):
+        if runs and (runs[-1][1] == i):
+            runs[-1][1] += 1
+            runs[-1][2].append(position[i])
+        else:
+            runs.append([i, i+1, [position[i]]])
 
+    return [tuple(r) for r in runs]
@@ -5,13 +5,14 @@ from __future__ import print_function, division, absolute_import
 import numpy as np
 import pandas as pd
 from polymer.block import Block
-from datetime import datetime
-from os.path import join, dirname
+from os.path import join, dirname, splitext
 from polymer.level1_meris import BANDS_MERIS
 from polymer.common import L2FLAGS
 from polymer.utils import raiseflag, coeff_sun_earth_distance
+from polymer.level1 import detector_table, gather_detectors
 from polymer.level1_meris import central_wavelength_meris
 from polymer.level1_nasa import tau_r_seadas_modis, tau_r_seadas_seawifs, tau_r_seadas_viirsn, tau_r_seadas_viirsj1
+from polymer.bodhaine import RayleighODTable
 
 # bands stored in the ASCII extractions
 BANDS_MODIS = [412,443,469,488,531,547,555,645,667,678,748,859,869,1240]
@@ -60,6 +61,13 @@ class Level1_ASCII(object):
                        'RTOA': lambda i, b: 'Rtoa_{}'.format(b)    # will translate to {412: 'Rtoa_412', ...}
                        'RTOA': lambda i, b: 'Rtoa_{02d}'.format(i+1)  # will translate to {412: 'Rtoa_01', ...}
         * ozone_unit: 'DU' (default), 'kg/m2', 'cm.atm'
+        * streaming: if True, the csv file is read by chunks of
+          blocksize*square lines, one per block, instead of being loaded in
+          memory (self.csv then contains only the current block)
+        * fmt: format of the file: 'csv', 'parquet' or 'feather' (requires
+          pyarrow). Default: detected from the file extension.
+          With parquet and feather, only the required columns are read, and
+          in streaming mode, parquet row groups are read incrementally.
     '''
     def __init__(self, filename, square=1, blocksize=100,
                  additional_headers=[], dir_smile=None,
@@ -70,7 +78,7 @@ class Level1_ASCII(object):
                  na_values=None,
                  ozone_unit='DU',
                  datetime_fmt='%Y%m%dT%H%M%SZ', verbose=True,
-                 sep=';', skiprows=0):
+                 sep=';', skiprows=0, streaming=False, fmt=None):
 
         self.sensor = sensor
         self.filename = filename
@@ -80,6 +88,15 @@ class Level1_ASCII(object):
         self.wind_module = wind_module
         self.verbose = verbose
         self.ozone_unit = ozone_unit
+        self.datetime_fmt = datetime_fmt
+        self.streaming = streaming
+        if fmt is None:
+            fmt = {'.parquet': 'parquet',
+                   '.feather': 'feather',
+                   '.arrow': 'feather',
+                   }.get(splitext(filename)[1].lower(), 'csv')
+        assert fmt in ['csv', 'parquet', 'feather']
+        self.fmt = fmt
         assert ozone_unit in ['DU', 'kg/m2', 'cm.atm']
 
         if BANDS is None:
@@ -110,6 +127,12 @@ class Level1_ASCII(object):
                                           enumerate(BANDS)))
             self.wav_band_names = dict(map(lambda b: (b[1], 'lam_band{:d}'.format(b[0])),
                                            enumerate(BANDS)))
+
+            # dense (detector, band) tables of the solar irradiance and of the
+            # detector wavelength
+            self.table_bands = list(BANDS)
+            self.F0_table = detector_table([self.F0[self.F0_band_names[b]] for b in BANDS])
+            self.wav_table = detector_table([self.detector_wavelength[self.wav_band_names[b]] for b in BANDS])
         elif (sensor == 'OLCI') or (sensor in ['MERIS'] and 'F0' in self.headers) :
             """self.F0_band_names = dict(map(lambda b: (b[1], 'F0_{:02d}'.format(b[0]+1)),
                                           enumerate(BANDS)))
@@ -156,16 +179,22 @@ class Level1_ASCII(object):
 
         columns += additional_headers
         columns += self.toa_band_names.values()
+        self.columns = columns
+        self.read_csv_kwargs = dict(sep=sep,
+                                    usecols=columns,
+                                    skiprows=skiprows,
+                                    na_values=na_values)
         if self.verbose:
-            print('Reading from CSV file "{}"...'.format(filename))
+            print('Reading from {} file "{}"...'.format(fmt, filename))
             print('{} columns: {}'.format(len(columns), str(columns)))
-        self.csv = pd.read_csv(filename,
-                sep=sep,
-                usecols = columns,
-                skiprows=skiprows,
-                na_values=na_values,
-                )
-        nrows = self.csv.shape[0]
+        if streaming:
+            nrows = self.count_rows()
+            self.csv = self.read_table(nrows=1)
+        else:
+            self.csv = self.read_table()
+            nrows = self.csv.shape[0]
+        self.jday, self.month = self.parse_dates(self.csv)
+        self.row0 = 0   # first line of self.csv in the file
         if self.verbose:
             print('Done (file has {} lines)'.format(nrows))
         assert nrows % square == 0
@@ -176,7 +205,104 @@ class Level1_ASCII(object):
         if self.verbose:
             print('Shape is', self.shape)
 
-        self.dates = [datetime.strptime(x, datetime_fmt) for x in self.csv[self.headers['DATETIME']]]
+        if sensor == 'GENERIC':
+            # central wavelength: from the first line
+            self.cwavelen = dict([(b, self.csv[name].values[0])
+                                  for (b, name) in self.wav_band_names.items()])
+
+    def read_table(self, nrows=None):
+        '''
+        returns the required columns of the file (or of its nrows first
+        lines) as a DataFrame
+        '''
+        if self.fmt == 'csv':
+            return pd.read_csv(self.filename, nrows=nrows,
+                               **self.read_csv_kwargs)
+        elif self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            if nrows is None:
+                table = pq.read_table(self.filename, columns=self.columns)
+            else:
+                pf = pq.ParquetFile(self.filename)
+                table = next(pf.iter_batches(batch_size=nrows,
+                                             columns=self.columns))
+            return table.to_pandas()
+        else:
+            import pyarrow.feather as feather
+            table = feather.read_table(self.filename, columns=self.columns,
+                                       memory_map=True)
+            if nrows is not None:
+                table = table.slice(0, nrows)
+            return table.to_pandas()
+
+    def count_rows(self):
+        '''
+        returns the number of lines in the file
+        '''
+        if self.fmt == 'csv':
+            # read only the first column
+            nrows = 0
+            for chunk in pd.read_csv(self.filename,
+                                     sep=self.read_csv_kwargs['sep'],
+                                     usecols=self.columns[:1],
+                                     skiprows=self.read_csv_kwargs['skiprows'],
+                                     chunksize=100000):
+                nrows += len(chunk)
+            return nrows
+        elif self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetFile(self.filename).metadata.num_rows
+        else:
+            import pyarrow.feather as feather
+            return feather.read_table(self.filename, columns=self.columns[:1],
+                                      memory_map=True).num_rows
+
+    def read_chunks(self, chunksize):
+        '''
+        iterates over the required columns of the file, by DataFrames of
+        chunksize lines (the last one may be shorter)
+        '''
+        if self.fmt == 'csv':
+            for chunk in pd.read_csv(self.filename, chunksize=chunksize,
+                                     **self.read_csv_kwargs):
+                yield chunk
+
+        elif self.fmt == 'parquet':
+            # record batches do not span row groups: group them by chunksize
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pf = pq.ParquetFile(self.filename)
+            batches = []
+            n = 0
+            for batch in pf.iter_batches(batch_size=chunksize,
+                                         columns=self.columns):
+                batches.append(batch)
+                n += batch.num_rows
+                if n >= chunksize:
+                    table = pa.Table.from_batches(batches)
+                    yield table.slice(0, chunksize).to_pandas()
+                    batches = table.slice(chunksize).to_batches()
+                    n -= chunksize
+            if n:
+                yield pa.Table.from_batches(batches).to_pandas()
+
+        else:
+            import pyarrow.feather as feather
+            table = feather.read_table(self.filename, columns=self.columns,
+                                       memory_map=True)
+            for start in range(0, table.num_rows, chunksize):
+                yield table.slice(start, chunksize).to_pandas()
+
+    def parse_dates(self, csv):
+        '''
+        returns the day of year and month of each line of csv, as integer
+        arrays (jday, month)
+        '''
+        dates = csv[self.headers['DATETIME']]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, format=self.datetime_fmt)
+        return (dates.dt.dayofyear.values.astype('int'),
+                dates.dt.month.values.astype('int'))
 
     def get_field(self, fname, sl, size):
         cname = self.headers[fname]
@@ -189,7 +315,7 @@ class Level1_ASCII(object):
 
         # initialize block
         block = Block(offset=offset, size=size, bands=bands)
-        sl = slice(offset[0]*xsize, (offset[0]+ysize)*xsize)
+        sl = slice(offset[0]*xsize - self.row0, (offset[0]+ysize)*xsize - self.row0)
         block.wavelen = np.zeros((ysize,xsize,nbands), dtype='float32') + np.NaN
         block.cwavelen = np.zeros(nbands, dtype='float32') + np.NaN
 
@@ -228,23 +354,21 @@ class Level1_ASCII(object):
         else:
             raise Exception('Invalid TOAR type "{}"'.format(self.TOAR))
 
-        block.jday = np.array([x.timetuple().tm_yday for x in self.dates[sl]]).reshape(size)
-        block.month = np.array([x.timetuple().tm_mon for x in self.dates[sl]]).reshape(size)
+        block.jday = self.jday[sl].reshape(size)
+        block.month = self.month[sl].reshape(size)
 
         # detector index and spectral information
         if self.sensor in ['MERIS', 'MERIS_FR', 'MERIS_RR'] and (not 'F0' in self.headers):
             di = self.csv[self.headers['DETECTOR_INDEX']][sl].values.reshape(size).astype('int')
 
-            # F0
-            coef = coeff_sun_earth_distance(block.jday)
-            block.F0 = np.zeros((ysize, xsize, nbands)) + np.NaN
-            for iband, band in enumerate(bands):
-                block.F0[:,:,iband] = self.F0[self.F0_band_names[band]][di]
-                block.F0[:,:,iband] *= coef
+            # F0 (the sun-earth distance coefficient depends on the pixel)
+            columns = [self.table_bands.index(band) for band in bands]
+            block.F0 = gather_detectors(self.F0_table, di, columns)
+            block.F0 *= coeff_sun_earth_distance(block.jday)[:,:,None]
 
             # detector wavelength
+            block.wavelen = gather_detectors(self.wav_table, di, columns)
             for iband, band in enumerate(bands):
-                block.wavelen[:,:,iband] = self.detector_wavelength[self.wav_band_names[band]][di]
                 block.cwavelen[iband] = central_wavelength_meris[band]
         elif (self.sensor in ['OLCI']) or (self.sensor in ['MERIS'] and 'F0' in self.headers):
             block.F0 = np.zeros((ysize, xsize, nbands)) + np.NaN
@@ -267,11 +391,14 @@ class Level1_ASCII(object):
             for iband, band in enumerate(bands):
                 name = self.wav_band_names[band]
                 block.wavelen[:,:,iband] = self.csv[name][sl].values.reshape(size)
-                block.cwavelen[iband] = self.csv[name].values[0]
+                block.cwavelen[iband] = self.cwavelen[band]
 
         block.bitmask = np.zeros(size, dtype='uint16')
         invalid = np.isnan(block.raa)
         invalid |= TOA[:,:,0] < 0
+        if 'F0' in block:
+            # invalid detector index (see gather_detectors)
+            invalid |= np.isnan(block.F0).any(axis=2)
         raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], invalid)
 
         # ozone
@@ -308,12 +435,11 @@ class Level1_ASCII(object):
                     'MODIS': tau_r_seadas_modis,
                     'SeaWiFS': tau_r_seadas_seawifs,
                     'VIIRS': tau_r_seadas_viirsn,
-                    'VIIRSN': tau_r_seadas_virrsn,
+                    'VIIRSN': tau_r_seadas_viirsn,
                     'VIIRSJ1': tau_r_seadas_viirsj1
                 }[self.sensor]
-            block.tau_ray = np.zeros((ysize, xsize, nbands), dtype='float32') + np.NaN
-            for iband, band in enumerate(bands):
-                block.tau_ray[:,:,iband] = tau_r_seadas[band] * block.surf_press/1013.
+            rodt = RayleighODTable.from_reference([tau_r_seadas[b] for b in bands])
+            block.tau_ray = rodt.tau_ray(block.surf_press)
 
         # Add detector index to output
         block.detector_index = self.csv[self.headers['DETECTOR_INDEX']][sl].values.reshape(size).astype(np.int16)
@@ -322,6 +448,10 @@ class Level1_ASCII(object):
 
     def blocks(self, bands_read):
 
+        if self.streaming:
+            # one chunk of the file per block
+            chunks = self.read_chunks(self.blocksize*self.width)
+
         nblocks = int(np.ceil(float(self.height)/self.blocksize))
         for iblock in range(nblocks):
 
@@ -338,6 +468,12 @@ class Level1_ASCII(object):
             yoffset = iblock*self.blocksize
             offset = (yoffset, xoffset)
 
+            if self.streaming:
+                self.csv = next(chunks)
+                self.jday, self.month = self.parse_dates(self.csv)
+                self.row0 = yoffset*xsize
+                assert len(self.csv) == ysize*xsize
+
             yield self.read_block(size, offset, bands_read)
 
 
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division, absolute_import
-from polymer.level1 import Level1_base
+from polymer.level1 import Level1_base, chunk_shape, band_runs
 from polymer.level1_nasa import filled
 from polymer.block import Block
 from polymer.hico import bands_hico, wav_hico, F0_hico
@@ -18,7 +18,7 @@ from polymer.common import L2FLAGS
 from os.path import basename, join, dirname
 from collections import OrderedDict
 
-class Level1_HICO(object):
+class Level1_HICO(Level1_base):
     """
     HICO Level1 reader
 
@@ -26,6 +26,9 @@ class Level1_HICO(object):
         * None: no land mask [default]
         * A GSW instance (see gsw.py)
             Example: landmask=GSW(directory='/path/to/gsw_data/')
+
+    blocksize: number of lines per block, or (ysize, xsize). Blocks are
+        aligned with the chunks of the datasets (see Level1_base.blocks)
     """
     def __init__(self, filename, blocksize=200,
                  sline=0, eline=-1, scol=0, ecol=-1,
@@ -117,10 +120,11 @@ class Level1_HICO(object):
         assert len(self.Lt.getncattr('wavelengths')) == len(bands_hico)
         ibands = np.array([bands_hico.index(b) for b in bands])
 
-        # read TOA
-        block.Ltoa = np.zeros(size3) + np.NaN
+        # read TOA: only the bands to process, by runs of consecutive bands
+        block.Ltoa = np.zeros(size3, dtype='float32') + np.NaN
         assert self.Lt.getncattr('units') == 'W/m^2/micrometer/sr'
-        block.Ltoa[:] = filled(self.Lt[SY, SX, ibands])
+        for (start, stop, positions) in band_runs(ibands):
+            block.Ltoa[:,:,positions] = filled(self.Lt[SY, SX, start:stop])
         block.Ltoa /= 10.  # convert W/m^2/um/sr -> mW/cm^2/um/sr
 
         # read bitmask
@@ -156,23 +160,18 @@ class Level1_HICO(object):
 
 
 
-    def blocks(self, bands_read):
-        nblocks = int(np.ceil(float(self.height)/self.blocksize))
-        for iblock in range(nblocks):
-            # determine block size
-            xsize = self.width
-            if iblock == nblocks-1:
-                ysize = self.height-(nblocks-1)*self.blocksize
-            else:
-                ysize = self.blocksize
-            size = (ysize, xsize)
-
-            # determine the block offset
-            xoffset = 0
-            yoffset = iblock*self.blocksize
-            offset = (yoffset, xoffset)
+    def block_tiles(self, bands_read):
+        '''
+        returns the chunk shapes of the datasets read in each block
+        '''
+        nav = self.nc.groups['navigation']
+        datasets = [nav[x] for x in ['latitudes', 'longitudes',
+                                     'solar_zenith', 'sensor_zenith',
+                                     'solar_azimuth', 'sensor_azimuth']]
+        chunks = [chunk_shape(x) for x in datasets]
+        chunks.append(chunk_shape(self.Lt, axes=(0, 1)))
 
-            yield self.read_block(size, offset, bands_read)
+        return [c for c in chunks if c is not None]
 
     def attributes(self, datefmt):
         attr = OrderedDict()
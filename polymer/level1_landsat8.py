@@ -51,13 +51,20 @@ class Level1_OLI(Level1_base):
 
         l8_angles is available at:
         https://www.usgs.gov/land-resources/nli/landsat/solar-illumination-and-sensor-viewing-angle-coefficient-files
+
+    blocksize: (ysize, xsize), or number of lines per block. Blocks are
+        aligned with the tiles of the GeoTIFF files (see Level1_base.blocks)
+
+    roi: region of interest, (lon_min, lat_min, lon_max, lat_max) or
+        [(lon, lat), ...] (see Level1_base.init_roi)
     '''
     def __init__(self, dirname,
                  sline=0, eline=-1,
                  scol=0, ecol=-1, ancillary=None,
                  altitude=0.,
                  landmask=None,
-                 blocksize=(500, 400)):
+                 blocksize=(500, 400),
+                 roi=None):
         # https://stackoverflow.com/questions/2922532
         self.sensor = 'OLI'
         self.blocksize = blocksize
@@ -65,6 +72,7 @@ class Level1_OLI(Level1_base):
         self.dirname = dirname
         self.filename = dirname
         self.landmask = landmask
+        self.datasets = {}
         if ancillary is None:
             self.ancillary = Ancillary_NASA()
         else:
@@ -140,6 +148,9 @@ class Level1_OLI(Level1_base):
         Ymin = gt[3] + Y0*gt[5]
         Ymax = gt[3] + Y1*gt[5]
 
+        self.geotransform = gt
+        self.init_roi(roi)
+
         XY = np.array(np.meshgrid(
             np.linspace(Xmin, Xmax, self.totalwidth)[self.scol:self.scol+self.width],
             np.linspace(Ymin, Ymax, self.totalheight)[self.sline:self.sline+self.height],
@@ -174,6 +185,22 @@ class Level1_OLI(Level1_base):
         self.ancillary_files.update(self.wind_speed.filename)
         self.ancillary_files.update(self.surf_press.filename)
 
+    def coarse_latlon(self, step=64):
+        '''
+        returns the geolocation of the product subsampled by step (see
+        Level1_base.coarse_latlon)
+        '''
+        gt = self.geotransform
+        rows = np.arange(0, self.totalheight, step)
+        cols = np.arange(0, self.totalwidth, step)
+        XY = np.moveaxis(np.array(np.meshgrid(gt[0] + cols*gt[1],
+                                              gt[3] + rows*gt[5])), 0, -1)
+        latlon = np.array(self.transform.TransformPoints(XY.reshape((-1, 2))))
+
+        return (latlon[:,1].reshape((len(rows), len(cols))),
+                latlon[:,0].reshape((len(rows), len(cols))),
+                rows, cols)
+
     def init_meta(self):
         # read metadata
         files_mtl = glob(os.path.join(self.dirname, 'LC*_MTL.txt'))
@@ -237,17 +264,52 @@ class Level1_OLI(Level1_base):
 
 
     def init_geometry(self):
-        # read sensor angles
+        # angles files are memory-mapped (int16, in hundredths of degrees),
+        # and scaled in each block (see read_angle)
+
+        # sensor angles
         filenames_sensor = glob(join(self.dirname, 'LC*_sensor_B01.img'))
         assert len(filenames_sensor) == 1, 'Error, sensor angles file missing ({})'.format(str(filenames_sensor))
         filename_sensor = filenames_sensor[0]
-        self.data_sensor = np.fromfile(filename_sensor, dtype='int16').astype('float32').reshape((2, self.totalheight, self.totalwidth))/100.
+        self.data_sensor = np.memmap(filename_sensor, dtype='int16', mode='r',
+                                     shape=(2, self.totalheight, self.totalwidth))
 
-        # read solar angles
+        # solar angles
         filenames_solar = glob(join(self.dirname, 'LC*_solar_B01.img'))
         assert len(filenames_solar) == 1, 'Error, solar angles file missing ({})'.format(str(filenames_solar))
         filename_solar = filenames_solar[0]
-        self.data_solar = np.fromfile(filename_solar, dtype='int16').astype('float32').reshape((2, self.totalheight, self.totalwidth))/100.
+        self.data_solar = np.memmap(filename_solar, dtype='int16', mode='r',
+                                    shape=(2, self.totalheight, self.totalwidth))
+
+    def read_angle(self, data, i, SY, SX):
+        '''
+        returns the angle i (0: azimuth, 1: zenith) of an angles file in
+        degrees, in the window (SY, SX)
+        '''
+        return data[i, SY, SX].astype('float32')/100.
+
+    def get_dataset(self, band):
+        '''
+        returns the (cached) gdal dataset of band
+        '''
+        if band not in self.datasets:
+            filename = os.path.join(
+                    self.dirname,
+                    self.attr_product['FILE_NAME_BAND_{}'.format(band_index[band])])
+            self.datasets[band] = gdal.Open(filename)
+
+        return self.datasets[band]
+
+    def block_tiles(self, bands_read):
+        '''
+        returns the tile (or strip) sizes of the GeoTIFF files of bands_read
+        '''
+        tiles = []
+        for band in bands_read:
+            (tx, ty) = self.get_dataset(band).GetRasterBand(1).GetBlockSize()
+            tiles.append((ty, tx))
+
+        return tiles
 
 
     def init_landmask(self):
@@ -271,10 +333,10 @@ class Level1_OLI(Level1_base):
         block.longitude = self.lon[offset[0]:offset[0]+ysize, offset[1]:offset[1]+xsize]
 
         # geometry
-        block.sza = self.data_solar[1, SY, SX]
-        block.vza = self.data_sensor[1,SY, SX]
-        block.saa = self.data_solar[0, SY, SX]
-        block.vaa = self.data_sensor[0,SY, SX]
+        block.sza = self.read_angle(self.data_solar, 1, SY, SX)
+        block.vza = self.read_angle(self.data_sensor, 1, SY, SX)
+        block.saa = self.read_angle(self.data_solar, 0, SY, SX)
+        block.vaa = self.read_angle(self.data_sensor, 0, SY, SX)
 
         # TOA reflectance
         block.Rtoa = np.zeros((ysize,xsize,nbands)) + np.NaN
@@ -282,13 +344,9 @@ class Level1_OLI(Level1_base):
             M = self.attr_rescaling['REFLECTANCE_MULT_BAND_{}'.format(band_index[band])]
             A = self.attr_rescaling['REFLECTANCE_ADD_BAND_{}'.format(band_index[band])]
 
-            filename = os.path.join(
-                    self.dirname,
-                    self.attr_product['FILE_NAME_BAND_{}'.format(band_index[band])])
-            dset = gdal.Open(filename)
-            band = dset.GetRasterBand(1)
-            data = band.ReadAsArray(xoff=self.scol+xoffset, yoff=self.sline+yoffset,
-                                    win_xsize=xsize, win_ysize=ysize)
+            raster = self.get_dataset(band).GetRasterBand(1)
+            data = raster.ReadAsArray(xoff=self.scol+xoffset, yoff=self.sline+yoffset,
+                                      win_xsize=xsize, win_ysize=ysize)
             block.Rtoa[:,:,iband] = (M*data + A)/np.cos(np.radians(block.sza))
             block.Rtoa[:,:,iband][data == 0] = np.NaN
 
@@ -345,4 +403,5 @@ class Level1_OLI(Level1_base):
         return self
 
     def __exit__(self, *args):
-        pass
+        # close the gdal datasets
+        self.datasets = {}
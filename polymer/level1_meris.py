@@ -10,7 +10,7 @@ from polymer.common import L2FLAGS
 from os.path import basename, join, dirname
 from collections import OrderedDict
 from polymer.utils import raiseflag, coeff_sun_earth_distance
-from polymer.level1 import Level1_base
+from polymer.level1 import Level1_base, detector_table, gather_detectors
 
 BANDS_MERIS = [412, 443, 490, 510, 560,
                620, 665, 681, 709, 754,
@@ -161,6 +161,12 @@ class Level1_MERIS_ENVISAT(Level1_base):
         self.dstop = self.read_date('SENSING_STOP')
         self.date = self.dstart + (self.dstop - self.dstart)//2
 
+        # dense (detector, band) tables of the solar irradiance (corrected for
+        # the sun-earth distance) and of the detector wavelength
+        coef = coeff_sun_earth_distance(self.date.timetuple().tm_yday)
+        self.F0_table = detector_table([self.F0[self.F0_band_names[b]] for b in BANDS_MERIS], coef)
+        self.wav_table = detector_table([self.detector_wavelength[self.wav_band_names[b]] for b in BANDS_MERIS])
+
         print('Opened "{}", ({}x{})'.format(filename, self.width, self.height))
 
         # ancillary data initialization
@@ -247,7 +253,7 @@ class Level1_MERIS_ENVISAT(Level1_base):
         nbands = len(bands)
 
         # initialize block
-        block = Block(offset=offset, size=size, bands=bands)
+        block = Block(offset=offset, size=size, bands=bands, pool=self.pool)
 
         block.latitude  = self.read_band('latitude',  size, offset)
         block.longitude = self.read_band('longitude', size, offset)
@@ -261,22 +267,19 @@ class Level1_MERIS_ENVISAT(Level1_base):
         # read detector index
         block.detector_index = self.read_band('detector_index', size, offset)
 
-        # get F0 for each band
-        block.F0 = np.zeros((ysize, xsize, nbands)) + np.NaN
-        for iband, band in enumerate(bands):
-            block.F0[:,:,iband] = self.F0[self.F0_band_names[band]][block.detector_index]
-        coef = coeff_sun_earth_distance(self.date.timetuple().tm_yday)
-        block.F0 *= coef
-
-        # calculate detector wavelength for each band
-        block.wavelen = np.zeros((ysize, xsize, nbands), dtype='float32') + np.NaN
+        # get F0 and detector wavelength for each band
+        columns = [BANDS_MERIS.index(b) for b in bands]
+        size3 = (ysize, xsize, nbands)
+        block.F0 = gather_detectors(self.F0_table, block.detector_index, columns,
+                                    out=block.buffer('F0', size3, fill=None))
+        block.wavelen = gather_detectors(self.wav_table, block.detector_index, columns,
+                                         out=block.buffer('wavelen', size3, fill=None))
         block.cwavelen = np.zeros(nbands, dtype='float32') + np.NaN
         for iband, band in enumerate(bands):
-            block.wavelen[:,:,iband] = self.detector_wavelength[self.wav_band_names[band]][block.detector_index]
             block.cwavelen[iband] = central_wavelength_meris[band]
 
         # read TOA
-        Ltoa = np.zeros((ysize,xsize,nbands)) + np.NaN
+        Ltoa = block.buffer('Ltoa', size3, dtype='float64')
         for iband, band in enumerate(bands):
             Ltoa_ = self.read_band(self.band_names[band], size, offset)
             Ltoa[:,:,iband] = Ltoa_[:,:]
@@ -333,6 +336,8 @@ class Level1_MERIS_ENVISAT(Level1_base):
         raiseflag(block.bitmask, L2FLAGS['L1_INVALID'],
                   self.read_bitmask(size, offset,
                                     '(l1_flags.INVALID) OR (l1_flags.SUSPECT) OR (l1_flags.COSMETIC)') != 0)
+        # invalid detector index (see gather_detectors)
+        raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], np.isnan(block.F0).any(axis=2))
 
         return block
 
@@ -6,18 +6,25 @@ from collections import OrderedDict
 from pathlib import Path
 from glymur import Jp2k
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from math import gcd
 from lxml import objectify
 from os.path import join, dirname, exists
 from datetime import datetime
 import numpy as np
 from polymer.block import Block
-from polymer.utils import rectBivariateSpline
+from polymer.utils import SplineGrid
 import pyproj
 import pandas as pd
 from polymer.ancillary import Ancillary_NASA
 from polymer.common import L2FLAGS
-from polymer.level1 import Level1_base
+from polymer.level1 import Level1_base, plan_blocks, axis_period, layout_report
+from polymer.archive import ZipProduct, is_zip
+from polymer.remote import RemoteProduct, is_url
+import os
 from polymer.utils import raiseflag
+from polymer.bodhaine import RayleighODTable
 import xarray as xr
 
 '''
@@ -72,6 +79,9 @@ class Level1_MSI(Level1_base):
                  srf_file=None,
                  use_srf=True,
                  add_noise=None,
+                 decode_threads=None,
+                 jp2_reduce=False,
+                 roi=None,
                  ):
         '''
         Sentinel-2 MSI Level1 reader
@@ -81,6 +91,17 @@ class Level1_MSI(Level1_base):
             (as downloaded on https://scihub.copernicus.eu/)
         * L1C_T51RTQ_A010954_20170728T024856/
             (as downloaded with Sentinelhub: https://github.com/sentinel-hub/sentinelhub-py)
+        * S2A_MSIL1C_20160318T145513_N0201_R039_T19LDC_20160318T232756.zip
+            (zipped SAFE product, read without extracting it: the xml files
+            are read from the archive, and only the jpeg2000 files of the
+            bands which are read are extracted to a temporary directory)
+        * https://server/bucket/S2A_MSIL1C_20160318T145513_N0201_R039_T19LDC_20160318T232756.SAFE
+            (remote SAFE product, listed by its manifest.safe: the xml files
+            are read with range requests, and only the jpeg2000 files of the
+            bands which are read are downloaded to a temporary directory)
+
+        blocksize: number of lines per block, or tuple (ysize, xsize) for
+            2-dimensional blocks aligned with the jpeg2000 tiles
 
         resolution: 60, 20 or 10 (in m)
 
@@ -113,18 +134,44 @@ class Level1_MSI(Level1_base):
         use_srf: whether to calculate the bands central wavelengths from the SRF or to use fixed ones
 
         add_noise: function (band, reflectance, sza) -> stdev_reflectance
+
+        decode_threads: number of threads for decoding the bands concurrently
+            (None: one per band, 1: no threading)
+
+        roi: region of interest, (lon_min, lat_min, lon_max, lat_max) or
+            [(lon, lat), ...] (see Level1_base.init_roi). The window is
+            aligned on the 60m grid.
+
+        jp2_reduce: when reading a band at a lower resolution than its native
+            resolution, use the jpeg2000 resolution levels to decode it
+            directly at a reduced resolution (by power of 2 factors), instead
+            of decoding the full resolution and averaging.
+            Faster, but the wavelet low-pass filter differs slightly from the
+            average of the full resolution pixels.
         '''
         self.sensor = 'MSI'
-        dirname = Path(dirname).resolve()
-        if list(dirname.glob('GRANULE')):
-            granules = list((dirname/'GRANULE').glob('*'))
+        if is_zip(dirname):
+            self.archive = ZipProduct(dirname)
+            dirname = self.archive.root
+        elif is_url(dirname):
+            self.archive = RemoteProduct(dirname)
+            dirname = self.archive.root
+        else:
+            self.archive = None
+            dirname = Path(dirname).resolve()
+        if self.glob(dirname/'GRANULE'):
+            granules = self.glob(dirname/'GRANULE'/'*')
             assert len(granules) == 1
             self.granule_dir = granules[0]
         else:
             self.granule_dir = dirname
         rootdir = self.granule_dir.parent.parent
 
-        self.filename = str(rootdir)
+        if self.archive is None:
+            self.filename = str(rootdir)
+        else:
+            self.filename = os.path.join(os.path.dirname(self.archive.filename),
+                                         rootdir.name)
         self.blocksize = blocksize
         self.resolution = str(resolution)
         self.landmask = landmask
@@ -152,14 +199,14 @@ class Level1_MSI(Level1_base):
                 }
 
         # load xml file (granule)
-        xmlfiles = glob(join(self.granule_dir, '*.xml'))
+        xmlfiles = self.glob(self.granule_dir/'*.xml')
         assert len(xmlfiles) == 1
         xmlfile = xmlfiles[0]
-        self.xmlgranule = objectify.parse(xmlfile).getroot()
+        self.xmlgranule = self.parse_xml(xmlfile)
 
         # load xml file (root)
         xmlfile = rootdir/'MTD_MSIL1C.xml'
-        xmlroot = objectify.parse(str(xmlfile)).getroot()
+        xmlroot = self.parse_xml(xmlfile)
 
         self.product_image_characteristics = xmlroot.General_Info.find('Product_Image_Characteristics')
         self.quantif = float(self.product_image_characteristics.QUANTIFICATION_VALUE)
@@ -171,6 +218,10 @@ class Level1_MSI(Level1_base):
         else:
             self.radio_offset_list = [0]*len(self.band_names)
 
+        self.decoder = Jp2Decoder(self.granule_dir, self.band_names,
+                                  threads=decode_threads, reduce=jp2_reduce,
+                                  archive=self.archive)
+
         self.date = datetime.strptime(str(self.xmlgranule.General_Info.find('SENSING_TIME')), '%Y-%m-%dT%H:%M:%S.%fZ')
         self.geocoding = self.xmlgranule.Geometric_Info.find('Tile_Geocoding')
         self.tileangles = self.xmlgranule.Geometric_Info.find('Tile_Angles')
@@ -195,16 +246,37 @@ class Level1_MSI(Level1_base):
                 scol=scol,
                 ecol=ecol)
 
+        # the bands at 60m are over-sampled: windows are aligned on their
+        # pixels (see read_TOA)
+        self.align = 60//int(resolution)
+
         self.init_latlon()
+        self.init_roi(roi, align=self.align)
         self.init_geometry()
         if self.ancillary == 'ECMWFT':
             self.init_ancillary_embedded()
         else:
             self.init_ancillary()
-        self.init_landmask()
         self.init_bands()
 
 
+    def glob(self, pattern):
+        '''
+        returns the list of the paths matching pattern, in the product
+        directory or archive
+        '''
+        if self.archive is None:
+            return [Path(p) for p in sorted(glob(str(pattern)))]
+        else:
+            return self.archive.glob(pattern)
+
+    def parse_xml(self, filename):
+        if self.archive is None:
+            return objectify.parse(str(filename)).getroot()
+        else:
+            with self.archive.open(filename) as fp:
+                return objectify.parse(fp).getroot()
+
     def init_bands(self):
         """ calculate equivalent wavelength from SRF """
 
@@ -235,6 +307,8 @@ class Level1_MSI(Level1_base):
 
     def init_ancillary_embedded(self):
         file_auxdata = (self.granule_dir/'AUX_DATA'/'AUX_ECMWFT')
+        if self.archive is not None:
+            file_auxdata = self.archive.extract(file_auxdata)
         ds = xr.open_dataset(file_auxdata, engine="cfgrib")
         self.wind_speed = np.sqrt(ds.u10**2 + ds.v10**2)
         assert ds.tco3.units == 'kg m**-2'
@@ -244,28 +318,53 @@ class Level1_MSI(Level1_base):
                 
 
     def init_latlon(self):
-
+        '''
+        Initialize the projection
+        (lat/lon are calculated for each block, see get_latlon)
+        '''
         code = self.geocoding.find('HORIZONTAL_CS_CODE').text
 
         print('Initialize MSI projection {}'.format(code))
 
-        proj = pyproj.Proj('+init={}'.format(code))
+        self.proj = pyproj.Proj('+init={}'.format(code))
 
         # lookup position in the UTM grid
         for e in self.geocoding.findall('Geoposition'):
             if e.attrib['resolution'] == self.resolution:
-                ULX = int(e.find('ULX').text)
-                ULY = int(e.find('ULY').text)
-                XDIM = int(e.find('XDIM').text)
-                YDIM = int(e.find('YDIM').text)
+                self.ULX = int(e.find('ULX').text)
+                self.ULY = int(e.find('ULY').text)
+                self.XDIM = int(e.find('XDIM').text)
+                self.YDIM = int(e.find('YDIM').text)
 
-        X, Y = np.meshgrid(ULX + XDIM//2 + XDIM*np.arange(self.totalheight), 
-                           ULY + YDIM//2 + YDIM*np.arange(self.totalwidth))
+    def get_latlon(self, SY, SX):
+        '''
+        returns lat, lon for the window SY, SX (slices in the full tile)
+        '''
+        X, Y = np.meshgrid(self.ULX + self.XDIM//2 + self.XDIM*np.arange(SX.start, SX.stop, SX.step),
+                           self.ULY + self.YDIM//2 + self.YDIM*np.arange(SY.start, SY.stop, SY.step))
 
-        self.lon, self.lat = (proj(X, Y, inverse=True))
+        lon, lat = self.proj(X, Y, inverse=True)
 
+        return lat, lon
+
+
+    def coarse_latlon(self, step=32):
+        '''
+        returns the geolocation of the tile subsampled by step (see
+        Level1_base.coarse_latlon)
+        '''
+        rows = np.arange(0, self.totalheight, step)
+        cols = np.arange(0, self.totalwidth, step)
+        lat, lon = self.get_latlon(slice(0, self.totalheight, step),
+                                   slice(0, self.totalwidth, step))
+
+        return lat, lon, rows, cols
 
     def init_geometry(self):
+        '''
+        Initialize the interpolation of the angles from the tie points
+        (the angles are interpolated for each block)
+        '''
 
         # read solar angles at tiepoints
         sza = read_xml_block(self.tileangles.find('Sun_Angles_Grid').find('Zenith').find('Values_List'))
@@ -273,8 +372,8 @@ class Level1_MSI(Level1_base):
 
         shp = (self.totalheight, self.totalwidth)
 
-        self.sza = rectBivariateSpline(sza, shp)
-        self.saa = rectBivariateSpline(saa, shp)
+        self.sza = SplineGrid(sza, shp)
+        self.saa = SplineGrid(saa, shp)
 
         # read view angles (for each band)
         vza = {}
@@ -299,30 +398,18 @@ class Level1_MSI(Level1_base):
                 ok = ~np.isnan(data)
                 vaa[bandid][ok] = data[ok]
 
-        self.vza = np.zeros(shp, dtype='float32')
-        self.vaa = np.zeros(shp, dtype='float32')
-
         # use the first band as vza and vaa
         k = sorted(vza.keys())[0]
         assert k in vaa
-        self.vza[:,:] = rectBivariateSpline(vza[k], shp)
-        self.vaa[:,:] = rectBivariateSpline(vaa[k], shp)
-
-    def init_landmask(self):
-        if not hasattr(self.landmask, 'get'):
-            return
-
-        self.landmask_data = self.landmask.get(self.lat, self.lon)
+        self.vza = SplineGrid(vza[k], shp)
+        self.vaa = SplineGrid(vaa[k], shp)
 
 
     def get_filename(self, band):
         '''
         returns jp2k filename containing band
         '''
-        filenames = glob(join(self.granule_dir, 'IMG_DATA/*_{}.jp2'.format(self.band_names[band])))
-        assert len(filenames) == 1
-
-        return filenames[0]
+        return self.decoder.filename(band)
 
 
     def read_TOA(self, band, size, offset):
@@ -330,48 +417,60 @@ class Level1_MSI(Level1_base):
         (ysize, xsize) = size
         (yoffset, xoffset) = offset
 
-        jp = Jp2k(self.get_filename(band))
+        jp = self.decoder.get(band)
 
         xrat = jp.shape[0]/float(self.totalwidth)
         yrat = jp.shape[1]/float(self.totalheight)
 
         # read input data
-        datao = jp[
-           int(yrat*(yoffset+self.sline)): int(yrat*(yoffset+self.sline+ysize)),
-           int(xrat*(xoffset+self.scol)) : int(xrat*(xoffset+self.scol+xsize))
-           ]
+        rows = slice(int(yrat*(yoffset+self.sline)), int(yrat*(yoffset+self.sline+ysize)))
+        cols = slice(int(xrat*(xoffset+self.scol)), int(xrat*(xoffset+self.scol+xsize)))
 
         if xrat >= 1.:
             # downsample
-            data = np.zeros(size, dtype='float32')
-            N = 0
-            for i in range(int(xrat)):
-                for j in range(int(yrat)):
-                    N += 1
-                    data += datao[j::int(yrat), i::int(xrat)]
-            data /= N
+            datao, (yr, xr) = self.decoder.read(band, rows, cols,
+                                                (int(yrat), int(xrat)))
+            # sum of at most 36 uint16: exact in float32
+            data = datao.reshape(ysize, yr, xsize, xr).sum(axis=(1, 3), dtype='float32')
+            data /= yr*xr
         else:
             # over-sample
+            datao = jp[rows, cols]
             data = datao.repeat(int(1/yrat), axis=0).repeat(int(1/xrat), axis=1)
 
         assert data.shape == size, '{} != {}'.format(data.shape, size)
 
         return data
 
-    def read_block(self, size, offset, bands):
+    def block_valid(self, size, offset):
+        '''
+        returns the pixels of the block which can be processed (see
+        Level1_base.block_valid)
+        '''
+        SY = slice(offset[0]+self.sline, offset[0]+self.sline+size[0])
+        SX = slice(offset[1]+self.scol, offset[1]+self.scol+size[1])
+
+        valid = ~np.isnan(self.vza[SY, SX])
+        valid &= self.sza[SY, SX] < 90
+        if hasattr(self.landmask, 'get'):
+            latitude, longitude = self.get_latlon(SY, SX)
+            valid &= ~self.landmask.get(latitude, longitude).astype('bool')
+
+        return valid
+
+    def read_block(self, size, offset, bands, read_bands=True):
 
         (ysize, xsize) = size
         (yoffset, xoffset) = offset
         nbands = len(bands)
 
-        block = Block(offset=offset, size=size, bands=bands)
+        block = Block(offset=offset, size=size, bands=bands, pool=self.pool)
 
         SY = slice(offset[0]+self.sline, offset[0]+self.sline+ysize)
         SX = slice(offset[1]+self.scol, offset[1]+self.scol+xsize)
 
         # read lat/lon
-        block.latitude = self.lat[SY, SX]
-        block.longitude = self.lon[SY, SX]
+        block.latitude, block.longitude = self.get_latlon(SY, SX)
 
         # read geometry
         block.sza = self.sza[SY, SX]
@@ -387,9 +486,15 @@ class Level1_MSI(Level1_base):
         raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], np.isnan(block.muv))
 
         # read RTOA
-        block.Rtoa = np.zeros((ysize,xsize,nbands)) + np.NaN
-        for iband, band in enumerate(bands):
-            raw_data = self.read_TOA(band, size, offset)
+        # (bands are decoded concurrently)
+        # if not read_bands, Rtoa is left to NaN
+        if read_bands:
+            raw = self.decoder.map(lambda b: self.read_TOA(b, size, offset), bands)
+        else:
+            raw = []
+        block.Rtoa = block.buffer('Rtoa', (ysize,xsize,nbands), dtype='float64')
+        for iband, band in enumerate(bands[:len(raw)]):
+            raw_data = raw[iband]
             if iband == 0:
                 raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], raw_data == 0)
 
@@ -405,14 +510,11 @@ class Level1_MSI(Level1_base):
 
             block.Rtoa[:,:,iband] = Rtoa + noise
 
-        if self.landmask is not None:
+        if hasattr(self.landmask, 'get'):
             raiseflag(block.bitmask, L2FLAGS['LAND'],
-                      self.landmask_data[
-                          yoffset+self.sline:yoffset+self.sline+ysize,
-                          xoffset+self.scol:xoffset+self.scol+xsize,
-                                         ])
+                      self.landmask.get(block.latitude, block.longitude))
 
-        block.wavelen = np.zeros((ysize, xsize, nbands), dtype='float32') + np.NaN
+        block.wavelen = block.buffer('wavelen', (ysize, xsize, nbands), fill=None)
         block.cwavelen = np.zeros(nbands, dtype='float32') + np.NaN
         for iband, band in enumerate(bands):
             block.wavelen[:,:,iband] = self.wav[band]
@@ -451,18 +553,18 @@ class Level1_MSI(Level1_base):
         block.surf_press = P0 * np.exp(-block.altitude/8000.)
 
         if not self.use_srf:
-            block.tau_ray = np.zeros((ysize, xsize, nbands), dtype='float32') + np.NaN
-            for iband, band in enumerate(bands):
-                block.tau_ray[:,:,iband] = {  # first calculations
-                                              # using convolution of ROD using old version of SRF
-                            443: 0.234280641095, 490: 0.149710335414,
-                            560: 0.0905014442489, 665: 0.0450755094234,
-                            705: 0.0356256787869, 740: 0.0290586201022,
-                            783: 0.0232262166776, 842: 0.0181555100059,
-                            865: 0.0155121863123, 940: 0.0108505370873,
-                            1375: 0.00242549670396, 1610: 0.00128165077197,
-                            2190: 0.000383201294006,
-                        }[band] * block.surf_press/1013.
+            tau_r = {  # first calculations
+                       # using convolution of ROD using old version of SRF
+                    443: 0.234280641095, 490: 0.149710335414,
+                    560: 0.0905014442489, 665: 0.0450755094234,
+                    705: 0.0356256787869, 740: 0.0290586201022,
+                    783: 0.0232262166776, 842: 0.0181555100059,
+                    865: 0.0155121863123, 940: 0.0108505370873,
+                    1375: 0.00242549670396, 1610: 0.00128165077197,
+                    2190: 0.000383201294006,
+                }
+            rodt = RayleighODTable.from_reference([tau_r[b] for b in bands])
+            block.tau_ray = rodt.tau_ray(block.surf_press)
 
         if self.Ltyp is not None:
             block.Ltyp = np.array([self.Ltyp[b] for b in bands], dtype='float32')
@@ -473,25 +575,68 @@ class Level1_MSI(Level1_base):
         return block
 
 
-    def blocks(self, bands_read):
-
-        nblocks = int(np.ceil(float(self.height)/self.blocksize))
-        for iblock in range(nblocks):
+    def block_tiles(self, bands_read):
+        '''
+        returns the jpeg2000 tile sizes of bands_read, in the processing grid
+        '''
+        tiles = []
+        for band in bands_read:
+            jp = self.decoder.get(band)
+            siz = [x for x in jp.codestream.segment if x.marker_id == 'SIZ'][0]
+            tiles.append((Fraction(siz.ytsiz*self.totalheight, jp.shape[0]),
+                          Fraction(siz.xtsiz*self.totalwidth, jp.shape[1])))
+        return tiles
+
+    def block_align(self, bands_read):
+        '''
+        bands at a lower resolution than the processing grid are
+        over-sampled: returns the alignment of the block boundaries on their
+        pixels, in the processing grid
+        '''
+        align = 1
+        for band in bands_read:
+            rat = self.totalheight//self.decoder.get(band).shape[0]
+            align = align*max(rat, 1)//gcd(align, max(rat, 1))
+        return align
 
-            # determine block size
-            xsize = self.width
-            if iblock == nblocks-1:
-                ysize = self.height-(nblocks-1)*self.blocksize
-            else:
-                ysize = self.blocksize
-            size = (ysize, xsize)
+    def split_period(self, bands_read):
+        '''
+        returns the period of the rows at which the blocks can be split
+        (see Level1_base.split_period): the split blocks stay aligned on the
+        pixels of the over-sampled bands, and on the jpeg2000 tiles for
+        2-dimensional blocks
+        '''
+        align = self.block_align(bands_read)
+        if isinstance(self.blocksize, int):
+            return align
+        return axis_period(self.blocksize[0],
+                           [t[0] for t in self.block_tiles(bands_read)],
+                           align)
+
+    def block_layout(self, bands_read, verbose=False):
+        '''
+        returns the list of (size, offset) of the blocks:
+            * if blocksize is an integer, blocks of blocksize full lines
+            * if blocksize is a tuple (ysize, xsize), 2-dimensional blocks
+              aligned with the jpeg2000 tiles of all bands (see
+              level1.plan_blocks), so that each tile is decoded only once
 
-            # determine the block offset
-            xoffset = 0
-            yoffset = iblock*self.blocksize
-            offset = (yoffset, xoffset)
+        verbose: print the layout report (see level1.layout_report)
+        '''
+        if isinstance(self.blocksize, int):
+            blocks = plan_blocks(self.height, self.width,
+                                 (self.blocksize, self.width))
+        else:
+            align = self.block_align(bands_read)
+            tiles = self.block_tiles(bands_read)
+            origin = (self.sline, self.scol)
+            blocks = plan_blocks(self.height, self.width, self.blocksize,
+                                 tiles=tiles, origin=origin,
+                                 align=(align, align))
+            if verbose:
+                print(layout_report(blocks, tiles, origin=origin))
 
-            yield self.read_block(size, offset, bands_read)
+        return blocks
 
     def attributes(self, datefmt):
 
@@ -509,7 +654,100 @@ class Level1_MSI(Level1_base):
         return self
 
     def __exit__(self, *args):
-        pass
+        self.decoder.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+class Jp2Decoder(object):
+    '''
+    Decoder for the jpeg2000 files of a MSI granule
+
+    The band filenames and Jp2k handles are cached, and the bands can be
+    decoded concurrently in a thread pool (see method map).
+
+    threads: number of threads (None: one per band, 1: no threading)
+    reduce: whether to use the jpeg2000 resolution levels for reading at a
+        lower resolution (see method read)
+    archive: ZipProduct containing the granule, if any. The jpeg2000 files
+        are extracted when first accessed.
+    '''
+    def __init__(self, granule_dir, band_names, threads=None, reduce=False,
+                 archive=None):
+        self.archive = archive
+        self.filenames = {}
+        for b, bn in band_names.items():
+            pattern = join(str(granule_dir), 'IMG_DATA/*_{}.jp2'.format(bn))
+            if archive is None:
+                filenames = glob(pattern)
+            else:
+                filenames = archive.glob(pattern)
+            if filenames:
+                self.filenames[b] = filenames
+        self.handles = {}
+        self.threads = threads
+        self.reduce = reduce
+        self.executor = None
+
+    def filename(self, band):
+        '''
+        returns jp2k filename containing band
+        '''
+        filenames = self.filenames.get(band, [])
+        assert len(filenames) == 1
+
+        if self.archive is None:
+            return filenames[0]
+        else:
+            return self.archive.extract(filenames[0])
+
+    def get(self, band):
+        '''
+        returns the Jp2k instance of band
+        '''
+        if band not in self.handles:
+            self.handles[band] = Jp2k(self.filename(band))
+        return self.handles[band]
+
+    def read(self, band, rows, cols, factor):
+        '''
+        Read the window (rows, cols) of band, for a later downsampling by
+        factor (fy, fx)
+
+        If reduce is set, the largest power of 2 dividing the factor is
+        applied by the jpeg2000 decoder.
+
+        returns the data and the remaining downsampling factor
+        '''
+        (fy, fx) = factor
+        step = 1
+        if self.reduce:
+            while (fy % (2*step) == 0) and (fx % (2*step) == 0):
+                step *= 2
+
+        jp = self.get(band)
+        if step == 1:
+            data = jp[rows, cols]
+        else:
+            data = jp[rows.start:rows.stop:step, cols.start:cols.stop:step]
+
+        return data, (fy//step, fx//step)
+
+    def map(self, func, bands):
+        '''
+        returns the list [func(b) for b in bands], evaluated concurrently
+        '''
+        if (self.threads == 1) or (len(bands) < 2):
+            return [func(b) for b in bands]
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads or len(bands))
+        return list(self.executor.map(func, bands))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
 
 def read_xml_block(item):
@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division, absolute_import
-from netCDF4 import Dataset
 import numpy as np
 from polymer.block import Block
 from datetime import datetime
@@ -10,7 +9,9 @@ from polymer.ancillary import Ancillary_NASA
 from polymer.common import L2FLAGS
 from collections import OrderedDict
 from polymer.utils import raiseflag
-from polymer.level1 import Level1_base
+from polymer.bodhaine import RayleighODTable
+from polymer.level1 import Level1_base, chunk_shape
+from polymer.remote import open_nc
 from os.path import dirname, join
 import pandas as pd
 
@@ -93,13 +94,22 @@ class Level1_NASA(Level1_base):
         - SeaWiFS
         - VIIRS
         - MODIS
+
+    blocksize: (ysize, xsize), or number of lines per block. Blocks are
+        aligned with the chunks of the datasets (see Level1_base.blocks)
+
+    roi: region of interest, (lon_min, lat_min, lon_max, lat_max) or
+        [(lon, lat), ...] (see Level1_base.init_roi)
+
+    filename can also be a HTTP(S) URL, read with range requests (see
+    remote.py)
     '''
     def __init__(self, filename, sensor=None, blocksize=(500, 400),
                  sline=0, eline=-1, scol=0, ecol=-1, ancillary=None,
-                 altitude=0.):
+                 altitude=0., roi=None):
         self.sensor = sensor
         self.filename = filename
-        self.root = Dataset(filename)
+        self.root = open_nc(filename)
         self.altitude = altitude
         lat = self.root.groups['navigation_data'].variables['latitude']
         totalheight, totalwidth = lat.shape
@@ -116,6 +126,7 @@ class Level1_NASA(Level1_base):
                 eline=eline,
                 scol=scol,
                 ecol=ecol)
+        self.init_roi(roi)
 
         # read flag meanings
         var = self.root.groups['geophysical_data'].variables['l2_flags']
@@ -162,7 +173,50 @@ class Level1_NASA(Level1_base):
         self.central_wavelength = dict([(b, float(b)) for b in bands])
 
 
-    def read_block(self, size, offset, bands):
+    def block_tiles(self, bands_read):
+        '''
+        returns the chunk shapes of the datasets read in each block
+        '''
+        nav = self.root.groups['navigation_data'].variables
+        geo = self.root.groups['geophysical_data'].variables
+        datasets = [nav['latitude'], nav['longitude']]
+        datasets += [geo[x] for x in ['solz', 'senz', 'sola', 'sena', 'l2_flags']]
+        for band in bands_read:
+            datasets += [geo['rhot_{}'.format(band)], geo['polcor_{}'.format(band)]]
+
+        chunks = [chunk_shape(x) for x in datasets]
+
+        return [c for c in chunks if c is not None]
+
+    def coarse_latlon(self, step=16):
+        '''
+        returns the geolocation of the product subsampled by step (see
+        Level1_base.coarse_latlon)
+        '''
+        nav = self.root.groups['navigation_data']
+        return (filled(nav.variables['latitude'][::step, ::step], fill_value=-999.),
+                filled(nav.variables['longitude'][::step, ::step], fill_value=-999.),
+                np.arange(0, self.totalheight, step),
+                np.arange(0, self.totalwidth, step))
+
+    def block_valid(self, size, offset):
+        '''
+        returns the pixels of the block which can be processed (see
+        Level1_base.block_valid)
+        '''
+        SY = slice(offset[0]+self.sline, offset[0]+self.sline+size[0])
+        SX = slice(offset[1]+self.scol , offset[1]+self.scol+size[1])
+        geo = self.root.groups['geophysical_data']
+
+        valid = filled(self.root.groups['navigation_data'].variables[
+                'latitude'][SY, SX], fill_value=-999.) > -90.
+        flags = filled(geo.variables['l2_flags'][SY, SX])
+        valid &= flags & self.flag_meanings['LAND'] == 0
+        valid &= filled(geo.variables['solz'][SY, SX]) < 90
+
+        return valid
+
+    def read_block(self, size, offset, bands, read_bands=True):
 
         nbands = len(bands)
         size3 = size + (nbands,)
@@ -172,7 +226,7 @@ class Level1_NASA(Level1_base):
         SX = slice(offset[1]+self.scol , offset[1]+self.scol+size[1])
 
         # initialize block
-        block = Block(offset=offset, size=size, bands=bands)
+        block = Block(offset=offset, size=size, bands=bands, pool=self.pool)
 
         # read lat/lon
         block.latitude = filled(self.root.groups['navigation_data'].variables[
@@ -193,8 +247,9 @@ class Level1_NASA(Level1_base):
         vaa.set_auto_mask(False)
         block.vaa = filled(vaa[SY, SX]) % 360
 
-        block.Rtoa = np.zeros(size3) + np.NaN
-        for iband, band in enumerate(bands):
+        # if not read_bands, Rtoa is left to NaN
+        block.Rtoa = block.buffer('Rtoa', size3, dtype='float64')
+        for iband, band in enumerate(bands if read_bands else []):
             Rtoa = filled(self.root.groups['geophysical_data'].variables[
                     'rhot_{}'.format(band)][SY, SX])
 
@@ -216,7 +271,8 @@ class Level1_NASA(Level1_base):
         P0 = np.zeros_like(ok, dtype='float32')+np.NaN
         P0[ok] = self.surf_press[block.latitude[ok], block.longitude[ok]]
 
-        ok &= (block.Rtoa >= 0).all(axis=-1)
+        if read_bands:
+            ok &= (block.Rtoa >= 0).all(axis=-1)
         raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], ~ok)
 
         # read surface altitude
@@ -233,15 +289,14 @@ class Level1_NASA(Level1_base):
         block.jday = self.date().timetuple().tm_yday
         block.month = self.date().timetuple().tm_mon
 
-        block.wavelen = np.zeros(size3, dtype='float32') + np.NaN
+        block.wavelen = block.buffer('wavelen', size3, fill=None)
         block.cwavelen = np.zeros(nbands, dtype='float32') + np.NaN
         for iband, band in enumerate(bands):
             block.wavelen[:,:,iband] = self.central_wavelength[band]
             block.cwavelen[iband] = self.central_wavelength[band]
 
-        block.tau_ray = np.zeros(size3, dtype='float32') + np.NaN
-        for iband, band in enumerate(bands):
-            block.tau_ray[:,:,iband] = self.tau_r_seadas[band] * block.surf_press/1013.
+        rodt = RayleighODTable.from_reference([self.tau_r_seadas[b] for b in bands])
+        block.tau_ray = rodt.tau_ray(block.surf_press)
 
         return block
 
@@ -291,7 +346,7 @@ class Level1_NASA(Level1_base):
 class Level1_VIIRS(Level1_NASA):
     ''' Interface to VIIRS Level-1C '''
     def __init__(self, filename, **kwargs):
-        root = Dataset(filename)
+        root = open_nc(filename)
         platform = root.getncattr('platform')
         sensor = {
                 'Suomi-NPP':'VIIRSN',
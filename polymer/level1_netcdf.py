@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function, division, absolute_import
-from polymer.level1 import Level1_base
+from polymer.level1 import (Level1_base, ConcurrentReader, chunk_shape,
+                             detector_table, gather_detectors)
+from polymer.remote import open_nc
 from polymer.block import Block
-from netCDF4 import Dataset
 import numpy as np
 import xarray as xr
 from warnings import warn
@@ -41,6 +42,18 @@ class Level1_NETCDF(Level1_base):
             SRTM3(cache_dir=...)  # srtm.py
             GLOBE(directory=...)  # globe.py
             SRTM3(..., missing=GLOBE(...))
+
+    blocksize: (ysize, xsize), or number of lines per block. Blocks are
+        aligned with the chunks of the datasets (see Level1_base.blocks)
+
+    read_threads: number of threads for reading the datasets of a block
+        concurrently (None: one per dataset, 1: no threading)
+
+    roi: region of interest, (lon_min, lat_min, lon_max, lat_max) or
+        [(lon, lat), ...] (see Level1_base.init_roi)
+
+    filename can also be a HTTP(S) URL of a netcdf4 file, read with range
+    requests (see remote.py)
     '''
     def __init__(self, filename,
                  blocksize=(500, 400),
@@ -48,10 +61,13 @@ class Level1_NETCDF(Level1_base):
                  apply_land_mask=None,
                  landmask=None,
                  altitude=0.,
-                 ancillary=None):
+                 ancillary=None,
+                 read_threads=None,
+                 roi=None):
 
         self.filename = filename
-        self.root = Dataset(filename)
+        self.root = open_nc(filename)
+        self.reader = ConcurrentReader(read_threads)
         self.blocksize = blocksize
         self.landmask = landmask
         self.altitude = altitude
@@ -167,9 +183,20 @@ class Level1_NETCDF(Level1_base):
                 totalwidth=totalwidth,
                 sline=0, eline=-1,
                 scol=0,  ecol=-1)
+        self.init_roi(roi)
 
         self.init_date()
 
+        if self.sensor == 'MERIS':
+            # dense (detector, band) tables of the solar irradiance (corrected
+            # for the sun-earth distance) and of the detector wavelength
+            # (columns indexed by band_index-1)
+            coef = coeff_sun_earth_distance(self.date.timetuple().tm_yday)
+            self.F0_table = detector_table([self.F0['E0_band{}'.format(i)]
+                                            for i in range(len(self.band_index))], coef)
+            self.wav_table = detector_table([self.detector_wavelength['lam_band{}'.format(i)]
+                                             for i in range(len(self.band_index))])
+
         # init ancillary
         if (ancillary is None) and (self.sensor == 'MSI'):
             self.ancillary = Ancillary_NASA()
@@ -185,6 +212,16 @@ class Level1_NETCDF(Level1_base):
         self.init_landmask()
 
 
+    def coarse_latlon(self, step=16):
+        '''
+        returns the geolocation of the product subsampled by step (see
+        Level1_base.coarse_latlon)
+        '''
+        return (self.root.variables[self.varnames['latitude']][::step, ::step],
+                self.root.variables[self.varnames['longitude']][::step, ::step],
+                np.arange(0, self.totalheight, step),
+                np.arange(0, self.totalwidth, step))
+
     def init_bands(self):
         if self.sensor == 'MSI':
             band_names = {
@@ -309,8 +346,23 @@ class Level1_NETCDF(Level1_base):
 
         self.date = date1 + (date2 - date1)//2
 
-    def get_bitmask(self, flags_dataset, flag_name, size, offset):
-        flags = self.read_band(flags_dataset, size, offset)
+    def block_tiles(self, bands_read):
+        '''
+        returns the chunk shapes of the full resolution datasets
+        '''
+        chunks = []
+        for var in self.root.variables.values():
+            if var.shape != (self.totalheight, self.totalwidth):
+                continue
+            chunk = chunk_shape(var)
+            if chunk is not None:
+                chunks.append(chunk)
+
+        return chunks
+
+    def get_bitmask(self, flags_dataset, flag_name, size, offset, flags=None):
+        if flags is None:
+            flags = self.read_band(flags_dataset, size, offset)
         flag_meanings = self.root.variables[flags_dataset].getncattr('flag_meanings').split()
         flag_masks = self.root.variables[flags_dataset].getncattr('flag_masks')
         masks = dict(zip(flag_meanings, flag_masks))
@@ -330,9 +382,10 @@ class Level1_NETCDF(Level1_base):
 
         var = self.root.variables[band_name]
 
-        data = var[yoffset+self.sline:yoffset+self.sline+ysize,
-                   xoffset+self.scol :xoffset+self.scol+xsize,
-                  ]
+        data = self.reader.read_nc(var,
+                   slice(yoffset+self.sline, yoffset+self.sline+ysize),
+                   slice(xoffset+self.scol , xoffset+self.scol+xsize),
+                  )
 
         if 'ozone' in band_name:
             if 'units' in var.ncattrs():
@@ -360,26 +413,27 @@ class Level1_NETCDF(Level1_base):
         size3 = size + (nbands,)
 
         # initialize block
-        block = Block(offset=offset, size=size, bands=bands)
-
-        # read lat/lon
-        block.latitude  = self.read_band('lat', size, offset)
-        block.longitude = self.read_band('lon', size, offset)
-
-
-        # read geometry
-        block.sza = self.read_band(self.varnames['SZA'], size, offset)
-        block.vza = self.read_band(self.varnames['VZA'], size, offset)
-        block.saa = self.read_band(self.varnames['SAA'], size, offset)
-        block.vaa = self.read_band(self.varnames['VAA'], size, offset)
+        block = Block(offset=offset, size=size, bands=bands, pool=self.pool)
+
+        # datasets to read: per pixel datasets (name, variable), and per band
+        # datasets ((block attribute, band index), variable) which are written
+        # to their slice of the block array
+        items = [
+                ('latitude', 'lat'),
+                ('longitude', 'lon'),
+                ('sza', self.varnames['SZA']),
+                ('vza', self.varnames['VZA']),
+                ('saa', self.varnames['SAA']),
+                ('vaa', self.varnames['VAA']),
+                ]
 
         # read Rtoa or Ltoa+F0
         # and wavelen
-        block.wavelen = np.zeros(size3, dtype='float32') + np.NaN
+        block.wavelen = block.buffer('wavelen', size3)
         block.cwavelen = np.zeros(nbands, dtype='float32') + np.NaN
         if self.sensor == 'MSI':
             # read Rtoa
-            block.Rtoa = np.zeros(size3) + np.NaN
+            block.Rtoa = block.buffer('Rtoa', size3, dtype='float64')
             for iband, band in enumerate(bands):
                 band_name = {
                         443 : 'B1', 490 : 'B2',
@@ -390,7 +444,7 @@ class Level1_NETCDF(Level1_base):
                         1375: 'B10', 1610: 'B11',
                         2190: 'B12'}[band]
 
-                block.Rtoa[:,:,iband] = self.read_band(band_name, size, offset)
+                items.append((('Rtoa', iband), band_name))
 
             # init wavelengths
             for iband, band in enumerate(bands):
@@ -399,7 +453,7 @@ class Level1_NETCDF(Level1_base):
 
         elif self.sensor in ['MERIS', 'OLCI']:
             # read Ltoa and F0
-            block.Ltoa = np.zeros(size3) + np.NaN
+            block.Ltoa = block.buffer('Ltoa', size3, dtype='float64')
             for iband, band in enumerate(bands):
                 if self.sensor == 'MERIS':
                     band_name = 'radiance_{}'.format(self.band_index[band])
@@ -408,49 +462,79 @@ class Level1_NETCDF(Level1_base):
                 else:
                     raise Exception('Invalid sensor "{}"'.format(self.sensor))
 
-                block.Ltoa[:,:,iband] = self.read_band(band_name, size, offset)
+                items.append((('Ltoa', iband), band_name))
 
             # detector wavelength and solar irradiance
-            block.F0 = np.zeros(size3, dtype='float32') + np.NaN
             if self.sensor == 'MERIS':
-                # read detector index
-                detector_index = self.read_band('detector_index', size, offset)
-
-                for iband, band in enumerate(bands):
-                    name = 'lam_band{}'.format(self.band_index[band]-1)   # 0-based
-                    block.wavelen[:,:,iband] = self.detector_wavelength[name][detector_index]
-                    block.cwavelen[iband] = central_wavelength_meris[band]
-
-                    name = 'E0_band{}'.format(self.band_index[band]-1)   # 0-based
-                    block.F0[:,:,iband] = self.F0[name][detector_index]
-
-                coef = coeff_sun_earth_distance(self.date.timetuple().tm_yday)
-                block.F0 *= coef
+                items.append(('detector_index', 'detector_index'))
+                items.append(('flags', 'l1_flags'))
 
             elif self.sensor == 'OLCI':  # OLCI
+                block.F0 = block.buffer('F0', size3)
                 for iband, band in enumerate(bands):
-                    block.wavelen[:,:,iband] = self.read_band('lambda0_band_{}'.format(self.band_index[band]), size, offset)
                     block.cwavelen[iband] = central_wavelength_olci[band]
-                    block.F0[:,:,iband] = self.read_band('solar_flux_band_{}'.format(self.band_index[band]), size, offset)  # should be seasonally corrected
+                    items.append((('wavelen', iband), 'lambda0_band_{}'.format(self.band_index[band])))
+                    items.append((('F0', iband), 'solar_flux_band_{}'.format(self.band_index[band])))  # should be seasonally corrected
+                items.append(('flags', 'quality_flags'))
             else:
                 raise Exception('Invalid sensor "{}"'.format(self.sensor))
+
+            # ancillary data
+            for name in ['ozone', 'zwind', 'mwind', 'press']:
+                items.append((name, self.varnames[name]))
         else:
             raise Exception('Invalid sensor "{}"'.format(self.sensor))
 
+        def read(item):
+            (key, band_name) = item
+            data = self.read_band(band_name, size, offset)
+            if isinstance(key, tuple):
+                (name, iband) = key
+                getattr(block, name)[:,:,iband] = data
+            else:
+                return data
+
+        # read all datasets concurrently
+        data = dict([(key, x) for ((key, _), x)
+                     in zip(items, self.reader.map(read, items))
+                     if not isinstance(key, tuple)])
+
+        block.latitude  = data['latitude']
+        block.longitude = data['longitude']
+        block.sza = data['sza']
+        block.vza = data['vza']
+        block.saa = data['saa']
+        block.vaa = data['vaa']
+
+        if self.sensor == 'MERIS':
+            detector_index = data['detector_index']
+
+            columns = [self.band_index[band]-1 for band in bands]   # 0-based
+            block.wavelen = gather_detectors(self.wav_table, detector_index, columns,
+                                             out=block.wavelen)
+            block.F0 = gather_detectors(self.F0_table, detector_index, columns,
+                                        out=block.buffer('F0', size3, fill=None))
+            for iband, band in enumerate(bands):
+                block.cwavelen[iband] = central_wavelength_meris[band]
+
         # read bitmask
         block.bitmask = np.zeros(size, dtype='uint16')
         if self.sensor == 'OLCI':
+            flags = data['flags']
             if self.landmask == 'default':
-                raiseflag(block.bitmask, L2FLAGS['LAND'], self.get_bitmask('quality_flags', 'land', size, offset))
-            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('quality_flags', 'invalid', size, offset))
-            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('quality_flags', 'cosmetic', size, offset))
+                raiseflag(block.bitmask, L2FLAGS['LAND'], self.get_bitmask('quality_flags', 'land', size, offset, flags))
+            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('quality_flags', 'invalid', size, offset, flags))
+            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('quality_flags', 'cosmetic', size, offset, flags))
 
         elif self.sensor == 'MERIS':
+            flags = data['flags']
             if self.landmask == 'default':
-                raiseflag(block.bitmask, L2FLAGS['LAND'], self.get_bitmask('l1_flags', 'LAND_OCEAN', size, offset))
-            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('l1_flags', 'INVALID', size, offset))
-            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('l1_flags', 'SUSPECT', size, offset))
-            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('l1_flags', 'COSMETIC', size, offset))
+                raiseflag(block.bitmask, L2FLAGS['LAND'], self.get_bitmask('l1_flags', 'LAND_OCEAN', size, offset, flags))
+            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('l1_flags', 'INVALID', size, offset, flags))
+            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('l1_flags', 'SUSPECT', size, offset, flags))
+            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], self.get_bitmask('l1_flags', 'COSMETIC', size, offset, flags))
+            # invalid detector index (see gather_detectors)
+            raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], np.isnan(block.F0).any(axis=2))
         elif self.sensor == 'MSI':
             raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], np.isnan(block.vza))
         else:
@@ -472,11 +556,11 @@ class Level1_NETCDF(Level1_base):
 
         # read ancillary data
         if self.sensor in ['MERIS', 'OLCI']:
-            block.ozone = self.read_band(self.varnames['ozone'], size, offset)
-            zwind = self.read_band(self.varnames['zwind'], size, offset)
-            mwind = self.read_band(self.varnames['mwind'], size, offset)
+            block.ozone = data['ozone']
+            zwind = data['zwind']
+            mwind = data['mwind']
             block.wind_speed = np.sqrt(zwind**2 + mwind**2)
-            P0 = self.read_band(self.varnames['press'], size, offset)
+            P0 = data['press']
         elif self.sensor == 'MSI' and self.ancillary == 'ECMWFT':
             # ancillary data embedded in Level1
             block.ozone = self.ozone.interp(
@@ -526,6 +610,6 @@ class Level1_NETCDF(Level1_base):
         return self
 
     def __exit__(self, *args):
-        pass
+        self.reader.close()
 
 
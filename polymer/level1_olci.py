@@ -26,6 +26,8 @@ def Level1_OLCI(dirname,
                 landmask='default',
                 altitude=0.,
                 add_noise=False,
+                read_threads=None,
+                roi=None,
                 ):
     '''
     OLCI reader (SAFE format)
@@ -41,6 +43,15 @@ def Level1_OLCI(dirname,
             SRTM3(cache_dir=...)  # srtm.py
             GLOBE(directory=...)  # globe.py
             SRTM3(..., missing=GLOBE(...))
+
+    read_threads: number of threads for reading the datasets of a block
+        concurrently (None: one per dataset, 1: no threading)
+
+    roi: region of interest, (lon_min, lat_min, lon_max, lat_max) or
+        [(lon, lat), ...] (see Level1_base.init_roi)
+
+    dirname can also be a zip archive of the product, or the HTTP(S) URL of
+    the product directory (see Level1_SAFE)
     '''
     # central wavelength of the detector (for normalization)
     # (detector 374 of camera 3)
@@ -102,4 +113,6 @@ def Level1_OLCI(dirname,
         Ltyp=Ltyp_olci,
         sigma_typ=sigma_typ_olci,
         add_noise=add_noise,
+        read_threads=read_threads,
+        roi=roi,
     )
@@ -14,6 +14,7 @@ from matplotlib import pyplot as plt
 from polymer.ancillary import Ancillary_NASA
 
 from polymer.block import Block
+from polymer.level1 import Level1_base, chunk_shape, band_runs
 from polymer.common import L2FLAGS
 from polymer.level1_nasa import filled
 from polymer.utils import coeff_sun_earth_distance, raiseflag
@@ -21,12 +22,15 @@ from polymer import prisma
 
 
 
-class Level1_PRISMA:
+class Level1_PRISMA(Level1_base):
     """
     PRISMA Level1 for Polymer
 
     http://prisma.asi.it/missionselect/docs/PRISMA%20ATBD_v1.pdf
     http://prisma.asi.it/missionselect/docs/PRISMA%20Product%20Specifications_Is2_3.pdf
+
+    blocksize: number of lines per block, or (ysize, xsize). Blocks are
+        aligned with the chunks of the datasets (see Level1_base.blocks)
     """
     def __init__(self, level1,
                  blocksize=100,
@@ -52,6 +56,7 @@ class Level1_PRISMA:
         self.HCO_GEO_L2 = self.hl2['HDFEOS']['SWATHS']['PRS_L2C_HCO']['Geometric Fields']
 
         self.blocksize = blocksize
+        self.buffer = None   # staging buffer for reading the cube
         self.sline = sline
         self.scol = scol
 
@@ -107,6 +112,24 @@ class Level1_PRISMA:
         attr['datetime'] = self.datetime
         return attr
 
+    def read_cube(self, cube, indices, SY, SX, out):
+        '''
+        reads the bands `indices` of cube (rows, bands, columns) in the
+        window (SY, SX), to out (rows, columns, bands)
+
+        Only these bands are read, by runs of consecutive bands (see
+        band_runs), through a staging buffer which is reused across blocks.
+        '''
+        (ysize, xsize) = out.shape[:2]
+        for (start, stop, positions) in band_runs(indices):
+            n = ysize*(stop-start)*xsize
+            if (self.buffer is None) or (self.buffer.size < n) \
+                    or (self.buffer.dtype != cube.dtype):
+                self.buffer = np.empty(ysize*len(indices)*xsize, dtype=cube.dtype)
+            stage = self.buffer[:n].reshape((ysize, stop-start, xsize))
+            cube.read_direct(stage, np.s_[SY, start:stop, SX])
+            out[:,:,positions] = stage.transpose([0, 2, 1])
+
     def read_block(self, size, offset, bands):
         nbands = len(bands)
         size3 = size + (nbands,)
@@ -131,11 +154,14 @@ class Level1_PRISMA:
         scale_vnir = self.h.attrs['ScaleFactor_Vnir']
         offset_vnir = self.h.attrs['Offset_Vnir']
         mask_value = 65535
-        Ltoa_VNIR_raw = self.HCO_DATA['VNIR_Cube'][
-            SY,:,SX].transpose([0, 2, 1])[:,:,len(prisma.bands)-ibands-1]
-        Ltoa_VNIR = offset_vnir + Ltoa_VNIR_raw/scale_vnir
-        Ltoa_VNIR[Ltoa_VNIR>=mask_value] = np.NaN
-        block.Ltoa = Ltoa_VNIR/10.  # convert W/m^2/um/sr -> mW/cm^2/um/sr
+        block.Ltoa = np.zeros(size3, dtype='float32')
+        # VNIR cube bands are in decreasing wavelengths
+        self.read_cube(self.HCO_DATA['VNIR_Cube'],
+                       len(prisma.bands)-ibands-1, SY, SX, block.Ltoa)
+        block.Ltoa /= scale_vnir
+        block.Ltoa += offset_vnir
+        block.Ltoa[block.Ltoa>=mask_value] = np.NaN
+        block.Ltoa /= 10.  # convert W/m^2/um/sr -> mW/cm^2/um/sr
         doy = self.datetime.timetuple().tm_yday  # day of year [1-366]
         block.F0 = np.array([self.F0[b] for b in bands])*coeff_sun_earth_distance(doy)
         block.F0 = np.broadcast_to(block.F0, size3)
@@ -176,23 +202,23 @@ class Level1_PRISMA:
         return block
 
 
-    def blocks(self, bands_read):
-        nblocks = int(np.ceil(float(self.height)/self.blocksize))
-        for iblock in range(nblocks):
-            # determine block size
-            xsize = self.width
-            if iblock == nblocks-1:
-                ysize = self.height-(nblocks-1)*self.blocksize
-            else:
-                ysize = self.blocksize
-            size = (ysize, xsize)
+    def block_tiles(self, bands_read):
+        '''
+        returns the chunk shapes of the datasets read in each block
+        '''
+        datasets = [self.HCO_GEO['Latitude_VNIR'],
+                    self.HCO_GEO['Longitude_VNIR'],
+                    self.HCO_GEO_L2['Solar_Zenith_Angle'],
+                    self.HCO_GEO_L2['Observing_Angle'],
+                    self.HCO_GEO_L2['Rel_Azimuth_Angle']]
+        if self.landmask is None:
+            datasets.append(self.HCO_DATA['LandCover_Mask'])
+        chunks = [chunk_shape(x) for x in datasets]
 
-            # determine the block offset
-            xoffset = 0
-            yoffset = iblock*self.blocksize
-            offset = (yoffset, xoffset)
+        # VNIR cube is (rows, bands, columns)
+        chunks.append(chunk_shape(self.HCO_DATA['VNIR_Cube'], axes=(0, 2)))
 
-            yield self.read_block(size, offset, bands_read)
+        return [c for c in chunks if c is not None]
 
 
     def get_time(self):
@@ -6,11 +6,13 @@ import numpy as np
 from polymer.block import Block
 from polymer.common import L2FLAGS
 from polymer.utils import raiseflag
-from polymer.level1 import Level1_base
+from polymer.level1 import (Level1_base, ConcurrentReader, chunk_shape,
+                             detector_table, gather_detectors)
+from polymer.archive import ZipProduct, is_zip
+from polymer.remote import RemoteProduct, NCFile, is_url
 from polymer.bodhaine import rod
 from polymer.luts import read_mlut, LUT
 from netCDF4 import Dataset
-from scipy.ndimage import map_coordinates
 from datetime import datetime
 from polymer.ancillary import Ancillary_NASA
 import os
@@ -33,6 +35,22 @@ class Level1_SAFE(Level1_base):
             SRTM3(cache_dir=...)  # srtm.py
             GLOBE(directory=...)  # globe.py
             SRTM3(..., missing=GLOBE(...))
+
+    blocksize: number of lines per block, or (ysize, xsize). Blocks are
+        aligned with the chunks of the datasets (see Level1_base.blocks)
+
+    read_threads: number of threads for reading the datasets of a block
+        concurrently (None: one per dataset, 1: no threading)
+
+    roi: region of interest, (lon_min, lat_min, lon_max, lat_max) or
+        [(lon, lat), ...] (see Level1_base.init_roi)
+
+    The product can also be a zip archive of the SAFE directory: the netcdf
+    files are then read in memory from the archive when first accessed,
+    without extracting it.
+    Or a HTTP(S) URL of the SAFE directory: the netcdf files are then read
+    with range requests, fetching only the parts of the files which are
+    read (see remote.py).
     '''
     def __init__(self, dirname,
                  sline=0, eline=-1,
@@ -47,6 +65,8 @@ class Level1_SAFE(Level1_base):
                  Ltyp=None,
                  sigma_typ=None,
                  add_noise=False,
+                 read_threads=None,
+                 roi=None,
                  ):
 
         self.sensor = sensor
@@ -61,8 +81,17 @@ class Level1_SAFE(Level1_base):
         self.Ltyp = Ltyp
         self.add_noise = add_noise
 
-        if not os.path.isdir(dirname):
-            dirname = os.path.dirname(dirname)
+        if is_zip(dirname):
+            self.archive = ZipProduct(dirname)
+            dirname = os.path.join(os.path.dirname(dirname),
+                                   self.archive.root.name)
+        elif is_url(dirname):
+            self.archive = RemoteProduct(dirname)
+            dirname = self.archive.filename
+        else:
+            self.archive = None
+            if not os.path.isdir(dirname):
+                dirname = os.path.dirname(dirname)
 
         if dirname.endswith(os.path.sep):
             dirname = dirname[:-1]
@@ -71,6 +100,9 @@ class Level1_SAFE(Level1_base):
         self.filename = dirname
         self.ancillary = ancillary
         self.nc_datasets = {}
+        self.tiepoints = {}
+        self.tiepoint_cache = {}
+        self.reader = ConcurrentReader(read_threads)
 
         # get product shape
         bid = list(self.band_names.values())[0]
@@ -84,9 +116,13 @@ class Level1_SAFE(Level1_base):
                 eline=eline,
                 scol=scol,
                 ecol=ecol)
+        self.init_roi(roi)
 
-        self.F0 = self.get_ncroot('instrument_data.nc').variables['solar_flux'][:]
-        self.lam0 = self.get_ncroot('instrument_data.nc').variables['lambda0'][:]
+        # dense (detector, band) tables of the solar irradiance and of the
+        # detector wavelength
+        instrument = self.get_ncroot('instrument_data.nc')
+        self.F0_table = detector_table(instrument.variables['solar_flux'][:])
+        self.wav_table = detector_table(instrument.variables['lambda0'][:])
 
         # read quality flag meanings
         qf = self.get_ncroot('qualityFlags.nc').variables['quality_flags']
@@ -136,22 +172,55 @@ class Level1_SAFE(Level1_base):
 
         self.landmask_data = self.landmask.get(lat, lon)
 
-    def get_ncroot(self, filename):
-        if filename in self.nc_datasets:
-            return self.nc_datasets[filename]
+    def coarse_latlon(self, step=16):
+        '''
+        returns the tie point geolocation of the product (see
+        Level1_base.coarse_latlon), or the geolocation subsampled by step if
+        tie_geo_coordinates.nc is not available
+        '''
+        if self.file_exists('tie_geo_coordinates.nc'):
+            root = self.get_ncroot('tie_geo_coordinates.nc')
+            al = root.getncattr('al_subsampling_factor')
+            ac = root.getncattr('ac_subsampling_factor')
+            lat = root.variables['latitude']
+            rows = np.minimum(al*np.arange(lat.shape[0]), self.totalheight-1)
+            cols = np.minimum(ac*np.arange(lat.shape[1]), self.totalwidth-1)
+            return (lat[:], root.variables['longitude'][:],
+                    rows, cols)
+
+        root = self.get_ncroot('geo_coordinates.nc')
+        return (root.variables['latitude'][::step, ::step],
+                root.variables['longitude'][::step, ::step],
+                np.arange(0, self.totalheight, step),
+                np.arange(0, self.totalwidth, step))
+
+    def file_exists(self, filename):
+        if self.archive is None:
+            return os.path.exists(os.path.join(self.dirname, filename))
+        else:
+            return self.archive.exists(self.archive.root/filename)
 
-        self.nc_datasets[filename] = Dataset(os.path.join(self.dirname, filename))
-        self.nc_datasets[filename].set_auto_mask(False)
+    def get_ncroot(self, filename):
+        with self.reader.lock:
+            if filename not in self.nc_datasets:
+                if self.archive is None:
+                    root = Dataset(os.path.join(self.dirname, filename))
+                elif isinstance(self.archive, RemoteProduct):
+                    root = NCFile(self.archive.open(self.archive.root/filename))
+                else:
+                    member = self.archive.root/filename
+                    root = Dataset(str(member), memory=self.archive.read(member))
+                root.set_auto_mask(False)
+                self.nc_datasets[filename] = root
 
         return self.nc_datasets[filename]
 
 
-    def read_band(self, band_name, size, offset):
-
-        (ysize, xsize) = size
-        (yoffset, xoffset) = offset
-
-        # load netcdf object if not done already
+    def nc_filename(self, band_name):
+        '''
+        returns the file containing band_name, and whether it is a tie point
+        dataset
+        '''
         if band_name in ['latitude', 'longitude']:
             filename = 'geo_coordinates.nc'
             tiepoint = False
@@ -171,7 +240,16 @@ class Level1_SAFE(Level1_base):
             filename = band_name + '.nc'
             tiepoint = False
 
+        return filename, tiepoint
+
 
+    def read_band(self, band_name, size, offset):
+
+        (ysize, xsize) = size
+        (yoffset, xoffset) = offset
+
+        # load netcdf object if not done already
+        filename, tiepoint = self.nc_filename(band_name)
         root = self.get_ncroot(filename)
         try:
             var = root.variables[band_name]
@@ -180,40 +258,59 @@ class Level1_SAFE(Level1_base):
             raise
 
         if tiepoint:
-            # window for tiepoint data read
-            ac = root.getncattr('ac_subsampling_factor')
-            al = root.getncattr('al_subsampling_factor')
+            # copy: the cached arrays are shared by the reads of the block
+            data = self.read_tiepoints(filename, size, offset)[band_name].copy()
+
+        else:
+            data = self.reader.read_nc(
+                var,
+                slice(yoffset+self.sline, yoffset+self.sline+ysize),
+                slice(xoffset+self.scol, xoffset+self.scol+xsize),
+                )
 
-            ymin = int(np.floor((yoffset+self.sline)/al))
-            ymax = min(int(np.ceil((yoffset+self.sline+ysize-1)/al)), var.shape[0])
-            xmin = int(np.floor((xoffset+self.scol)/ac))
-            xmax = min(int(np.ceil((xoffset+self.scol+xsize-1)/ac)), var.shape[1])
-            data = var[ymin:ymax+1, xmin:xmax+1]
+        return data
 
-            if band_name == 'horizontal_wind':
-                # wind modulus from zonal and meridional components
-                data = np.sqrt(data[...,0]**2 + data[...,1]**2)
 
-            coords = np.meshgrid(np.linspace(0, xmax-xmin, (xmax-xmin)*ac+1),
-                                 np.linspace(0, ymax-ymin, (ymax-ymin)*al+1))
-            out = np.zeros(coords[0].shape, dtype='float32')
-            if band_name in ['OAA', 'SAA']:
-                order=0   # nearest neighbour for azimuth angles
+    def read_tiepoints(self, filename, size, offset):
+        '''
+        returns all the tie point datasets of filename ('tie_geometries.nc' or
+        'tie_meteo.nc'), interpolated on the block (size, offset)
+
+        The datasets of the last block are cached, and should not be modified.
+        '''
+        key = (filename, size, offset)
+        if key in self.tiepoint_cache:
+            return self.tiepoint_cache[key]
+
+        if filename not in self.tiepoints:
+            # read the tie point grids once
+            root = self.get_ncroot(filename)
+            if filename == 'tie_geometries.nc':
+                datasets = OrderedDict([(x, root.variables[x][:])
+                                        for x in ['SZA', 'SAA', 'OZA', 'OAA']])
+                angles = ['SAA', 'OAA']
             else:
-                order=1
-            map_coordinates(data, (coords[1], coords[0]), output=out, order=order)
-            data = out
+                datasets = OrderedDict([(x, root.variables[x][:])
+                                        for x in ['total_ozone', 'sea_level_pressure']])
+                # wind modulus from zonal and meridional components
+                wind = root.variables['horizontal_wind'][:]
+                datasets['horizontal_wind'] = np.sqrt(wind[...,0]**2 + wind[...,1]**2)
+                angles = []
 
-            data = data[
-                yoffset+self.sline-al*ymin : yoffset+self.sline-al*ymin+ysize,
-                xoffset+self.scol-ac*xmin : xoffset+self.scol-ac*xmin+xsize,
-            ]
+            self.tiepoints[filename] = TiePoints(
+                    datasets,
+                    al=root.getncattr('al_subsampling_factor'),
+                    ac=root.getncattr('ac_subsampling_factor'),
+                    angles=angles)
 
-        else:
-            data = var[
-                yoffset+self.sline:yoffset+self.sline+ysize,
-                xoffset+self.scol:xoffset+self.scol+xsize,
-                ]
+        (ysize, xsize) = size
+        (yoffset, xoffset) = offset
+        data = self.tiepoints[filename].interp(
+                (yoffset+self.sline, ysize),
+                (xoffset+self.scol, xsize))
+
+        # keep only the current block
+        self.tiepoint_cache = {key: data}
 
         return data
 
@@ -222,18 +319,69 @@ class Level1_SAFE(Level1_base):
         return self.dstart + (self.dstop - self.dstart)//2
 
 
-    def read_block(self, size, offset, bands):
+    def block_valid(self, size, offset):
+        '''
+        returns the pixels of the block which can be processed (see
+        Level1_base.block_valid)
+        '''
+        (ysize, xsize) = size
+        (yoffset, xoffset) = offset
+
+        bitmask = self.read_band('quality_flags', size, offset)
+        invalid = bitmask & self.quality_flags['invalid'] != 0
+        if self.landmask == 'default':
+            bval = self.quality_flags['land'] + self.quality_flags['fresh_inland_water']
+            invalid |= bitmask & bval == self.quality_flags['land']
+        elif self.landmask is not None:
+            invalid |= self.landmask_data[yoffset:yoffset+ysize,
+                                          xoffset:xoffset+xsize] != 0
+        invalid |= self.read_band('SZA', size, offset) >= 90
+
+        return ~invalid
+
+    def read_block(self, size, offset, bands, read_bands=True):
 
         (ysize, xsize) = size
         (yoffset, xoffset) = offset
         nbands = len(bands)
 
         # initialize block
-        block = Block(offset=offset, size=size, bands=bands)
+        block = Block(offset=offset, size=size, bands=bands, pool=self.pool)
+
+        # read LTOA and the auxiliary datasets concurrently
+        # (each band is written to its slice of block.Ltoa)
+        block.Ltoa = block.buffer('Ltoa', (ysize,xsize,nbands), dtype='float64')
+        if self.add_noise:
+            # draw the noise sequentially, for reproducibility
+            normal = [np.random.normal(0, 1, ysize*xsize).reshape(size)
+                      for _ in bands]
+
+        def read(item):
+            (iband, band_name) = item
+            data = self.read_band(band_name, size, offset)
+            if iband is None:
+                return data
+
+            band = bands[iband]
+            if self.add_noise:
+                stdev = np.sqrt(data/self.Ltyp[band])*self.sigma_typ[band]
+                noise = stdev*normal[iband]
+            else:
+                noise = 0
+            block.Ltoa[:,:,iband] = data[:,:] + noise
+
+        # if not read_bands, Ltoa is left to NaN
+        aux = ['latitude', 'longitude', 'detector_index', 'quality_flags']
+        if read_bands:
+            items = [(iband, self.band_names[band]) for (iband, band) in enumerate(bands)]
+        else:
+            items = []
+        items += [(None, x) for x in aux]
+        aux = dict(zip(aux, self.reader.map(read, items)[len(items)-len(aux):]))
 
         # read geometry
-        block.latitude  = self.read_band('latitude',  size, offset)
-        block.longitude = self.read_band('longitude', size, offset)
+        block.latitude  = aux['latitude']
+        block.longitude = aux['longitude']
 
         # read geometry
         block.sza = self.read_band('SZA', size, offset)
@@ -241,30 +389,17 @@ class Level1_SAFE(Level1_base):
         block.saa = self.read_band('SAA', size, offset)
         block.vaa = self.read_band('OAA', size, offset)
 
-        # read LTOA
-        block.Ltoa = np.zeros((ysize,xsize,nbands)) + np.NaN
-        for iband, band in enumerate(bands):
-            Ltoa_data = self.read_band(self.band_names[band], size, offset)
-            if self.add_noise:
-                stdev = np.sqrt(Ltoa_data/self.Ltyp[band])*self.sigma_typ[band]
-                noise = stdev*np.random.normal(0, 1, stdev.size).reshape(stdev.shape)
-            else:
-                noise = 0
-            block.Ltoa[:,:,iband] = Ltoa_data[:,:] + noise
-
         # detector index
-        di = self.read_band('detector_index', size, offset)
-
-        # solar irradiance (seasonally corrected)
-        block.F0 = np.zeros((ysize, xsize, nbands), dtype='float32') + np.NaN
-        for iband, band in enumerate(bands):
-            block.F0[:,:,iband] = self.F0[self.band_index[band], di]
-
-        # detector wavelength
-        block.wavelen = np.zeros((ysize, xsize, nbands), dtype='float32') + np.NaN
+        di = aux['detector_index']
+
+        # solar irradiance (seasonally corrected) and detector wavelength
+        columns = [self.band_index[band] for band in bands]
+        block.F0 = gather_detectors(self.F0_table, di, columns,
+                                    out=block.buffer('F0', block.Ltoa.shape, fill=None))
+        block.wavelen = gather_detectors(self.wav_table, di, columns,
+                                         out=block.buffer('wavelen', block.Ltoa.shape, fill=None))
         block.cwavelen = np.zeros(nbands, dtype='float32') + np.NaN
         for iband, band in enumerate(bands):
-            block.wavelen[:,:,iband] = self.lam0[self.band_index[band], di]
             block.cwavelen[iband] = self.central_wavelength[band]
 
         # julian day and month
@@ -272,7 +407,7 @@ class Level1_SAFE(Level1_base):
         block.month = self.date().timetuple().tm_mon
 
         # quality flags
-        bitmask = self.read_band('quality_flags', size, offset)
+        bitmask = aux['quality_flags']
         block.bitmask = np.zeros(size, dtype='uint16')
         if self.landmask == 'default':
             # raise LAND mask when land is raised but not fresh_inland_water
@@ -289,6 +424,8 @@ class Level1_SAFE(Level1_base):
                                          ])
 
         l1_invalid = bitmask & self.quality_flags['invalid'] != 0
+        # invalid detector index (see gather_detectors)
+        l1_invalid |= np.isnan(block.F0).any(axis=2)
         raiseflag(block.bitmask, L2FLAGS['L1_INVALID'], l1_invalid)
 
         # read ancillary data
@@ -310,8 +447,7 @@ class Level1_SAFE(Level1_base):
         else: # ancillary files embedded in level1
 
             # read total ozone in kg/m2
-            block.ozone = self.read_band('total_ozone', size, offset)
-            block.ozone /= 2.1415e-5  # convert kg/m2 to DU
+            block.ozone = self.read_band('total_ozone', size, offset)/2.1415e-5  # convert kg/m2 to DU
 
             # read sea level pressure in hPa
             P0 = self.read_band('sea_level_pressure', size, offset)
@@ -338,25 +474,20 @@ class Level1_SAFE(Level1_base):
 
         return block
 
-    def blocks(self, bands_read):
-
-        nblocks = int(np.ceil(float(self.height)/self.blocksize))
-        for iblock in range(nblocks):
-
-            # determine block size
-            xsize = self.width
-            if iblock == nblocks-1:
-                ysize = self.height-(nblocks-1)*self.blocksize
-            else:
-                ysize = self.blocksize
-            size = (ysize, xsize)
-
-            # determine the block offset
-            xoffset = 0
-            yoffset = iblock*self.blocksize
-            offset = (yoffset, xoffset)
-
-            yield self.read_block(size, offset, bands_read)
+    def block_tiles(self, bands_read):
+        '''
+        returns the chunk shapes of the full resolution datasets read in
+        each block
+        '''
+        chunks = []
+        for band_name in ([self.band_names[b] for b in bands_read]
+                          + ['latitude', 'longitude', 'detector_index', 'quality_flags']):
+            filename, _ = self.nc_filename(band_name)
+            chunk = chunk_shape(self.get_ncroot(filename).variables[band_name])
+            if chunk is not None:
+                chunks.append(chunk)
+
+        return chunks
 
     def attributes(self, datefmt):
         attr = OrderedDict()
@@ -373,5 +504,85 @@ class Level1_SAFE(Level1_base):
         return self
 
     def __exit__(self, *args):
-        pass
+        self.reader.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+class TiePoints(object):
+    '''
+    Bilinear interpolation of tie point grids on the full resolution grid
+
+    datasets: dictionary of tie point grids (2-dim arrays of same shape)
+    al, ac: subsampling factors along and across track
+    angles: names of the datasets containing angles in degrees, which are
+        interpolated through their unit vectors (to handle the wrap-around
+        at 360°)
+
+    All datasets are interpolated together, with separable weights.
+    '''
+    def __init__(self, datasets, al, ac, angles=[]):
+        self.names = list(datasets)
+        self.angles = angles
+        self.al = al
+        self.ac = ac
+
+        layers = []
+        self.signed = {}
+        for name in self.names:
+            d = np.array(datasets[name], dtype='float64')
+            if name in angles:
+                # keep the convention of the input angles: [-180, 180] or [0, 360]
+                self.signed[name] = (d < 0).any()
+                layers += [np.cos(np.radians(d)), np.sin(np.radians(d))]
+            else:
+                layers.append(d)
+        self.data = np.stack(layers)
+
+    @staticmethod
+    def weights(start, size, factor, n):
+        '''
+        returns the indices (i0, i1) of the surrounding tie points and the
+        weight of i1, for the pixels start..start+size
+        '''
+        t = np.arange(start, start+size)/float(factor)
+        i0 = np.clip(np.floor(t).astype('int'), 0, n-1)
+        i1 = np.minimum(i0+1, n-1)
+        w = t - i0
+        return i0, i1, w
+
+    def interp(self, rows, cols):
+        '''
+        rows, cols: (start, size) of the window in the full resolution grid
+
+        returns an OrderedDict of the interpolated datasets (float32)
+        '''
+        (_, ny, nx) = self.data.shape
+        y0, y1, wy = self.weights(rows[0], rows[1], self.al, ny)
+        x0, x1, wx = self.weights(cols[0], cols[1], self.ac, nx)
+
+        # interpolate along the rows on the tie point columns,
+        # then along the columns
+        ymin, ymax = y0.min(), y1.max()+1
+        sub = self.data[:, ymin:ymax, :]
+        wy = wy[None,:,None]
+        R = (1-wy)*sub[:, y0-ymin, :] + wy*sub[:, y1-ymin, :]
+        xmin, xmax = x0.min(), x1.max()+1
+        R = R[:, :, xmin:xmax]
+        out = (1-wx)*R[:, :, x0-xmin] + wx*R[:, :, x1-xmin]
+
+        res = OrderedDict()
+        i = 0
+        for name in self.names:
+            if name in self.angles:
+                a = np.degrees(np.arctan2(out[i+1], out[i]))
+                if not self.signed[name]:
+                    a %= 360.
+                res[name] = a.astype('float32')
+                i += 2
+            else:
+                res[name] = out[i].astype('float32')
+                i += 1
+
+        return res
 
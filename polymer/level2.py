@@ -38,12 +38,15 @@ class Level2(object):
                 - hdf4 (default)
                 - netcdf4
                 - memory (returns a level2 object stored in memory)
+                - matchups (csv table of the point matchups, see matchups.py)
         other kwargs are passed to the level2 object constructor
     '''
     def __init__(self, fmt='netcdf4', **kwargs):
         if not 'ext' in kwargs:
             if fmt == 'hdf4':
                 kwargs['ext'] = '.polymer.hdf'
+            elif fmt == 'matchups':
+                kwargs['ext'] = '.polymer.csv'
             else:
                 kwargs['ext'] = '.polymer.nc'
 
@@ -59,6 +62,9 @@ class Level2(object):
         elif fmt == 'memory':
             from polymer.level2 import Level2_base
             self.Level2 = Level2_base
+        elif fmt == 'matchups':
+            from polymer.matchups import Level2_Matchups
+            self.Level2 = Level2_Matchups
         else:
             raise Exception('Invalid format "{}"'.format(fmt))
 
@@ -108,35 +114,25 @@ class Level2_base(object):
         (hei, wid) = block.size
         S = (slice(yoff,yoff+hei), slice(xoff,xoff+wid))
 
-        to_write = list(self.datasets)
-
-        for d in block.datasets():
-
-            data = block[d]
-
-            if not hasattr(data, 'ndim'):
+        # look up the requested datasets in the block (either datasets of
+        # the block, or bands of its spectral datasets, see Block.lookup)
+        missing = []
+        for d in self.datasets:
+            found = block.lookup(d)
+            if found is None:
+                missing.append(d)
                 continue
 
-            if (data.ndim == 2) and (d in self.datasets):
-                to_write.remove(d)
-                self.write_block(d, block[d], S,
-                                 block.attributes.get(d, {}))
-
-            if (data.ndim == 3):
-                if d in self.datasets:
-                    to_write.remove(d)
-                    self.write_block(d, block[d], S,
-                                     block.attributes.get(d, {}))
-                else:
-                    for iband, b in enumerate(self.bands):
-                        dd = d+str(b) 
-                        if dd in self.datasets:
-                            to_write.remove(dd)
-                            self.write_block(dd, block[d][:,:,iband], S,
-                                             block.attributes.get(d, {}))
-
-        if len(to_write) != 0:
-            raise Exception('Error, could not find requested datasets: {}'.format(', '.join(to_write)))
+            (name, iband) = found
+            if iband is None:
+                self.write_block(d, block[name], S,
+                                 block.attributes.get(name, {}))
+            else:
+                self.write_block(d, block[name][:,:,iband], S,
+                                 block.attributes.get(name, {}))
+
+        if len(missing) != 0:
+            raise Exception('Error, could not find requested datasets: {}'.format(', '.join(missing)))
 
     def attributes(self):
         return {}
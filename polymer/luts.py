@@ -2254,7 +2254,7 @@ class MLUT(object):
 def read_mlut(filename, fmt=None):
     '''
     Read a MLUT (multi-format)
-    fmt: netcdf4, hdf4
+    fmt: netcdf4, hdf4, hdf5, npy
          or None (determine format from extension)
     '''
     if fmt is None:
@@ -2262,6 +2262,8 @@ def read_mlut(filename, fmt=None):
             fmt = 'hdf4'
         elif filename.endswith('.nc'):
             fmt = 'netcdf4'
+        elif filename.endswith('.mlut'):
+            fmt = 'npy'
         else:
             raise ValueError('Cannot determine desired format '
                     'of filename "{}"'.format(filename))
@@ -2272,6 +2274,8 @@ def read_mlut(filename, fmt=None):
         return read_mlut_hdf(filename)
     elif fmt=='hdf5':
         return read_mlut_hdf5(filename)
+    elif fmt=='npy':
+        return read_mlut_npy(filename)
 
     else:
         raise ValueError('Invalid format {}'.format(fmt))
@@ -2483,6 +2487,143 @@ def read_mlut_hdf(filename, datasets=None):
 
     return m
 
+def _json_default(obj):
+    # numpy types are not serializable by the json module
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, bytes):
+        return obj.decode()
+    raise TypeError('Cannot serialize {} to json'.format(type(obj)))
+
+
+def save_mlut_npy(mlut, dirname, source=None):
+    '''
+    Save a MLUT as a directory of uncompressed .npy files
+    (one per axis and per dataset) plus a json file for the metadata.
+    This format can be read back with memory mapping (see read_mlut_npy).
+
+    The directory is first written under a temporary name, then renamed, so
+    that concurrent processes never see a partially written MLUT.
+
+    source: optional dictionary stored in the metadata, used by
+            read_mlut_cached to check that the cache is up to date
+    '''
+    import json
+    from tempfile import mkdtemp
+    from os.path import join, dirname as parentdir, basename
+    from os import rename
+    from shutil import rmtree
+
+    tmpdir = mkdtemp(dir=parentdir(dirname) or '.',
+                     prefix=basename(dirname)+'.tmp')
+    try:
+        meta = {'axes': [], 'datasets': [],
+                'attrs': dict(mlut.attrs),
+                'source': source}
+        for i, (name, ax) in enumerate(mlut.axes.items()):
+            fname = 'axis_{:03d}.npy'.format(i)
+            np.save(join(tmpdir, fname), np.ascontiguousarray(ax))
+            meta['axes'].append({'name': name, 'file': fname})
+
+        for i, (name, data, axnames, attrs) in enumerate(mlut.data):
+            fname = 'data_{:03d}.npy'.format(i)
+            np.save(join(tmpdir, fname), np.ascontiguousarray(data))
+            meta['datasets'].append({'name': name, 'file': fname,
+                                     'axes': list(axnames),
+                                     'attrs': dict(attrs)})
+
+        with open(join(tmpdir, 'mlut.json'), 'w') as fp:
+            json.dump(meta, fp, default=_json_default)
+
+        if exists(dirname):
+            rmtree(dirname)
+        rename(tmpdir, dirname)
+    except:
+        rmtree(tmpdir, ignore_errors=True)
+        raise
+
+
+def read_mlut_npy(dirname, mmap_mode='r'):
+    '''
+    Read a MLUT saved with save_mlut_npy
+
+    mmap_mode: passed to np.load. With the default 'r', the arrays are memory
+               mapped: loading is immediate and the physical pages are shared
+               between all processes reading the same MLUT.
+    '''
+    import json
+    from os.path import join
+
+    with open(join(dirname, 'mlut.json')) as fp:
+        meta = json.load(fp)
+
+    m = MLUT()
+    for ax in meta['axes']:
+        m.add_axis(str(ax['name']),
+                   np.load(join(dirname, ax['file']), mmap_mode=mmap_mode))
+    for ds in meta['datasets']:
+        m.add_dataset(str(ds['name']),
+                      np.load(join(dirname, ds['file']), mmap_mode=mmap_mode),
+                      axnames=ds['axes'],
+                      attrs=ds['attrs'])
+    m.set_attrs(meta['attrs'])
+
+    return m
+
+
+def read_mlut_cached(filename, cache_dir=None, verbose=False):
+    '''
+    Read a MLUT (hdf4 or netcdf4, see read_mlut) through a memory-mapped cache
+
+    On first use, the MLUT is converted to the npy format (see save_mlut_npy)
+    in cache_dir (by default, next to filename, with extension .mlut).
+    Subsequent calls read the cache with memory mapping.
+    The cache is regenerated if the size or modification time of filename
+    have changed.
+
+    If the cache can not be written (read-only directory), falls back to a
+    direct read of filename.
+    '''
+    import json
+    from os import stat
+    from os.path import join, basename, splitext, isdir
+
+    if not exists(filename):
+        raise IOError(f'File not found ({filename})')
+
+    st = stat(filename)
+    source = {'filename': basename(filename),
+              'size': st.st_size,
+              'mtime': st.st_mtime}
+
+    if cache_dir is None:
+        cache = splitext(filename)[0] + '.mlut'
+    else:
+        cache = join(cache_dir, splitext(basename(filename))[0] + '.mlut')
+
+    if isdir(cache):
+        try:
+            with open(join(cache, 'mlut.json')) as fp:
+                up_to_date = (json.load(fp)['source'] == source)
+        except (IOError, ValueError, KeyError):
+            up_to_date = False
+        if up_to_date:
+            return read_mlut_npy(cache)
+
+    mlut = read_mlut(filename)
+    try:
+        if verbose:
+            print('Writing MLUT cache "{}"'.format(cache))
+        save_mlut_npy(mlut, cache, source=source)
+    except (IOError, OSError) as e:
+        warnings.warn('Could not write MLUT cache "{}" ({})'.format(cache, e))
+        return mlut
+
+    return read_mlut_npy(cache)
+
+
 def from_xarray(A):
     """
     Convert xarray object `A` (`Dataset` or `DataArray`) to MLUT or LUT.
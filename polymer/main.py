@@ -5,18 +5,27 @@
 from __future__ import print_function, division, absolute_import
 
 import numpy as np
-from polymer.luts import read_mlut_hdf, Idx
+from polymer.luts import read_mlut_hdf, read_mlut_cached, Idx
 from polymer.utils import stdNxN, raiseflag
 from polymer.common import L2FLAGS
-from pyhdf.SD import SD
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 from datetime import datetime
+from collections import OrderedDict
 from polymer.params import Params
-from polymer.bodhaine import rod
+from polymer.bodhaine import RayleighODTable
+from polymer.rayleigh import RayleighLUT, FIXED_BANDS_SENSORS, pressure_scaling
+from polymer.no2 import NO2Climatology
 from polymer.polymer_main import PolymerMinimizer
+from polymer.preprocessing import toa_correction, rayleigh_interp
 from polymer.water import ParkRuddick, MorelMaritorena
 from warnings import warn
+from os import getpid
+from os.path import dirname
+from time import time
 from polymer.uncertainties import toa_uncertainties
+from polymer.matchups import (read_targets, locate_targets, matchup_blocks,
+                              Level2_Matchups)
+from polymer.block import BufferPool
 
 import sys
 if sys.version_info[:2] >= (3, 0):
@@ -39,7 +48,41 @@ class InitCorr(object):
         self.params = params
 
         # read the look-up table
-        self.mlut = read_mlut_hdf(params.lut_file)
+        self.load_lut()
+
+        # sensor-specific Rayleigh LUTs (initialized with the first block)
+        self.rlut = None
+
+        # NO2 climatology (loaded on first use)
+        self.no2 = None
+
+    def load_lut(self):
+        '''
+        Read the generic look-up table, through its memory-mapped cache if
+        params.lut_cache is set
+        '''
+        if self.params.lut_cache:
+            self.mlut = read_mlut_cached(self.params.lut_file,
+                                         cache_dir=self.params.lut_cache_dir,
+                                         verbose=self.params.verbose)
+        else:
+            self.mlut = read_mlut_hdf(self.params.lut_file)
+
+        # a memory-mapped LUT is re-opened instead of being pickled
+        self.lut_mapped = all([isinstance(x[1], np.memmap)
+                               for x in self.mlut.data])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['generic_luts'] = None   # rebuilt from mlut
+        if self.lut_mapped:
+            state['mlut'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.mlut is None:
+            self.load_lut()
 
 
     def init_minimizer(self):
@@ -101,7 +144,7 @@ class InitCorr(object):
         if hasattr(block, 'Rtoa'):
             return
 
-        block.Rtoa = np.zeros(block.Ltoa.shape)+np.NaN
+        block.Rtoa = block.buffer('Rtoa')
 
         ok = (block.bitmask & self.params.BITMASK_INVALID) == 0
 
@@ -121,79 +164,22 @@ class InitCorr(object):
             block.Rtoa[ok,i] *= self.params.calib[b]
 
 
-    def read_no2_data(self, month):
-        '''
-        read no2 data from month (1..12) or for all months if month < 0
-
-        shape of arrays is (month, lat, lon)
-        '''
-        hdf1 = SD(self.params.no2_climatology)
-        hdf2 = SD(self.params.no2_frac200m)
-
-        if month < 0:
-            months = range(1, 13)
-            nmo = 12
-        else:
-            months = [month]
-            nmo = 1
-
-        self.no2_total_data = np.zeros((nmo,720,1440), dtype='float32')
-        self.no2_tropo_data = np.zeros((nmo,720,1440), dtype='float32')
-        self.no2_frac200m_data = np.zeros((90,180), dtype='float32')
-
-
-        for i, m in enumerate(months):
-            # read total and tropospheric no2 data
-            self.no2_total_data[i,:,:] = hdf1.select('tot_no2_{:02d}'.format(m)).get()
-
-            self.no2_tropo_data[i,:,:] = hdf1.select('trop_no2_{:02d}'.format(m)).get()
-
-        # read fraction of tropospheric NO2 above 200mn
-        self.no2_frac200m_data[:,:] = hdf2.select('f_no2_200m').get()
-
-        hdf1.end()
-        hdf2.end()
-
-
     def get_no2(self, block):
         '''
         returns no2_frac, no2_tropo, no2_strat at the pixels coordinates
         '''
-        ok = (block.bitmask & self.params.BITMASK_INVALID) == 0
-
-        # get month
-        if isinstance(block.month, np.ndarray):
-            mon = -1
-            imon = block.month-1
-        else:
-            mon = block.month
-            imon = 0
-
-        try:
-            self.no2_tropo_data
-        except:
-            self.read_no2_data(mon)
-
-        # coordinates of current block in 1440x720 grid
-        ilat = (4*(90 - block.latitude)).astype('int')
-        ilon = (4*block.longitude).astype('int')
-        ilon[ilon<0] += 4*360
-        ilat[~ok] = 0
-        ilon[~ok] = 0
-
-        no2_tropo = self.no2_tropo_data[imon,ilat,ilon]*1e15
-        no2_strat = (self.no2_total_data[imon,ilat,ilon]
-                     - self.no2_tropo_data[imon,ilat,ilon])*1e15
+        params = self.params
+        ok = (block.bitmask & params.BITMASK_INVALID) == 0
 
-        # coordinates of current block in 90x180 grid
-        ilat = (0.5*(90 - block.latitude)).astype('int')
-        ilon = (0.5*(block.longitude)).astype('int')
-        ilon[ilon<0] += 180
-        ilat[~ok] = 0
-        ilon[~ok] = 0
-        no2_frac = self.no2_frac200m_data[ilat,ilon]
+        if self.no2 is None:
+            self.no2 = NO2Climatology(params.no2_climatology,
+                                      params.no2_frac200m,
+                                      cache=params.lut_cache,
+                                      cache_dir=params.lut_cache_dir,
+                                      interp=params.no2_interp,
+                                      verbose=params.verbose)
 
-        return no2_frac, no2_tropo, no2_strat
+        return self.no2.get(block.latitude, block.longitude, block.month, ok)
 
 
     def gas_correction(self, block):
@@ -204,7 +190,7 @@ class InitCorr(object):
         if self.params.partial >= 4:
             return
 
-        block.Rtoa_gc = np.zeros(block.Rtoa.shape, dtype='float32') + np.NaN
+        block.Rtoa_gc = block.buffer('Rtoa_gc')
         nightpixel = block.sza >= 90
 
         ok = (block.bitmask & self.params.BITMASK_INVALID) == 0
@@ -273,12 +259,11 @@ class InitCorr(object):
         # calculate Rayleigh optical thickness
         # for NIR band
         inir_read = params.bands_read().index(params.band_cloudmask)
-        wav = block.wavelen[ok, inir_read]
         if not hasattr(block, 'tau_ray'):
             # default: calculate Rayleigh optical thickness on the fly
-            tau_ray = rod(wav/1000., 400., 45.,
-                          block.altitude[ok],
-                          block.surf_press[ok])
+            rodt = RayleighODTable(block.wavelen[ok, inir_read][:, None])
+            tau_ray = rodt.band(0, rodt.factor(block.surf_press[ok],
+                                               block.altitude[ok]))
         else:
             # if level1 provides its Rayleigh optical thickness, use it
             tau_ray = block.tau_ray[ok, inir_read]
@@ -300,13 +285,36 @@ class InitCorr(object):
         raiseflag(block.bitmask, L2FLAGS['CLOUD_BASE'], cloudmask)
 
 
+    def get_rayleigh_lut(self, block):
+        '''
+        Returns the Rayleigh LUTs specialized for the current sensor and bands
+        (see rayleigh.py), or None if they do not apply
+        '''
+        params = self.params
+        if (not params.rayleigh_lut) or (params.sensor not in FIXED_BANDS_SENSORS):
+            return None
+
+        if (self.rlut is None) or (self.rlut.bands != list(block.bands)):
+            if not params.lut_cache:
+                cache_dir = None
+            elif params.lut_cache_dir is None:
+                cache_dir = dirname(params.lut_file)
+            else:
+                cache_dir = params.lut_cache_dir
+            self.rlut = RayleighLUT(self.mlut, params.sensor,
+                                    block.bands, block.cwavelen,
+                                    cache_dir=cache_dir,
+                                    verbose=params.verbose)
+
+        return self.rlut
+
+
     def rayleigh_correction(self, block):
         '''
         Rayleigh correction
         + transmission interpolation
         '''
         params = self.params
-        mlut = self.mlut
         if params.partial >= 2:
             return
 
@@ -315,43 +323,17 @@ class InitCorr(object):
         raiseflag(block.bitmask, L2FLAGS['HIGH_AIR_MASS'],
                   block.air_mass > 5.)
 
-        block.Rprime = np.zeros(block.Rtoa.shape, dtype='float32')+np.NaN
-        block.Rprime_noglint = np.zeros(block.Rtoa.shape, dtype='float32')+np.NaN
-        block.Rmol = np.zeros(block.Rtoa.shape, dtype='float32')+np.NaN
-        block.Rmolgli = np.zeros(block.Rtoa.shape, dtype='float32')+np.NaN
-        block.Tmol = np.zeros(block.Rtoa.shape, dtype='float32')+np.NaN
+        block.Rprime = block.buffer('Rprime')
+        block.Rprime_noglint = block.buffer('Rprime_noglint')
+        block.Rmol = block.buffer('Rmol')
+        block.Rmolgli = block.buffer('Rmolgli')
+        block.Tmol = block.buffer('Tmol')
 
         ok = (block.bitmask & self.params.BITMASK_INVALID) == 0
 
-        for i in xrange(block.nbands):
-            wind = block.wind_speed[ok]
-            wmax = np.amax(mlut.axis('dim_wind'))
-            wind[wind > wmax] = wmax  # clip to max wind
-
-            # calculate Rayleigh optical thickness
-            # for current band
-            wav = block.wavelen[ok, i]
-            if not hasattr(block, 'tau_ray'):
-                # default: calculate Rayleigh optical thickness on the fly
-                tau_ray = rod(wav/1000., 400., 45.,
-                              block.altitude[ok],
-                              block.surf_press[ok])
-            else:
-                # if level1 provides its Rayleigh optical thickness, use it
-                tau_ray = block.tau_ray[ok,i]
-
-            Rmolgli = mlut['Rmolgli'][
-                    Idx(block.muv[ok]),
-                    Idx(block.raa[ok]),
-                    Idx(block.mus[ok]),
-                    Idx(tau_ray),
-                    Idx(wind)]
-            Rmol = mlut['Rmol'][
-                    Idx(block.muv[ok]),
-                    Idx(block.raa[ok]),
-                    Idx(block.mus[ok]),
-                    Idx(tau_ray)]
+        for i, (Rmol, Rmolgli, Tmol) in enumerate(self.rayleigh_lookup(block, ok)):
 
+            block.Tmol[ok,i] = Tmol
             block.Rmolgli[ok,i] = Rmolgli
             block.Rmol[ok,i] = Rmol
 
@@ -362,16 +344,199 @@ class InitCorr(object):
 
             block.Rprime_noglint[ok,i] = block.Rtoa_gc[ok,i] - Rmol
 
-            # TODO: share axes indices
-            # and across wavelengths
-            block.Tmol[ok,i]  = mlut['Tmolgli'][
-                    Idx(block.mus[ok]),
-                    Idx(tau_ray),
-                    Idx(wind)]
-            block.Tmol[ok,i] *= mlut['Tmolgli'][
-                    Idx(block.muv[ok]),
-                    Idx(tau_ray),
-                    Idx(wind)]
+
+    def rayleigh_lookup(self, block, ok):
+        '''
+        Interpolate the Rayleigh LUTs at the pixels ok
+        yields Rmol, Rmolgli and Tmol (two-way transmission) for each band
+        '''
+        mlut = self.mlut
+
+        wind = block.wind_speed[ok]
+        wmax = np.amax(mlut.axis('dim_wind'))
+        wind[wind > wmax] = wmax  # clip to max wind
+
+        rlut = self.get_rayleigh_lut(block)
+        if rlut is not None:
+            # sensor-specific LUTs: the indices of the geometry, wind and
+            # pressure are shared across bands
+            index = rlut.index(block.muv[ok], block.raa[ok], block.mus[ok], wind)
+            if not hasattr(block, 'tau_ray'):
+                index_s = rlut.index_press(pressure_scaling(
+                    block.surf_press[ok], block.altitude[ok]))
+        elif not hasattr(block, 'tau_ray'):
+            # spectral and pressure dependencies of the Rayleigh optical
+            # thickness are calculated once for all bands
+            rodt = RayleighODTable(block.wavelen[ok])
+            press_factor = rodt.factor(block.surf_press[ok], block.altitude[ok])
+
+        for i in xrange(block.nbands):
+
+            if rlut is not None:
+                if hasattr(block, 'tau_ray'):
+                    # scaling factor of the optical thickness provided by level1
+                    index_s = rlut.index_press(block.tau_ray[ok,i]/rlut.tau_ref[i])
+                Rmol, Rmolgli, Tmol = rlut.get(i, index, index_s)
+
+            else:
+                # calculate Rayleigh optical thickness
+                # for current band
+                if not hasattr(block, 'tau_ray'):
+                    # default: calculate Rayleigh optical thickness on the fly
+                    tau_ray = rodt.band(i, press_factor)
+                else:
+                    # if level1 provides its Rayleigh optical thickness, use it
+                    tau_ray = block.tau_ray[ok,i]
+
+                Rmolgli = mlut['Rmolgli'][
+                        Idx(block.muv[ok]),
+                        Idx(block.raa[ok]),
+                        Idx(block.mus[ok]),
+                        Idx(tau_ray),
+                        Idx(wind)]
+                Rmol = mlut['Rmol'][
+                        Idx(block.muv[ok]),
+                        Idx(block.raa[ok]),
+                        Idx(block.mus[ok]),
+                        Idx(tau_ray)]
+
+                # TODO: share axes indices
+                # and across wavelengths
+                Tmol = mlut['Tmolgli'][
+                        Idx(block.mus[ok]),
+                        Idx(tau_ray),
+                        Idx(wind)].astype('float32')
+                Tmol = (Tmol * mlut['Tmolgli'][
+                        Idx(block.muv[ok]),
+                        Idx(tau_ray),
+                        Idx(wind)]).astype('float32')
+
+            yield Rmol, Rmolgli, Tmol
+
+
+    def rayleigh_indices(self, block, ok):
+        '''
+        Float indices of the pixels ok in the Rayleigh LUTs, for
+        preprocessing.rayleigh_interp
+
+        Returns (luts, index, itau):
+            luts: the LUTs Rmol, Rmolgli and Tmolgli, with a leading band axis
+                (of length 1 if shared by all bands)
+            index: the indices (muv, raa, mus, wind), shared by all bands
+            itau: the indices of the optical thickness (or of its pressure
+                scaling factor), of shape (N, nbands), or (N, 1) if shared by
+                all bands
+        '''
+        mlut = self.mlut
+        f64 = lambda x: np.ascontiguousarray(x, dtype='float64')
+
+        wind = block.wind_speed[ok]
+        wmax = np.amax(mlut.axis('dim_wind'))
+        wind[wind > wmax] = wmax  # clip to max wind
+
+        rlut = self.get_rayleigh_lut(block)
+        if rlut is not None:
+            luts = [rlut.mlut[name].data for name in ['Rmol', 'Rmolgli', 'Tmolgli']]
+            index = rlut.index(block.muv[ok], block.raa[ok], block.mus[ok], wind)
+            if hasattr(block, 'tau_ray'):
+                itau = rlut.index_press(block.tau_ray[ok]/rlut.tau_ref)
+            else:
+                itau = rlut.index_press(pressure_scaling(
+                    block.surf_press[ok], block.altitude[ok]))[:,None]
+        else:
+            if getattr(self, 'generic_luts', None) is None:
+                # LUTs of the same dtype, with a band axis
+                luts = [mlut[name].data for name in ['Rmol', 'Rmolgli', 'Tmolgli']]
+                dtype = np.result_type(*luts)
+                if dtype not in [np.float32, np.float64]:
+                    dtype = np.float64
+                self.generic_luts = [np.asarray(x, dtype=dtype)[None] for x in luts]
+            luts = self.generic_luts
+            axes = mlut['Rmolgli'].axes
+            index = (Idx(block.muv[ok]).index(axes[0]),
+                     Idx(block.raa[ok]).index(axes[1]),
+                     Idx(block.mus[ok]).index(axes[2]),
+                     Idx(wind).index(axes[4]))
+            if hasattr(block, 'tau_ray'):
+                tau_ray = block.tau_ray[ok]
+            else:
+                rodt = RayleighODTable(block.wavelen[ok])
+                press_factor = rodt.factor(block.surf_press[ok], block.altitude[ok])
+                tau_ray = np.stack([rodt.band(i, press_factor)
+                                    for i in xrange(block.nbands)], axis=-1)
+            itau = Idx(tau_ray).index(axes[3])
+
+        return luts, [f64(x) for x in index], f64(itau).reshape(len(wind), -1)
+
+    def fused_corrections(self, block):
+        '''
+        Conversion to reflectance, calibration, gaseous correction, cloud mask
+        and Rayleigh correction, using the fused pixel loops of
+        preprocessing.pyx (equivalent to the successive calls to
+        convert_reflectance, apply_calib, gas_correction, cloudmask and
+        rayleigh_correction)
+        '''
+        params = self.params
+
+        # the night pixels are converted to reflectance, but not corrected
+        # (as in convert_reflectance and gas_correction)
+        valid = (block.bitmask & params.BITMASK_INVALID) == 0
+        nightpixel = block.sza >= 90
+        raiseflag(block.bitmask, L2FLAGS['EXCEPTION'], nightpixel)
+        ok = (block.bitmask & params.BITMASK_INVALID) == 0
+
+        # make sure that ozone is in DU
+        ozone_warn = (block.ozone[ok] < 50) | (block.ozone[ok] > 1000)
+        if ozone_warn.any():
+            warn('ozone is assumed in DU ({})'.format(block.ozone[ok][ozone_warn]))
+
+        no2_frac, no2_tropo, no2_strat = self.get_no2(block)
+        no2_tr200 = no2_frac * no2_tropo
+        no2_tr200[no2_tr200<0] = 0
+
+        # per-band coefficients
+        if params.calib is None:
+            calib = np.ones(block.nbands)
+        else:
+            calib = np.array([params.calib[b] for b in block.bands], dtype='float64')
+        K_OZ = np.array([params.K_OZ[b] for b in block.bands], dtype='float64')
+        K_NO2 = np.array([params.K_NO2[b] for b in block.bands], dtype='float64')
+        a_285 = K_NO2 * (1.0 - 0.003*(285.0-294.0))
+        a_225 = K_NO2 * (1.0 - 0.003*(225.0-294.0))
+
+        f32 = lambda x: np.asarray(x).astype('float32', copy=False)
+        if hasattr(block, 'Rtoa'):
+            block.Rtoa = f32(block.Rtoa)
+            Ltoa, F0 = None, None
+        else:
+            block.Rtoa = block.buffer('Rtoa', dtype='float32')
+            Ltoa, F0 = f32(block.Ltoa), f32(block.F0)
+        block.Rtoa_gc = block.buffer('Rtoa_gc')
+
+        toa_correction(block.Rtoa, block.Rtoa_gc, valid.view('uint8'), ok.view('uint8'),
+                       f32(block.mus), f32(block.muv), f32(block.air_mass),
+                       f32(block.ozone), f32(no2_tr200), f32(no2_strat),
+                       calib, K_OZ, a_285, a_225, Ltoa=Ltoa, F0=F0)
+
+        self.cloudmask(block)
+
+        raiseflag(block.bitmask, L2FLAGS['HIGH_AIR_MASS'],
+                  block.air_mass > 5.)
+
+        block.Rprime = block.buffer('Rprime')
+        block.Rprime_noglint = block.buffer('Rprime_noglint')
+        block.Rmol = block.buffer('Rmol')
+        block.Rmolgli = block.buffer('Rmolgli')
+        block.Tmol = block.buffer('Tmol')
+
+        ok = (block.bitmask & params.BITMASK_INVALID) == 0
+        luts, (imuv, iraa, imus, iwind), itau = self.rayleigh_indices(block, ok)
+
+        rayleigh_interp(block.Rtoa_gc, ok.view('uint8'), *luts,
+                        imuv, iraa, imus, iwind, itau,
+                        block.Rprime, block.Rprime_noglint,
+                        block.Rmol, block.Rmolgli, block.Tmol,
+                        int(params.glint_precorrection))
 
 
     def set_attributes(self, block):
@@ -396,36 +561,77 @@ def process_block(args):
     '''
 
     (block, c, opt) = args
+    t0 = time()
 
     if opt is None:
         opt = c.init_minimizer()
 
     c.preprocessing(block)
 
-    c.convert_reflectance(block)
+    if c.params.fused_preprocessing and (c.params.partial < 2):
+        c.fused_corrections(block)
+    else:
+        c.convert_reflectance(block)
 
-    c.apply_calib(block)
+        c.apply_calib(block)
 
-    c.gas_correction(block)
+        c.gas_correction(block)
 
-    c.cloudmask(block)
+        c.cloudmask(block)
 
-    c.rayleigh_correction(block)
+        c.rayleigh_correction(block)
 
     opt.minimize(block)
 
     c.set_attributes(block)
 
+    # for the load balance report
+    block.processing_time = time() - t0
+    block.worker = getpid()
+
     return block
 
 
-def blockiterator(level1, params, multi=False):
+def load_balance(times, nworkers):
+    '''
+    returns a summary of the load balance of the processing, from the list
+    of (worker, processing time, estimated cost) of the blocks, for
+    nworkers workers
+
+    The efficiency is the ratio of the total processing time to nworkers
+    times the processing time of the busiest worker (1 if all workers are
+    busy for the same time).
+    '''
+    busy = {}
+    for worker, t, _ in times:
+        busy[worker] = busy.get(worker, 0.) + t
+    busy = list(busy.values()) + [0.]*max(nworkers - len(busy), 0)
+    summary = OrderedDict()
+    summary['workers'] = nworkers
+    summary['blocks'] = len(times)
+    summary['busy_min'] = min(busy) if busy else 0.
+    summary['busy_max'] = max(busy) if busy else 0.
+    summary['efficiency'] = sum(busy)/(nworkers*summary['busy_max']) if summary['busy_max'] else 1.
+
+    # correlation of the estimated costs and the processing times
+    est = [(c, t) for (_, t, c) in times if c is not None]
+    if len(est) > 1:
+        c, t = np.array(est).T
+        if c.std() and t.std():
+            summary['cost_correlation'] = np.corrcoef(c, t)[0, 1]
+
+    return summary
+
+
+def blockiterator(level1, params, multi=False, windows=None):
     '''
     Block iterator
     if multi (boolean), iterate in multiprocessing mode:
         The minimizer is created in the processing function instead of here,
         because as a cython class it is not picklable.
     Otherwise, the minimizer is created once.
+    windows: iterate over the windows of the point matchups instead of the
+        whole level1 (see matchups.locate_targets)
     '''
 
     c = InitCorr(params)
@@ -435,7 +641,25 @@ def blockiterator(level1, params, multi=False):
     else:
         opt = c.init_minimizer()
 
-    for block in level1.blocks(params.bands_read()):
+    if windows is not None:
+        blocks = matchup_blocks(level1, windows, params.bands_read())
+    elif multi and params.schedule and hasattr(level1, 'valid_profiles'):
+        nworkers = params.multiprocessing if params.multiprocessing > 0 else cpu_count()
+        blocks = level1.blocks(params.bands_read(), nworkers=nworkers,
+                               split=params.schedule_split)
+    elif params.prescan and hasattr(level1, 'prescan'):
+        blocks = level1.blocks(params.bands_read(), prescan=True)
+    else:
+        if params.prescan:
+            warn('prescan is not supported by {}'.format(level1.__class__.__name__))
+        blocks = level1.blocks(params.bands_read())
+
+    for iblock, block in enumerate(blocks):
+
+        if iblock == 0:
+            # initialize the sensor-specific Rayleigh LUTs before
+            # they are passed to the processing function
+            c.get_rayleigh_lut(block)
 
         if params.verbose:
             print('Processing', block)
@@ -445,7 +669,7 @@ def blockiterator(level1, params, multi=False):
 
 
 
-def run_atm_corr(level1, level2, **kwargs):
+def run_atm_corr(level1, level2, targets=None, **kwargs):
     '''
     Polymer atmospheric correction: main function
     https://www.osapublishing.org/oe/abstract.cfm?uri=oe-19-10-9783
@@ -473,6 +697,13 @@ def run_atm_corr(level1, level2, **kwargs):
         Level2('memory')   # store output in memory
         # using specific level2 classes
         Level2_NETCDF('out.nc', overwrite=True)
+        Level2(fmt='matchups')  # point matchups (requires targets)
+
+    targets: point matchup mode (see matchups.py)
+        list of targets (latitude, longitude[, time_start, time_end[, box]]),
+        or a DataFrame with these columns (see matchups.read_targets)
+        Only the windows around the targets are read and processed, and the
+        results are written to a table by Level2(fmt='matchups').
 
     Additional keyword arguments:
     see attributes defined in Params class
@@ -503,6 +734,23 @@ def run_atm_corr(level1, level2, **kwargs):
         params.preprocess(l1)
 
         l2.init(l1)
+        l1.verbose = params.verbose
+
+        if (targets is not None) != isinstance(l2, Level2_Matchups):
+            raise Exception('The matchup mode requires both targets and '
+                            'a matchup level2 (Level2(fmt="matchups"))')
+        if targets is not None:
+            windows = locate_targets(l1, read_targets(targets))
+        else:
+            windows = None
+
+        # buffer pool for the block arrays
+        # (only in single process mode: the blocks are not shared across
+        # processes)
+        buffers = None
+        if params.buffer_pool and (params.multiprocessing == 0):
+            buffers = BufferPool()
+            l1.pool = buffers
 
         # initialize the block iterator
         if params.multiprocessing != 0:
@@ -512,14 +760,24 @@ def run_atm_corr(level1, level2, **kwargs):
                 nproc = params.multiprocessing
             pool = Pool(nproc)
             block_iter = pool.imap_unordered(process_block,
-                    blockiterator(l1, params, True))
+                    blockiterator(l1, params, True, windows))
         else:
             block_iter = imap(process_block,
-                    blockiterator(l1, params, False))
+                    blockiterator(l1, params, False, windows))
 
         # loop over the blocks
+        times = []
         for block in block_iter:
+            times.append((block.worker, block.processing_time,
+                          getattr(block, 'estimated_cost', None)))
             l2.write(block)
+            if buffers is not None:
+                buffers.release(block)
+
+        if buffers is not None:
+            l1.pool = None
+            if params.verbose:
+                print(buffers)
 
         # finalize level2 file and include global attributes
         params.processing_duration = datetime.now()-t0
@@ -532,6 +790,14 @@ def run_atm_corr(level1, level2, **kwargs):
         l2.finish(params)
 
         if params.verbose:
+            if params.multiprocessing != 0:
+                lb = load_balance(times, nproc or cpu_count())
+                print('Load balance: {} blocks on {} workers, busy time {:.1f}s '
+                      'to {:.1f}s per worker, efficiency {:.1f}%{}'.format(
+                          lb['blocks'], lb['workers'], lb['busy_min'],
+                          lb['busy_max'], 100*lb['efficiency'],
+                          ', cost estimate correlation {:.2f}'.format(lb['cost_correlation'])
+                          if 'cost_correlation' in lb else ''))
             print('Done in {}'.format(datetime.now()-t0))
 
         return l2
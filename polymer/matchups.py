@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Point matchups: processing of small windows around a list of targets
+(in-situ stations), and output of a table of results
+
+Example:
+    targets = [(43.1, 5.9), (43.3, 5.2, datetime(2020, 5, 2), datetime(2020, 5, 4), 5)]
+    run_atm_corr(Level1(<filename>),
+                 Level2(fmt='matchups', outdir='/data/'),
+                 targets=targets)
+'''
+
+from __future__ import print_function, division, absolute_import
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from polymer.level2 import Level2_file
+from polymer.level1 import sample_cells
+
+
+target_columns = ['latitude', 'longitude', 'time_start', 'time_end', 'box']
+
+
+def read_targets(targets, box=3):
+    '''
+    returns the targets as a DataFrame
+
+    targets: a DataFrame, or a list of tuples
+        (latitude, longitude[, time_start, time_end[, box]])
+        Optional columns:
+            - time_start, time_end: the target is processed only if the
+              level1 date is within [time_start, time_end]
+            - box: size of the box of box x box pixels around the target
+              (odd integer)
+            Other columns (station names...) are copied to the output
+    box: default box size
+    '''
+    if isinstance(targets, pd.DataFrame):
+        targets = targets.copy()
+    else:
+        targets = [tuple(t) for t in targets]
+        ncol = max([len(t) for t in targets]) if targets else 2
+        targets = pd.DataFrame(targets, columns=target_columns[:ncol])
+
+    if 'box' not in targets.columns:
+        targets['box'] = box
+    targets['box'] = targets['box'].fillna(box).astype('int')
+    if (targets['box'] % 2 == 0).any():
+        raise Exception('The size of the boxes should be odd')
+
+    return targets
+
+
+def level1_date(level1):
+    '''
+    returns the date of level1, or None if not available
+    '''
+    date = getattr(level1, 'date', None)
+    if callable(date):
+        date = date()
+    return date
+
+
+def locate(latitude, longitude, rows, cols, shape, lat, lon):
+    '''
+    returns the position (row, col) of (lat, lon) in the product grid of
+    shape (totalheight, totalwidth) from the coarse geolocation (latitude,
+    longitude) at the positions rows and cols (see
+    Level1_base.coarse_latlon), or None if it is outside the product
+    '''
+    coslat = np.cos(np.radians(lat))
+    dlat = latitude - lat
+    dlon = coslat*((longitude - lon + 180) % 360 - 180)
+    dist = np.sqrt(dlat**2 + dlon**2)
+    if np.isnan(dist).all():
+        return None
+    (i, j) = np.unravel_index(np.nanargmin(dist), dist.shape)
+
+    # local derivatives of the geolocation
+    i0, i1 = max(i-1, 0), min(i+1, len(rows)-1)
+    j0, j1 = max(j-1, 0), min(j+1, len(cols)-1)
+    J = np.array([
+        [(dlat[i1, j] - dlat[i0, j])/max(rows[i1] - rows[i0], 1),
+         (dlat[i, j1] - dlat[i, j0])/max(cols[j1] - cols[j0], 1)],
+        [(dlon[i1, j] - dlon[i0, j])/max(rows[i1] - rows[i0], 1),
+         (dlon[i, j1] - dlon[i, j0])/max(cols[j1] - cols[j0], 1)],
+        ])
+    if not np.isfinite(J).all() or (abs(np.linalg.det(J)) == 0):
+        return None
+    (dr, dc) = np.linalg.solve(J, -np.array([dlat[i, j], dlon[i, j]]))
+
+    # the target should be within the extent of the sample
+    (row, col) = (int(round(rows[i] + dr)), int(round(cols[j] + dc)))
+    (ylo, yhi) = sample_cells(rows, shape[0])
+    (xlo, xhi) = sample_cells(cols, shape[1])
+    if not ((ylo[i] <= row <= yhi[i]) and (xlo[j] <= col <= xhi[j])):
+        return None
+
+    return row, col
+
+
+def aligned(start, stop, origin, align, length):
+    '''
+    returns the interval [start, stop) of a window axis (relative to origin),
+    widened to multiples of align in the product grid and clipped to
+    [0, length)
+    '''
+    start = align*((origin + start)//align) - origin
+    stop = -align*(-(origin + stop)//align) - origin
+    return max(start, 0), min(stop, length)
+
+
+def locate_targets(level1, targets, margin=3):
+    '''
+    locates the targets (see read_targets) in level1
+
+    Returns a list of windows (target, size, offset) to read with
+    read_block, where target is a dict of the target columns (with its
+    index), and the window includes a margin around the box of each target.
+    The window is widened so that its boundaries are multiples of the
+    alignment of level1 (level1.align) in the product grid.
+
+    The position of the targets is estimated from the coarse geolocation of
+    level1 (coarse_latlon), and refined on the full resolution geolocation
+    of the window (see Level2_Matchups). The margin also avoids the
+    effects of the window edges on the cloud mask.
+    '''
+    date = level1_date(level1)
+    latitude, longitude, rows, cols = level1.coarse_latlon()
+    sline = getattr(level1, 'sline', 0)
+    scol = getattr(level1, 'scol', 0)
+    (height, width) = (level1.height, level1.width)
+    align = getattr(level1, 'align', 1)
+
+    windows = []
+    for index, t in targets.iterrows():
+        if date is not None:
+            if ('time_start' in t) and pd.notnull(t['time_start']) and (date < t['time_start']):
+                continue
+            if ('time_end' in t) and pd.notnull(t['time_end']) and (date > t['time_end']):
+                continue
+
+        pos = locate(latitude, longitude, rows, cols,
+                     (level1.totalheight, level1.totalwidth),
+                     t['latitude'], t['longitude'])
+        if pos is None:
+            continue
+
+        # window relative to the level1 window
+        (row, col) = (pos[0] - sline, pos[1] - scol)
+        half = t['box']//2 + margin
+        ystart, ystop = aligned(row-half, row+half+1, sline, align, height)
+        xstart, xstop = aligned(col-half, col+half+1, scol, align, width)
+        if (ystart >= ystop) or (xstart >= xstop):
+            continue
+
+        target = OrderedDict([('target', index)])
+        target.update(t)
+        windows.append((target, (ystop-ystart, xstop-xstart), (ystart, xstart)))
+
+    print('{} targets out of {} located in {}'.format(
+        len(windows), len(targets), level1.__class__.__name__))
+
+    return windows
+
+
+def matchup_blocks(level1, windows, bands):
+    '''
+    Iterate over the blocks of the windows located by locate_targets
+    '''
+    for target, size, offset in windows:
+        block = level1.read_block(size, offset, bands)
+        block.target = target
+        yield block
+
+
+class Level2_Matchups(Level2_file):
+    '''
+    Level2 for the point matchups: a csv table with one line per target.
+    Requires the matchup mode of run_atm_corr (argument targets).
+
+    For each target, the pixel closest to the target is searched in the
+    processed window, and the box of box x box pixels around this pixel is
+    extracted. The output includes the target columns, the position
+    (row, col) of the central pixel in the product and its distance to the
+    target (in km), and for each dataset:
+        - its value at the central pixel
+        - its mean and standard deviation over the valid pixels of the box
+          (floating point datasets only)
+    The valid pixels are those where bitmask & BITMASK_REJECT == 0, their
+    number is given by n_valid.
+
+    filename: string
+        if None, determine filename from level1 by using output directory
+        outdir and extension ext
+    outdir: output directory
+    ext: output file extension
+    overwrite: boolean
+        overwrite existing file
+    datasets: list or None
+        list of datasets to include in level 2
+        if None (default), use default_datasets defined in level2 module
+
+    After processing, the table is also available as the attribute results.
+    '''
+    def __init__(self,
+                 filename=None,
+                 ext='.polymer.csv',
+                 outdir=None,
+                 overwrite=False,
+                 datasets=None,
+                 ):
+        self.filename = filename
+        self.ext = ext
+        self.outdir = outdir
+        self.overwrite = overwrite
+        self.datasets = datasets
+        self.extractions = []
+        self.results = None
+
+    def init(self, level1):
+        super(Level2_Matchups, self).init(level1)
+        self.origin = (getattr(level1, 'sline', 0), getattr(level1, 'scol', 0))
+
+    def write(self, block):
+        t = block.target
+        self.bands = block.bands
+
+        # closest pixel to the target
+        coslat = np.cos(np.radians(t['latitude']))
+        dist = 111.2*np.sqrt((block.latitude - t['latitude'])**2
+                             + (coslat*((block.longitude - t['longitude'] + 180) % 360 - 180))**2)
+        if np.isnan(dist).all():
+            return
+        (i, j) = np.unravel_index(np.nanargmin(dist), dist.shape)
+        half = t['box']//2
+        S = (slice(max(i-half, 0), i+half+1), slice(max(j-half, 0), j+half+1))
+
+        ext = OrderedDict(t)
+        ext['row'] = self.origin[0] + block.offset[0] + i
+        ext['col'] = self.origin[1] + block.offset[1] + j
+        ext['distance'] = dist[i, j]
+        data = OrderedDict()
+        missing = []
+        for d in self.datasets:
+            found = block.lookup(d)
+            if found is None:
+                if d not in block:
+                    missing.append(d)
+                continue
+            (name, iband) = found
+            x = block[name]
+            if x.shape[:2] != tuple(block.size):
+                continue
+            if x.ndim == 2:
+                data[d] = (x[S].copy(), x[i, j])
+            elif iband is None:
+                for iband, b in enumerate(self.bands):
+                    data[d+str(b)] = (x[S][:,:,iband].copy(), x[i, j, iband])
+            else:
+                data[d] = (x[S][:,:,iband].copy(), x[i, j, iband])
+
+        if missing:
+            raise Exception('Error, could not find requested datasets: {}'.format(', '.join(missing)))
+
+        # (copies, the block arrays may be recycled, see block.BufferPool)
+        self.extractions.append((ext, block.bitmask[S].copy(), data))
+
+    def finish(self, params):
+        results = []
+        for ext, bitmask, data in self.extractions:
+            valid = (bitmask & params.BITMASK_REJECT) == 0
+            ext['n_valid'] = np.sum(valid)
+            for d, (box, center) in data.items():
+                ext[d] = center
+                if box.dtype.kind == 'f':
+                    ext[d+'_mean'] = np.mean(box[valid]) if valid.any() else np.NaN
+                    ext[d+'_std'] = np.std(box[valid]) if valid.any() else np.NaN
+            results.append(ext)
+
+        if results:
+            self.results = pd.DataFrame(results).sort_values('target')
+        else:
+            self.results = pd.DataFrame(columns=['target'])
+        self.results.to_csv(self.filename, index=False)
+
+    def attributes(self):
+        attrs = OrderedDict()
+        attrs['l2_filename'] = self.filename
+        attrs['l2_format'] = 'matchups'
+        return attrs
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+NO2 climatology for the gaseous correction
+'''
+
+from __future__ import print_function, division, absolute_import
+import numpy as np
+from polymer.luts import read_mlut_hdf, read_mlut_cached
+
+
+class NO2Climatology(object):
+    '''
+    Monthly total and tropospheric NO2 climatology (1440x720 grid), and
+    fraction of tropospheric NO2 above 200m (180x90 grid)
+
+    no2_climatology, no2_frac200m: hdf files
+    cache: whether to read the data through a memory-mapped cache (see
+           luts.read_mlut_cached), so that the processes share the same pages
+    cache_dir: location of the cache (default: next to the hdf files)
+    interp: 'nearest' or 'bilinear'
+
+    The data of each month is loaded on first use.
+    '''
+    def __init__(self, no2_climatology, no2_frac200m,
+                 cache=True, cache_dir=None, interp='nearest', verbose=False):
+        assert interp in ['nearest', 'bilinear']
+        self.no2_climatology = no2_climatology
+        self.no2_frac200m = no2_frac200m
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.interp = interp
+        self.verbose = verbose
+        self.reset()
+
+    def reset(self):
+        self.mlut = None
+        self.months = {}
+        self.frac200m = None
+
+    def read(self, filename, datasets):
+        '''
+        returns the data of datasets (list) in filename
+        '''
+        if self.cache:
+            if self.mlut is None:
+                self.mlut = {}
+            if filename not in self.mlut:
+                self.mlut[filename] = read_mlut_cached(filename,
+                                                       cache_dir=self.cache_dir,
+                                                       verbose=self.verbose)
+            m = self.mlut[filename]
+        else:
+            m = read_mlut_hdf(filename, datasets=datasets)
+
+        return [m[d].data for d in datasets]
+
+    def month(self, m):
+        '''
+        returns the total and tropospheric NO2 for month m (1..12)
+        '''
+        if m not in self.months:
+            self.months[m] = self.read(self.no2_climatology,
+                                       ['tot_no2_{:02d}'.format(m),
+                                        'trop_no2_{:02d}'.format(m)])
+        return self.months[m]
+
+    def frac(self):
+        if self.frac200m is None:
+            self.frac200m, = self.read(self.no2_frac200m, ['f_no2_200m'])
+        return self.frac200m
+
+    def lookup(self, data, latitude, longitude):
+        '''
+        lookup global, regular lat/lon grid data (lat from 90 to -90, lon from
+        0 to 360, at pixel centers) at latitude and longitude (1-d arrays)
+        '''
+        nlat, nlon = data.shape
+        res = nlat/180.
+
+        if self.interp == 'nearest':
+            ilat = (res*(90 - latitude)).astype('int')
+            ilon = (res*longitude).astype('int')
+            ilon[ilon<0] += nlon
+            np.clip(ilat, 0, nlat-1, out=ilat)
+            np.clip(ilon, 0, nlon-1, out=ilon)
+            return data[ilat, ilon]
+
+        # bilinear interpolation
+        y = np.clip(res*(90 - latitude) - 0.5, 0, nlat-1)
+        x = (res*longitude - 0.5) % nlon
+        ilat = np.minimum(y.astype('int'), nlat-2)
+        ilon = x.astype('int')
+        ilon1 = (ilon + 1) % nlon
+        dy = y - ilat
+        dx = x - ilon
+        return ((1-dy)*((1-dx)*data[ilat, ilon] + dx*data[ilat, ilon1])
+                + dy*((1-dx)*data[ilat+1, ilon] + dx*data[ilat+1, ilon1]))
+
+    def get(self, latitude, longitude, month, ok):
+        '''
+        returns no2_frac, no2_tropo, no2_strat at the pixels coordinates
+
+        latitude, longitude: arrays
+        month: month (1..12), as a scalar or per pixel (array)
+        ok: pixels where the results are calculated (0 elsewhere)
+        '''
+        no2_frac = np.zeros(latitude.shape, dtype='float32')
+        no2_tropo = np.zeros(latitude.shape, dtype='float32')
+        no2_strat = np.zeros(latitude.shape, dtype='float32')
+
+        if isinstance(month, np.ndarray):
+            months = np.unique(month[ok])
+        else:
+            months = [month]
+
+        for m in months:
+            if isinstance(month, np.ndarray):
+                sel = ok & (month == m)
+            else:
+                sel = ok
+            lat = latitude[sel]
+            lon = longitude[sel]
+            total, tropo = self.month(int(m))
+
+            tropo = self.lookup(tropo, lat, lon)
+            no2_tropo[sel] = tropo*1e15
+            no2_strat[sel] = (self.lookup(total, lat, lon) - tropo)*1e15
+
+        no2_frac[ok] = self.lookup(self.frac(), latitude[ok], longitude[ok])
+
+        return no2_frac, no2_tropo, no2_strat
+
+    def __getstate__(self):
+        # the data is re-loaded instead of being pickled
+        state = self.__dict__.copy()
+        state['mlut'] = None
+        state['months'] = {}
+        state['frac200m'] = None
+        return state
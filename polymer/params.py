@@ -130,6 +130,42 @@ class Params(object):
         # Generic look-up table
         self.lut_file = join(self.dir_base, 'auxdata/generic/LUT.hdf')
 
+        # cache the LUT and NO2 climatology in a memory-mapped format
+        # (see luts.read_mlut_cached)
+        # the cache is written on first use in lut_cache_dir
+        # (None: next to the original files)
+        self.lut_cache = True
+        self.lut_cache_dir = None
+
+        # use Rayleigh LUTs precomputed for the bands of the current sensor,
+        # for sensors with fixed band wavelengths (see rayleigh.py)
+        # these LUTs are cached in lut_cache_dir if lut_cache is set
+        self.rayleigh_lut = False
+
+        # use the fused pixel loops of preprocessing.pyx for the conversion
+        # to reflectance, gaseous and Rayleigh corrections
+        self.fused_preprocessing = False
+
+        # two-phase read: the valid pixels (level1 flags, landmask, daytime)
+        # are read first for all blocks, and the spectral bands are not read
+        # for the blocks without any valid pixel (level1 derived from
+        # Level1_base only)
+        self.prescan = False
+
+        # recycle the block arrays through a buffer pool (see
+        # block.BufferPool): the arrays of each block are reused by the next
+        # blocks once it has been written (single process mode only)
+        self.buffer_pool = False
+
+        # cost-aware scheduling in multiprocessing mode: the valid pixels
+        # are read first (as for prescan) to estimate the cost of each
+        # block, and the blocks are dispatched by decreasing cost
+        # The blocks costing more than 1/(schedule_split*nworkers) of the
+        # total are split (0: no splitting).
+        # (see level1.schedule_blocks ; level1 derived from Level1_base only)
+        self.schedule = False
+        self.schedule_split = 4
+
         self.thres_chi2 = 0.005
 
         self.partial = 0    # whether to perform partial processing
@@ -206,6 +242,7 @@ class Params(object):
         # no2 absorption data
         self.no2_climatology = join(self.dir_base, 'auxdata/common/no2_climatology.hdf')
         self.no2_frac200m  = join(self.dir_base, 'auxdata/common/trop_f_no2_200m.hdf')
+        self.no2_interp = 'nearest'  # or 'bilinear'
 
         self.multiprocessing = 0 # 0: single thread
                                  # N != 0: multiprocessing, with:
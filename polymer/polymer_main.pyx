@@ -470,25 +470,26 @@ cdef class PolymerMinimizer:
         x0[:] = self.initial_point_1[:]
 
         # create the output datasets
-        block.logchl = np.zeros(block.size, dtype='float32')
+        # (from the buffer pool of the block, if any)
+        block.logchl = block.buffer('logchl', block.size, fill=0)
         cdef float[:,:] logchl = block.logchl
-        block.fa = np.zeros(block.size, dtype='float32')
+        block.fa = block.buffer('fa', block.size, fill=0)
         cdef float[:,:] fa = block.fa
-        block.logfb = np.zeros(block.size, dtype='float32')
+        block.logfb = block.buffer('logfb', block.size, fill=0)
         cdef float[:,:] logfb = block.logfb
-        block.SPM = np.zeros(block.size, dtype='float32')
+        block.SPM = block.buffer('SPM', block.size, fill=0)
         cdef float[:,:] SPM = block.SPM
-        block.niter = np.zeros(block.size, dtype='uint32')
+        block.niter = block.buffer('niter', block.size, dtype='uint32', fill=0)
         cdef unsigned int[:,:] niter = block.niter
-        block.Rw = np.zeros(block.size+(block.nbands,), dtype='float32')
+        block.Rw = block.buffer('Rw', block.size+(block.nbands,), fill=0)
         cdef float[:,:,:] Rw = block.Rw
-        block.Ratm = np.zeros(block.size+(block.nbands,), dtype='float32')
+        block.Ratm = block.buffer('Ratm', block.size+(block.nbands,), fill=0)
         cdef float[:,:,:] Ratm = block.Ratm
-        block.Rwmod = np.zeros(block.size+(block.nbands,), dtype='float32') + np.NaN
+        block.Rwmod = block.buffer('Rwmod', block.size+(block.nbands,))
         cdef float[:,:,:] Rwmod = block.Rwmod
-        block.eps = np.zeros(block.size, dtype='float32')
+        block.eps = block.buffer('eps', block.size, fill=0)
         cdef float[:,:] eps = block.eps
-        block.Ci = np.zeros(block.size+(self.Ncoef,), dtype='float32')
+        block.Ci = block.buffer('Ci', block.size+(self.Ncoef,), fill=0)
         cdef float[:,:,:] Ci = block.Ci
 
         cdef float[:,:] logchl_unc
@@ -499,11 +500,11 @@ cdef class PolymerMinimizer:
         cdef float[:,:] d_rw_x_cov
         cdef float[:,:] d_rw_x
         if self.uncertainties:
-            block.logchl_unc = np.zeros(block.size, dtype='float32') + np.NaN
+            block.logchl_unc = block.buffer('logchl_unc', block.size)
             logchl_unc = block.logchl_unc
-            block.logfb_unc = np.zeros(block.size, dtype='float32') + np.NaN
+            block.logfb_unc = block.buffer('logfb_unc', block.size)
             logfb_unc = block.logfb_unc
-            block.rho_w_unc = np.zeros(block.size+(block.nbands,), dtype='float32') + np.NaN
+            block.rho_w_unc = block.buffer('rho_w_unc', block.size+(block.nbands,))
             rho_w_unc = block.rho_w_unc
             Rtoa_var = block.Rtoa_var
             d_rw_x = np.zeros((block.nbands, self.Nparams), dtype='float32') + np.NaN
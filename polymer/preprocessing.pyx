@@ -0,0 +1,252 @@
+'''
+Fused pixel loops for the initial corrections (see InitCorr.fused_corrections)
+
+The conversion to reflectance, calibration and gaseous correction are applied
+in a single pass over the valid pixels of a block, and the Rayleigh LUTs are
+interpolated and the Rayleigh corrected reflectances written in a second pass
+(the cloud mask, which involves a spatial filter, is applied in between).
+'''
+
+import numpy as np
+cimport numpy as np
+from libc.math cimport exp, M_PI
+
+
+ctypedef fused lut_t:
+    float
+    double
+
+
+def toa_correction(float[:,:,:] Rtoa,
+                   float[:,:,:] Rtoa_gc,
+                   unsigned char[:,:] ok,
+                   unsigned char[:,:] day,
+                   float[:,:] mus,
+                   float[:,:] muv,
+                   float[:,:] air_mass,
+                   float[:,:] ozone,
+                   float[:,:] no2_tr200,
+                   float[:,:] no2_strat,
+                   double[:] calib,
+                   double[:] K_OZ,
+                   double[:] a_285,
+                   double[:] a_225,
+                   float[:,:,:] Ltoa=None,
+                   float[:,:,:] F0=None):
+    '''
+    Conversion to reflectance (if Ltoa is provided), calibration and
+    correction for ozone and NO2 absorption, for all bands
+
+    Rtoa: TOA reflectance (input if Ltoa is None, output otherwise), calibrated
+          in place
+    Rtoa_gc: output, gaseous corrected TOA reflectance
+    ok: valid pixels (converted and calibrated)
+    day: valid pixels at daytime (corrected for gaseous absorption)
+    calib, K_OZ, a_285, a_225: per-band calibration coefficients, ozone
+        absorption and NO2 absorption at 285K and 225K
+    '''
+    cdef int Nx = Rtoa.shape[0]
+    cdef int Ny = Rtoa.shape[1]
+    cdef int nbands = Rtoa.shape[2]
+    cdef int i, j, b
+    cdef int convert = Ltoa is not None
+    cdef double r, tau_o3, tau_no2, tr200, strat, m
+
+    for i in range(Nx):
+        for j in range(Ny):
+            if not ok[i,j]:
+                continue
+
+            if day[i,j]:
+                # convert from DU to cm*atm
+                tau_o3 = ozone[i,j] * 1e-3 * air_mass[i,j]
+                tr200 = no2_tr200[i,j]
+                strat = no2_strat[i,j]
+                m = 1./mus[i,j] + 1./muv[i,j]
+
+            for b in range(nbands):
+                if convert:
+                    r = Ltoa[i,j,b]*M_PI/(<float>(mus[i,j]*F0[i,j,b]))
+                else:
+                    r = Rtoa[i,j,b]
+                r *= calib[b]
+                Rtoa[i,j,b] = r
+
+                if not day[i,j]:
+                    continue
+
+                # ozone and NO2 transmittances in a single exponential
+                tau_no2 = a_285[b]*tr200 + a_225[b]*strat
+                Rtoa_gc[i,j,b] = r*exp(K_OZ[b]*tau_o3 + tau_no2*m)
+
+
+cdef inline void bracket(double k, int n, int *i0, int *i1, double *x) noexcept nogil:
+    '''
+    lower and upper indices i0 and i1, and weight x of the upper index, for
+    the interpolation at the float index k along an axis of length n
+    (as in LUT.__getitem__)
+    '''
+    cdef int i = <int>k
+    if n == 1:
+        i0[0] = 0
+        i1[0] = 0
+        x[0] = 0.
+        return
+    if i == n-1:
+        i -= 1
+    i0[0] = i
+    i1[0] = i+1
+    x[0] = k - i
+
+
+cdef inline double interp_rmol(const lut_t[:,:,:,:,:] L, int l,
+                               int *i0, int *i1, double *x) nogil:
+    '''
+    interpolation of Rmol (band, muv, raa, mus, tau)
+    '''
+    cdef double r = 0., w0, w1, w2, w3
+    cdef int a, b, c, d, ia, ib, ic, id
+    for a in range(2):
+        ia = i1[0] if a else i0[0]
+        w0 = x[0] if a else 1.-x[0]
+        for b in range(2):
+            ib = i1[1] if b else i0[1]
+            w1 = w0*(x[1] if b else 1.-x[1])
+            for c in range(2):
+                ic = i1[2] if c else i0[2]
+                w2 = w1*(x[2] if c else 1.-x[2])
+                for d in range(2):
+                    id = i1[3] if d else i0[3]
+                    w3 = w2*(x[3] if d else 1.-x[3])
+                    r += w3*L[l, ia, ib, ic, id]
+    return r
+
+
+cdef inline double interp_rmolgli(const lut_t[:,:,:,:,:,:] L, int l,
+                                  int *i0, int *i1, double *x) nogil:
+    '''
+    interpolation of Rmolgli (band, muv, raa, mus, tau, wind)
+    '''
+    cdef double r = 0., w0, w1, w2, w3, w4
+    cdef int a, b, c, d, e, ia, ib, ic, id, ie
+    for a in range(2):
+        ia = i1[0] if a else i0[0]
+        w0 = x[0] if a else 1.-x[0]
+        for b in range(2):
+            ib = i1[1] if b else i0[1]
+            w1 = w0*(x[1] if b else 1.-x[1])
+            for c in range(2):
+                ic = i1[2] if c else i0[2]
+                w2 = w1*(x[2] if c else 1.-x[2])
+                for d in range(2):
+                    id = i1[3] if d else i0[3]
+                    w3 = w2*(x[3] if d else 1.-x[3])
+                    for e in range(2):
+                        ie = i1[4] if e else i0[4]
+                        w4 = w3*(x[4] if e else 1.-x[4])
+                        r += w4*L[l, ia, ib, ic, id, ie]
+    return r
+
+
+cdef inline double interp_tmol(const lut_t[:,:,:,:] L, int l, int imu,
+                               int *i0, int *i1, double *x) nogil:
+    '''
+    interpolation of Tmolgli (band, mu, tau, wind), where imu is the position
+    of mu (muv or mus) in the indices
+    '''
+    cdef double r = 0., w0, w1, w2
+    cdef int a, b, c, ia, ib, ic
+    for a in range(2):
+        ia = i1[imu] if a else i0[imu]
+        w0 = x[imu] if a else 1.-x[imu]
+        for b in range(2):
+            ib = i1[3] if b else i0[3]
+            w1 = w0*(x[3] if b else 1.-x[3])
+            for c in range(2):
+                ic = i1[4] if c else i0[4]
+                w2 = w1*(x[4] if c else 1.-x[4])
+                r += w2*L[l, ia, ib, ic]
+    return r
+
+
+def rayleigh_interp(float[:,:,:] Rtoa_gc,
+                    unsigned char[:,:] ok,
+                    const lut_t[:,:,:,:,:] Rmol_lut,
+                    const lut_t[:,:,:,:,:,:] Rmolgli_lut,
+                    const lut_t[:,:,:,:] Tmolgli_lut,
+                    double[:] imuv,
+                    double[:] iraa,
+                    double[:] imus,
+                    double[:] iwind,
+                    double[:,:] itau,
+                    float[:,:,:] Rprime,
+                    float[:,:,:] Rprime_noglint,
+                    float[:,:,:] Rmol,
+                    float[:,:,:] Rmolgli,
+                    float[:,:,:] Tmol,
+                    int glint_precorrection):
+    '''
+    Interpolation of the Rayleigh LUTs and Rayleigh correction, for all bands
+
+    Rmol_lut, Rmolgli_lut, Tmolgli_lut: the LUTs Rmol (muv, raa, mus, tau),
+        Rmolgli (muv, raa, mus, tau, wind) and Tmolgli (mu, tau, wind), with
+        a leading band axis (of length 1 if the LUTs are shared by all bands)
+    imuv, iraa, imus, iwind: float indices of the valid pixels (in C order)
+        in these LUTs, shared by all bands
+    itau: float indices of tau (or of the pressure scaling factor), of shape
+        (N, nbands), or (N, 1) if shared by all bands
+
+    The interpolation weights of the geometry and wind are calculated once
+    per pixel.
+    '''
+    cdef int Nx = Rtoa_gc.shape[0]
+    cdef int Ny = Rtoa_gc.shape[1]
+    cdef int nbands = Rtoa_gc.shape[2]
+    cdef int shared_lut = Rmol_lut.shape[0] == 1
+    cdef int shared_tau = itau.shape[1] == 1
+    cdef int nmu = Rmolgli_lut.shape[1]
+    cdef int nphi = Rmolgli_lut.shape[2]
+    cdef int ntau = Rmolgli_lut.shape[4]
+    cdef int nwind = Rmolgli_lut.shape[5]
+    cdef int i, j, b, l
+    cdef int k = 0
+    cdef int i0[5]
+    cdef int i1[5]
+    cdef double x[5]
+    cdef double rgc, rmol, rmolgli
+    cdef float tmol
+
+    for i in range(Nx):
+        for j in range(Ny):
+            if not ok[i,j]:
+                continue
+
+            # indices of the geometry and wind: (muv, raa, mus, tau, wind)
+            bracket(imuv[k], nmu, &i0[0], &i1[0], &x[0])
+            bracket(iraa[k], nphi, &i0[1], &i1[1], &x[1])
+            bracket(imus[k], nmu, &i0[2], &i1[2], &x[2])
+            bracket(iwind[k], nwind, &i0[4], &i1[4], &x[4])
+
+            for b in range(nbands):
+                if (b == 0) or (not shared_tau):
+                    bracket(itau[k, 0 if shared_tau else b], ntau,
+                            &i0[3], &i1[3], &x[3])
+                l = 0 if shared_lut else b
+
+                rmol = interp_rmol(Rmol_lut, l, i0, i1, x)
+                rmolgli = interp_rmolgli(Rmolgli_lut, l, i0, i1, x)
+                tmol = <float>interp_tmol(Tmolgli_lut, l, 2, i0, i1, x)
+                tmol = <float>(tmol*interp_tmol(Tmolgli_lut, l, 0, i0, i1, x))
+
+                rgc = Rtoa_gc[i,j,b]
+                Rmol[i,j,b] = rmol
+                Rmolgli[i,j,b] = rmolgli
+                Tmol[i,j,b] = tmol
+
+                if glint_precorrection:
+                    Rprime[i,j,b] = rgc - rmolgli
+                else:
+                    Rprime[i,j,b] = rgc - rmol
+                Rprime_noglint[i,j,b] = rgc - rmol
+
+            k += 1
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Rayleigh look-up tables specialized for a sensor
+
+For sensors with fixed band wavelengths, the Rayleigh optical thickness of
+each band is tau_ref(band) * s, where tau_ref is the optical thickness at
+standard pressure and sea level, and s is a scaling factor depending only on
+the surface pressure and altitude.
+The generic Rayleigh LUTs (Rmol, Rmolgli and Tmolgli as a function of tau_ray)
+are therefore resampled once, for each band, along a common axis of s.
+The indices of the geometry, wind and s are then shared by all bands.
+'''
+
+from __future__ import print_function, division, absolute_import
+import numpy as np
+from os.path import join, dirname, isdir
+from hashlib import sha1
+from zlib import adler32
+from warnings import warn
+from polymer.luts import MLUT, LUT, Idx, save_mlut_npy, read_mlut_npy
+from polymer.bodhaine import rod, g
+
+
+# sensors whose band wavelengths do not depend on the pixel
+FIXED_BANDS_SENSORS = ['MSI', 'OLI', 'MODIS', 'SeaWiFS',
+                       'VIIRS', 'VIIRSN', 'VIIRSJ1',
+                       'PRISMA', 'HICO']
+
+# axis of the surface pressure scaling factor
+# (covers surface pressures from about 400 to 1100 hPa)
+press_ratio = np.linspace(0.4, 1.1, 29)
+
+
+def tau_ref(wav):
+    '''
+    Rayleigh optical thickness at standard pressure, at sea level
+        wav: wavelength in nm
+    '''
+    return rod(np.array(wav)/1000., 400., 45., 0., 1013.25)
+
+
+def pressure_scaling(surf_press, altitude):
+    '''
+    Scaling factor s such as tau_ray = tau_ref * s
+    (identical to the ratio of rod(wav, z=altitude, P=surf_press) and tau_ref,
+    for any wavelength)
+    '''
+    return (surf_press/1013.25)*(g(45., 0.)/g(45., altitude))
+
+
+class RayleighLUT(object):
+    '''
+    Rayleigh LUTs (Rmol, Rmolgli and Tmolgli) for a given sensor and list of
+    bands, as a function of the geometry, wind speed and surface pressure
+    scaling factor
+
+    mlut: the generic LUT
+    sensor: sensor name
+    bands: list of bands
+    wav: list of band wavelengths (nm)
+    cache_dir: directory for the cached tables (None: don't cache)
+    '''
+    def __init__(self, mlut, sensor, bands, wav,
+                 cache_dir=None, verbose=False):
+        self.bands = list(bands)
+        self.tau_ref = tau_ref(wav)
+
+        self.cache = None
+        m = None
+        if cache_dir is not None:
+            self.cache = join(cache_dir, 'rayleigh_{}_{}.mlut'.format(
+                sensor, self.key(mlut, sensor)))
+            if isdir(self.cache):
+                m = read_mlut_npy(self.cache)
+
+        if m is None:
+            if verbose:
+                print('Precomputing Rayleigh LUTs for {}'.format(sensor))
+            m = self.calc(mlut)
+            if self.cache is not None:
+                try:
+                    save_mlut_npy(m, self.cache)
+                    m = read_mlut_npy(self.cache)
+                except (IOError, OSError) as e:
+                    warn('Could not write Rayleigh LUT cache "{}" ({})'.format(
+                        self.cache, e))
+                    self.cache = None
+
+        self.init(m)
+
+    def key(self, mlut, sensor):
+        '''
+        A key identifying the tables: sensor, bands, tau_ref and LUT checksum
+        '''
+        h = sha1()
+        h.update(str(sensor).encode())
+        h.update(str(self.bands).encode())
+        h.update(np.round(self.tau_ref, 8).tobytes())
+        h.update(press_ratio.tobytes())
+        for name in ['Rmol', 'Rmolgli', 'Tmolgli']:
+            data = np.ascontiguousarray(mlut[name].data)
+            h.update(str(adler32(data.view('uint8'))).encode())
+        return h.hexdigest()[:16]
+
+    def calc(self, mlut):
+        '''
+        Resample the generic LUTs along the press_ratio axis, for each band
+        '''
+        m = MLUT()
+        for name, itau in [('Rmol', 3),
+                           ('Rmolgli', 3),
+                           ('Tmolgli', 1)]:
+            lut = mlut[name]
+            axtau = lut.axes[itau]
+            data = []
+            for t in self.tau_ref:
+                # interpolate the generic LUT at each tau = tau_ref * s
+                keys = [slice(None)]*lut.ndim
+                res = []
+                for s in press_ratio:
+                    keys[itau] = float(Idx(t*s, fill_value='extrema').index(axtau))
+                    res.append(lut[tuple(keys)])
+                data.append(np.stack(res, axis=itau))
+            names = list(lut.names)
+            names[itau] = 'press_ratio'
+            for i, ax in enumerate(names):
+                if (ax is not None) and (ax not in m.axes) and (i != itau):
+                    m.add_axis(ax, lut.axes[i])
+            m.add_dataset(name, np.array(data, dtype='float32'),
+                          ['band'] + names)
+
+        m.add_axis('press_ratio', press_ratio)
+        m.add_axis('band', np.array(self.bands))
+
+        return m
+
+    def init(self, m):
+        self.mlut = m
+        self.luts = {}
+        for name in ['Rmol', 'Rmolgli', 'Tmolgli']:
+            data = m[name].data
+            self.luts[name] = [LUT(data[i]) for i in range(len(self.bands))]
+        # axes of Rmolgli are (band, mu, phi, mu, press_ratio, wind)
+        axes = m['Rmolgli'].axes
+        self.axis_mu = axes[1]
+        self.axis_phi = axes[2]
+        self.axis_wind = axes[5]
+
+    def index(self, muv, raa, mus, wind):
+        '''
+        returns the float indices of the geometry and wind
+        (shared by all bands)
+        '''
+        return (Idx(muv).index(self.axis_mu),
+                Idx(raa).index(self.axis_phi),
+                Idx(mus).index(self.axis_mu),
+                Idx(wind).index(self.axis_wind))
+
+    def index_press(self, s):
+        '''
+        returns the float index of the pressure scaling factor s
+        '''
+        return Idx(s).index(press_ratio)
+
+    def get(self, iband, index, index_s):
+        '''
+        returns Rmol, Rmolgli and Tmol (two-way transmission) for band iband
+        index: indices of the geometry and wind (see index method)
+        index_s: index of the pressure scaling factor (see index_press method)
+        '''
+        imuv, iraa, imus, iwind = index
+        Rmol = self.luts['Rmol'][iband][imuv, iraa, imus, index_s]
+        Rmolgli = self.luts['Rmolgli'][iband][imuv, iraa, imus, index_s, iwind]
+        Tmol = self.luts['Tmolgli'][iband][imus, index_s, iwind]
+        Tmol *= self.luts['Tmolgli'][iband][imuv, index_s, iwind]
+
+        return Rmol, Rmolgli, Tmol
+
+    def __getstate__(self):
+        # a cached table is re-opened instead of being pickled
+        state = self.__dict__.copy()
+        if self.cache is not None:
+            state['mlut'] = None
+            state['luts'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.mlut is None:
+            self.init(read_mlut_npy(self.cache))
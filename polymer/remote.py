@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Access to the products on a HTTP(S) server (such as an object store), with
+range requests: only the byte ranges of the files which are actually read
+are downloaded, when they are first accessed.
+
+- RemoteFile: a seekable file object on a URL, with a block cache and
+  read-ahead
+- RemoteProduct: a SAFE product on a server, with the same interface as
+  ZipProduct (see archive.py)
+- NCFile: read-only access to a netCDF4 (HDF5) file object through h5py,
+  with the netCDF4 interface used by the readers (the netcdf library can
+  only open files by name)
+
+Example:
+    Level1('https://server/bucket/S3A_OL_1_EFR____20190101T101010_..._002.SEN3')
+'''
+
+from __future__ import print_function, division, absolute_import
+import io
+import os
+import re
+import tempfile
+import weakref
+import numpy as np
+from collections import OrderedDict
+from pathlib import PurePosixPath
+from shutil import rmtree, copyfileobj
+from threading import Lock
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from urllib.parse import quote
+from netCDF4 import Dataset, default_fillvals
+from polymer.archive import glob_paths
+
+
+def is_url(filename):
+    '''
+    whether filename is a HTTP(S) URL
+    '''
+    return str(filename).startswith(('http://', 'https://'))
+
+
+def url_size(url):
+    '''
+    returns the size in bytes of the file at url
+    '''
+    with urlopen(Request(url, method='HEAD')) as response:
+        return int(response.headers['Content-Length'])
+
+
+class RemoteFile(io.RawIOBase):
+    '''
+    A read-only, seekable file object on url, read with HTTP range requests
+
+    The file is fetched by blocks of blocksize bytes, which are kept in a
+    cache of up to cachesize blocks (the least recently used blocks are
+    discarded). When the file is read sequentially, the next readahead
+    blocks are fetched within the same request.
+
+    The number of requests and of fetched bytes are available as the
+    attributes requests and fetched.
+    '''
+    def __init__(self, url, blocksize=2**18, readahead=4, cachesize=256):
+        super(RemoteFile, self).__init__()
+        self.url = url
+        self.blocksize = blocksize
+        self.readahead = readahead
+        self.cachesize = cachesize
+        self.size = url_size(url)
+        self.nblocks = -(-self.size//blocksize)
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.pos = 0
+        self.last = None   # last block read
+        self.requests = 0
+        self.fetched = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence ({})'.format(whence))
+        return self.pos
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        n = max(min(len(view), self.size - self.pos), 0)
+        if n == 0:
+            return 0
+        first = self.pos//self.blocksize
+        last = (self.pos + n - 1)//self.blocksize
+        data = b''.join(self.get_blocks(first, last))
+        start = self.pos - first*self.blocksize
+        view[:n] = data[start:start+n]
+        self.pos += n
+        return n
+
+    def fetch(self, start, stop):
+        '''
+        returns the bytes [start, stop[ of the file
+        '''
+        req = Request(self.url,
+                      headers={'Range': 'bytes={}-{}'.format(start, stop-1)})
+        with urlopen(req) as response:
+            data = response.read()
+            if response.status != 206:
+                # the range has been ignored by the server
+                data = data[start:stop]
+        self.requests += 1
+        self.fetched += len(data)
+        return data
+
+    def get_blocks(self, first, last):
+        '''
+        returns the list of the blocks first to last (included), fetching
+        the missing ones in a single request
+        '''
+        with self.lock:
+            missing = [i for i in range(first, last+1) if i not in self.cache]
+            if missing:
+                start, stop = missing[0], missing[-1]+1
+                if (self.last is not None) and (first in [self.last, self.last+1]):
+                    # sequential read
+                    end = min(stop + self.readahead, self.nblocks)
+                    while (stop < end) and (stop not in self.cache):
+                        stop += 1
+                data = self.fetch(start*self.blocksize,
+                                  min(stop*self.blocksize, self.size))
+                for i in range(start, stop):
+                    self.cache[i] = data[(i-start)*self.blocksize:(i-start+1)*self.blocksize]
+
+            blocks = []
+            for i in range(first, last+1):
+                self.cache.move_to_end(i)
+                blocks.append(self.cache[i])
+            while len(self.cache) > self.cachesize:
+                self.cache.popitem(last=False)
+            self.last = last
+
+        return blocks
+
+    def close(self):
+        self.cache.clear()
+        super(RemoteFile, self).close()
+
+
+class RemoteProduct(object):
+    '''
+    A SAFE product on a HTTP(S) server, given by the url of its directory
+
+    Same interface as ZipProduct: the files are accessed by their path
+    starting with the product directory (attribute root). The list of the
+    files is read in the manifest of the product (xfdumanifest.xml for
+    Sentinel-3, manifest.safe for Sentinel-2), which is required by glob;
+    without manifest, exists uses HEAD requests.
+
+    The files can be read in memory (read), opened as RemoteFile (open), or
+    downloaded individually to a temporary directory (extract) for the
+    libraries which require a filename. The downloaded files are removed by
+    close().
+
+    tmpdir: base directory for the downloaded files (default: system
+        temporary directory)
+    other kwargs are passed to RemoteFile
+    '''
+    manifests = ['xfdumanifest.xml', 'manifest.safe']
+
+    def __init__(self, url, tmpdir=None, **kwargs):
+        self.filename = str(url).rstrip('/')
+        (self.baseurl, name) = self.filename.rsplit('/', 1)
+        self.root = PurePosixPath(name)
+        self.tmpdir = tmpdir
+        self.kwargs = kwargs
+        self.extractdir = None
+        self.extracted = {}
+        self.found = {}
+        self.lock = Lock()
+
+        # all the paths of the product, from its manifest
+        self.paths = None
+        for manifest in self.manifests:
+            try:
+                content = self.read(self.root/manifest)
+            except HTTPError as e:
+                if e.code == 404:
+                    continue
+                raise
+            self.paths = set([self.root, self.root/manifest])
+            for href in re.findall(rb'<fileLocation[^>]*href="([^"]+)"', content):
+                p = self.root/href.decode()
+                self.paths.add(p)
+                self.paths.update(p.parents)
+            self.paths.discard(PurePosixPath('.'))
+            break
+
+    def url(self, name):
+        return self.baseurl + '/' + quote(str(name))
+
+    def exists(self, name):
+        if self.paths is not None:
+            return PurePosixPath(name) in self.paths
+
+        name = str(name)
+        if name not in self.found:
+            try:
+                url_size(self.url(name))
+                self.found[name] = True
+            except HTTPError as e:
+                if e.code != 404:
+                    raise
+                self.found[name] = False
+        return self.found[name]
+
+    def glob(self, pattern):
+        '''
+        returns the sorted list of the paths matching pattern
+        (fnmatch pattern, matched component-wise)
+        '''
+        if self.paths is None:
+            raise IOError('Can not list the files of {} (no manifest)'.format(self.filename))
+        return glob_paths(self.paths, pattern)
+
+    def read(self, name):
+        '''
+        returns the content of file name
+        '''
+        with urlopen(self.url(name)) as response:
+            return response.read()
+
+    def open(self, name):
+        '''
+        returns a RemoteFile for file name
+        '''
+        return RemoteFile(self.url(name), **self.kwargs)
+
+    def extract(self, name):
+        '''
+        downloads file name to the temporary directory (once), and returns
+        its filename
+        '''
+        name = str(name)
+        with self.lock:
+            if name not in self.extracted:
+                if self.extractdir is None:
+                    self.extractdir = tempfile.mkdtemp(dir=self.tmpdir,
+                                                       prefix='polymer_remote_')
+                print('Downloading {}'.format(os.path.basename(name)))
+                target = os.path.join(self.extractdir, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with urlopen(self.url(name)) as response, open(target, 'wb') as fp:
+                    copyfileobj(response, fp)
+                self.extracted[name] = target
+            return self.extracted[name]
+
+    def close(self):
+        if self.extractdir is not None:
+            rmtree(self.extractdir)
+            self.extractdir = None
+            self.extracted = {}
+
+    def __del__(self):
+        if getattr(self, 'extractdir', None) is not None:
+            rmtree(self.extractdir, ignore_errors=True)
+
+
+# HDF5 attributes used by the netcdf library for its own data model
+hidden_attributes = ['CLASS', 'NAME', 'REFERENCE_LIST', 'DIMENSION_LIST',
+                     '_Netcdf4Dimid', '_Netcdf4Coordinates', '_NCProperties',
+                     '_nc3_strict', '_IsNetcdf4']
+
+
+def nc_attributes(obj):
+    '''
+    returns the netcdf attributes of a h5py object, converted like netCDF4
+    (strings, and scalars for single values)
+    '''
+    attrs = OrderedDict()
+    for name in obj.attrs:
+        if name in hidden_attributes:
+            continue
+        value = obj.attrs[name]
+        if isinstance(value, bytes):
+            value = value.decode()
+        elif isinstance(value, np.ndarray) and (value.size == 1):
+            value = value.reshape(-1)[0]
+        attrs[name] = value
+
+    return attrs
+
+
+class NCVariable(object):
+    '''
+    A netCDF4-like variable on a h5py dataset
+
+    The automatic masking (missing_value, _FillValue or default fill value,
+    valid_min, valid_max, valid_range) and scaling (scale_factor,
+    add_offset, _Unsigned) follow the netCDF4 module.
+    '''
+    def __init__(self, ds):
+        import h5py
+        self.ds = ds
+        self.name = ds.name.split('/')[-1]
+        self.attrs = nc_attributes(ds)
+        self.shape = ds.shape
+        self.ndim = ds.ndim
+        self.dtype = ds.dtype
+        self.no_fill = (ds.id.get_create_plist().get_fill_time()
+                        == h5py.h5d.FILL_TIME_NEVER)
+        self.scale = True
+        self.mask = True
+
+    def ncattrs(self):
+        return list(self.attrs)
+
+    def getncattr(self, name):
+        return self.attrs[name]
+
+    def set_auto_scale(self, scale):
+        self.scale = bool(scale)
+
+    def set_auto_mask(self, mask):
+        self.mask = bool(mask)
+
+    def set_auto_maskandscale(self, maskandscale):
+        self.scale = self.mask = bool(maskandscale)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[...], dtype=dtype)
+
+    def chunking(self):
+        if self.ds.chunks is None:
+            return 'contiguous'
+        return list(self.ds.chunks)
+
+    def __getitem__(self, key):
+        if self.ndim == 0:
+            data = np.asarray(self.ds[()])
+        else:
+            data = np.asarray(self.ds[key])
+
+        if self.scale and (self.attrs.get('_Unsigned') in ['true', 'True']) \
+                and (data.dtype.kind == 'i'):
+            data = data.view('{}u{}'.format(data.dtype.byteorder, data.dtype.itemsize))
+
+        if self.mask and (self.dtype.kind in 'iuf'):
+            data = self.masked(data)
+
+        if self.scale:
+            sf = self.attrs.get('scale_factor')
+            ao = self.attrs.get('add_offset')
+            if (sf is not None) and (ao is not None):
+                if (ao != 0.) or (sf != 1.):
+                    data = data*sf + ao
+                else:
+                    data = data.astype(np.asarray(sf).dtype)
+            elif (sf is not None) and (sf != 1.):
+                data = data*sf
+            elif (ao is not None) and (ao != 0.):
+                data = data + ao
+
+        return data
+
+    def masked(self, data):
+        '''
+        returns data as a masked array (see netCDF4.Variable.set_auto_mask)
+        '''
+        def value(name):
+            return np.array(self.attrs[name], self.dtype).view(data.dtype)
+
+        def equal(x, v):
+            if (x.dtype.kind == 'f') and np.isnan(v):
+                return np.isnan(x)
+            return x == v
+
+        mask = np.zeros(data.shape, dtype='bool')
+        if 'missing_value' in self.attrs:
+            for m in np.atleast_1d(value('missing_value')):
+                mask |= equal(data, m)
+        if '_FillValue' in self.attrs:
+            mask |= equal(data, value('_FillValue'))
+        elif not self.no_fill:
+            mask |= data == np.array(default_fillvals[self.dtype.str[1:]], self.dtype)
+
+        vmin, vmax = None, None
+        if ('valid_range' in self.attrs) and (np.size(self.attrs['valid_range']) == 2):
+            vmin, vmax = value('valid_range')
+        else:
+            if 'valid_min' in self.attrs:
+                vmin = value('valid_min')
+            if 'valid_max' in self.attrs:
+                vmax = value('valid_max')
+        if vmin is not None:
+            mask |= data < vmin
+        if vmax is not None:
+            mask |= data > vmax
+
+        return np.ma.masked_array(data, mask=mask)
+
+
+def close_file(h5file, fileobj):
+    h5file.close()
+    fileobj.close()
+
+
+class NCFile(object):
+    '''
+    netCDF4-like read-only access to a netCDF4 (HDF5) file through h5py
+
+    Provides the part of the netCDF4.Dataset interface used by the readers
+    (variables, groups, attributes, automatic masking and scaling), for the
+    file objects which can not be opened by the netcdf library, such as
+    RemoteFile: only the parts of the file which are read are accessed.
+    '''
+    def __init__(self, fileobj, group=None):
+        import h5py
+        self.fileobj = fileobj
+        if group is None:
+            group = h5py.File(fileobj, 'r')
+            # close the h5py file before fileobj, at the latest at exit
+            self.finalizer = weakref.finalize(self, close_file, group, fileobj)
+        self.group = group
+        self.attrs = nc_attributes(group)
+        self.variables = OrderedDict()
+        self.groups = OrderedDict()
+        for name, obj in group.items():
+            if isinstance(obj, h5py.Group):
+                self.groups[name] = NCFile(None, group=obj)
+            elif b'not a netCDF variable' not in np.bytes_(obj.attrs.get('NAME', b'')):
+                self.variables[name] = NCVariable(obj)
+
+    def ncattrs(self):
+        return list(self.attrs)
+
+    def getncattr(self, name):
+        return self.attrs[name]
+
+    def set_auto_mask(self, mask):
+        for var in self.variables.values():
+            var.set_auto_mask(mask)
+        for grp in self.groups.values():
+            grp.set_auto_mask(mask)
+
+    def set_auto_scale(self, scale):
+        for var in self.variables.values():
+            var.set_auto_scale(scale)
+        for grp in self.groups.values():
+            grp.set_auto_scale(scale)
+
+    def close(self):
+        if self.fileobj is not None:
+            self.finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_nc(filename):
+    '''
+    opens a netcdf file for reading: a netCDF4 Dataset, or a NCFile for a
+    URL (read with range requests)
+    '''
+    if is_url(filename):
+        return NCFile(RemoteFile(filename))
+    else:
+        return Dataset(filename)
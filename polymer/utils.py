@@ -167,22 +167,35 @@ def rectBivariateSpline(A, shp):
     Fill NaNs with closest values, otherwise RectBivariateSpline gives no
     result.
     '''
-    xin = np.arange(shp[0], dtype='float32') / (shp[0]-1) * A.shape[0]
-    yin = np.arange(shp[1], dtype='float32') / (shp[1]-1) * A.shape[1]
+    return SplineGrid(A, shp)[:, :]
 
-    x = np.arange(A.shape[0], dtype='float32')
-    y = np.arange(A.shape[1], dtype='float32')
-
-    invalid = isnan(A)
-    if invalid.any():
-        # fill nans
-        # see http://stackoverflow.com/questions/3662361/
-        ind = distance_transform_edt(invalid, return_distances=False, return_indices=True)
-        A = A[tuple(ind)]
-
-    f = RectBivariateSpline(x, y, A)
+class SplineGrid(object):
+    '''
+    Bivariate spline interpolation of array A to a grid of shape shp (see
+    rectBivariateSpline), evaluated lazily on windows of this grid:
 
-    return f(xin, yin).astype('float32')
+        SplineGrid(A, shp)[SY, SX]   # SY and SX are slices
+    '''
+    def __init__(self, A, shp):
+        self.shape = shp
+        self.xin = np.arange(shp[0], dtype='float32') / (shp[0]-1) * A.shape[0]
+        self.yin = np.arange(shp[1], dtype='float32') / (shp[1]-1) * A.shape[1]
+
+        x = np.arange(A.shape[0], dtype='float32')
+        y = np.arange(A.shape[1], dtype='float32')
+
+        invalid = isnan(A)
+        if invalid.any():
+            # fill nans
+            # see http://stackoverflow.com/questions/3662361/
+            ind = distance_transform_edt(invalid, return_distances=False, return_indices=True)
+            A = A[tuple(ind)]
+
+        self.f = RectBivariateSpline(x, y, A)
+
+    def __getitem__(self, key):
+        (sy, sx) = key
+        return self.f(self.xin[sy], self.yin[sx]).astype('float32')
 
 def pstr(x):
     '''
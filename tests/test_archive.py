@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import zipfile
+from os.path import join, exists
+from pathlib import PurePosixPath
+from tempfile import TemporaryDirectory
+from polymer.archive import ZipProduct, is_zip
+
+
+def test_zip_product():
+    with TemporaryDirectory() as tmpdir:
+        filename = join(tmpdir, 'S2A_MSIL1C_TEST.zip')
+        with zipfile.ZipFile(filename, 'w') as z:
+            z.writestr('S2A_MSIL1C_TEST.SAFE/MTD_MSIL1C.xml', '<a/>')
+            for b in ['B01', 'B02', 'B8A']:
+                z.writestr('S2A_MSIL1C_TEST.SAFE/GRANULE/L1C_T31/IMG_DATA/T31_{}.jp2'.format(b), b)
+        assert is_zip(filename)
+        assert not is_zip(tmpdir)
+
+        p = ZipProduct(filename, tmpdir=tmpdir)
+        root = p.root
+        assert root == PurePosixPath('S2A_MSIL1C_TEST.SAFE')
+        assert p.exists(root/'GRANULE')
+        assert p.glob(root/'GRANULE'/'*') == [root/'GRANULE'/'L1C_T31']
+        assert p.glob(root/'*.xml') == [root/'MTD_MSIL1C.xml']
+        jp2 = p.glob(root/'GRANULE'/'*'/'IMG_DATA'/'*_B0?.jp2')
+        assert [x.name for x in jp2] == ['T31_B01.jp2', 'T31_B02.jp2']
+        assert p.read(jp2[1]) == b'B02'
+        with p.open(root/'MTD_MSIL1C.xml') as fp:
+            assert fp.read() == b'<a/>'
+
+        # only the requested members are extracted
+        f = p.extract(jp2[0])
+        assert p.extract(jp2[0]) == f
+        assert open(f).read() == 'B01'
+        assert len(p.extracted) == 1
+        p.close()
+        assert not exists(f)
@@ -40,3 +40,74 @@ def test_ascii(request):
             plt.legend()
             plt.grid(True)
         conftest.savefig(request)
+
+
+def sample_csv(filename, nrows):
+    '''
+    write a sample OLCI extraction file
+    '''
+    import numpy as np
+    import pandas as pd
+    from polymer.level1_ascii import BANDS_OLCI
+    np.random.seed(0)
+    csv = pd.DataFrame()
+    csv['TIME'] = pd.date_range('2019-12-30', periods=nrows, freq='3h').strftime('%Y%m%dT%H%M%SZ')
+    for name, vmin, vmax in [('LAT', -60, 60), ('LON', -180, 180),
+                             ('SUN_ZENITH', 0, 70), ('VIEW_ZENITH', 0, 60),
+                             ('DELTA_AZIMUTH', 0, 180), ('WINDM', 0, 10),
+                             ('OZONE_ECMWF', 250, 400), ('PRESS_ECMWF', 990, 1030),
+                             ('ALTITUDE', 0, 0)]:
+        csv[name] = np.random.uniform(vmin, vmax, nrows)
+    csv['DETECTOR'] = np.random.randint(0, 3700, nrows)
+    for i, b in enumerate(BANDS_OLCI):
+        csv['TOAR_{:02d}'.format(i+1)] = np.random.uniform(10, 100, nrows)
+        csv['F0_{:02d}'.format(i+1)] = np.random.uniform(1000, 2000, nrows)
+        csv['LAMBDA0_{:02d}'.format(i+1)] = b + np.random.uniform(-1, 1, nrows)
+    csv.to_csv(filename, sep=';', index=False)
+
+
+def test_ascii_streaming():
+    import numpy as np
+    with TemporaryDirectory() as tmpdir:
+        filename = tmpdir + '/extraction.csv'
+        sample_csv(filename, 3*230)
+        bands = [412, 443, 560, 865]
+        ref = Level1_ASCII(filename, square=3, blocksize=50, sensor='OLCI')
+        l1 = Level1_ASCII(filename, square=3, blocksize=50, sensor='OLCI',
+                          streaming=True)
+        assert l1.shape == ref.shape == (230, 3)
+        blocks = list(l1.blocks(bands))
+        assert len(blocks) == 5
+        for b1, b2 in zip(ref.blocks(bands), blocks):
+            assert b1.offset == b2.offset
+            for name in ['latitude', 'sza', 'raa', 'Ltoa', 'F0', 'wavelen',
+                         'jday', 'month', 'ozone', 'detector_index']:
+                assert np.array_equal(getattr(b1, name), getattr(b2, name)), name
+
+
+def test_ascii_columnar():
+    import numpy as np
+    import pandas as pd
+    import pytest
+    pytest.importorskip('pyarrow')
+    with TemporaryDirectory() as tmpdir:
+        filename = tmpdir + '/extraction.csv'
+        sample_csv(filename, 3*230)
+        csv = pd.read_csv(filename, sep=';')
+        csv.to_parquet(tmpdir + '/extraction.parquet', row_group_size=100)
+        csv.to_feather(tmpdir + '/extraction.feather')
+
+        bands = [412, 443, 560, 865]
+        ref = list(Level1_ASCII(filename, square=3, blocksize=50,
+                                sensor='OLCI').blocks(bands))
+        for ext in ['parquet', 'feather']:
+            for streaming in [False, True]:
+                l1 = Level1_ASCII(tmpdir + '/extraction.' + ext, square=3,
+                                  blocksize=50, sensor='OLCI',
+                                  streaming=streaming)
+                assert l1.fmt == ext
+                blocks = list(l1.blocks(bands))
+                assert len(blocks) == len(ref)
+                for b1, b2 in zip(ref, blocks):
+                    for name in ['latitude', 'Ltoa', 'F0', 'jday', 'detector_index']:
+                        assert np.array_equal(getattr(b1, name), getattr(b2, name)), name
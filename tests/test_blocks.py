@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pickle
+import numpy as np
+import pytest
+from fractions import Fraction
+from polymer.level1 import (Level1_base, roi_mask, plan_blocks, plan_chunked_blocks, chunk_passes,
+                            band_runs, detector_table, gather_detectors,
+                            schedule_blocks, axis_period)
+from polymer.block import Block, BufferPool
+
+
+def coverage(blocks, shape):
+    cov = np.zeros(shape, dtype='int')
+    for (ysize, xsize), (yoffset, xoffset) in blocks:
+        cov[yoffset:yoffset+ysize, xoffset:xoffset+xsize] += 1
+    return cov
+
+
+def test_plan_blocks_untiled():
+    blocks = plan_blocks(1000, 700, (300, 400))
+    assert blocks[0] == ((300, 400), (0, 0))
+    assert blocks[-1] == ((100, 300), (900, 400))
+    assert (coverage(blocks, (1000, 700)) == 1).all()
+
+
+@pytest.mark.parametrize('origin', [(0, 0), (120, 36)])
+def test_plan_blocks_tiled(origin):
+    # MSI at 20m: tiles of 1024 pixels at 10, 20 and 60m
+    tiles = [(512, 512), (1024, 1024), (3072, 3072)]
+    shape = (5490-origin[0], 5490-origin[1])
+
+    # blocks larger than the common period of all tiles (and of the 60m
+    # pixels): each tile is decoded once
+    blocks = plan_blocks(shape[0], shape[1], (4000, 4000),
+                         tiles=tiles, origin=origin, align=(3, 3))
+    assert (coverage(blocks, shape) == 1).all()
+    for t in tiles:
+        assert chunk_passes(blocks, t, origin=origin) == 1
+
+    # degraded case: the 20m tiles aligned on the 60m pixels (3072) do not
+    # fit in the blocks, which are aligned with the 10m tiles and the 60m
+    # pixels only (1536): the 20m and 60m tiles are decoded more than once
+    blocks = plan_blocks(shape[0], shape[1], (2000, 2000),
+                         tiles=tiles, origin=origin, align=(3, 3))
+    assert (coverage(blocks, shape) == 1).all()
+    for _, (yoffset, xoffset) in blocks:
+        for (o, off) in [(origin[0], yoffset), (origin[1], xoffset)]:
+            assert (off == 0) or ((o + off) % 1536 == 0)
+    assert chunk_passes(blocks, tiles[0], origin=origin) == 1
+    assert chunk_passes(blocks, tiles[1], origin=origin) > 1
+    assert chunk_passes(blocks, tiles[2], origin=origin) > 1
+
+
+def test_plan_blocks_fractional():
+    # MSI at 60m, 10m band: tiles of 1024/6 pixels
+    blocks = plan_blocks(1830, 1830, (198, 1830),
+                         tiles=[(Fraction(1024, 6), Fraction(1024, 6))])
+    assert (coverage(blocks, (1830, 1830)) == 1).all()
+    assert sorted(set(b[1][0] for b in blocks))[:3] == [0, 170, 341]
+
+
+@pytest.mark.parametrize('blocksize', [100, (500, 400)])
+@pytest.mark.parametrize('origin', [(0, 0), (70, 33)])
+def test_plan_chunked_blocks(blocksize, origin):
+    shape = (1210, 1000)
+    chunks = [(64, 1000), (64, 256), (2000, 2000)]
+    blocks = plan_chunked_blocks(shape[0], shape[1], blocksize,
+                                 chunks=chunks, origin=origin)
+    assert (coverage(blocks, shape) == 1).all()
+    if isinstance(blocksize, int):
+        assert set(b[0][1] for b in blocks) == {shape[1]}
+
+    # chunks not larger than the blocks are decompressed once
+    assert chunk_passes(blocks, (64, 256), origin=origin) == 1
+    if isinstance(blocksize, int):
+        assert chunk_passes(blocks, (64, 1000), origin=origin) == 1
+    assert chunk_passes(blocks, (2000, 2000), origin=origin) == len(blocks)
+
+    # unaligned blocks
+    blocks = plan_chunked_blocks(shape[0], shape[1], blocksize, origin=origin)
+    assert chunk_passes(blocks, (64, 1000), origin=origin) > 1
+
+
+def test_detector_table():
+    np.random.seed(0)
+    names = ['E0_band{}'.format(i) for i in range(15)]
+    F0 = np.zeros(925, dtype=[(n, 'f8') for n in names])
+    for n in names:
+        F0[n] = np.random.rand(925)*2000.
+    di = np.random.randint(-1, 925, (30, 40)).astype('int16')
+    table = detector_table([F0[n] for n in names], coef=1.03)
+    assert table.shape == (925, 15)
+
+    columns = [2, 7, 3]
+    res = gather_detectors(table, di, columns)
+    assert res.dtype == np.float32
+    assert res.shape == (30, 40, 3)
+    ok = di >= 0
+    for i, c in enumerate(columns):
+        assert np.allclose(res[:,:,i][ok], F0[names[c]][di[ok]]*1.03, rtol=1e-6)
+    # invalid detector indices
+    assert np.isnan(res[~ok]).all()
+    di[0, 0] = 925
+    assert np.isnan(gather_detectors(table, di, columns)[0, 0]).all()
+
+    # from a (band, detector) array
+    lam0 = np.random.rand(21, 100).astype('float32')
+    di = np.random.randint(0, 100, (5, 6))
+    res = gather_detectors(detector_table(lam0), di, [20, 0])
+    assert (res[:,:,0] == lam0[20, di]).all()
+    assert (res[:,:,1] == lam0[0, di]).all()
+
+
+def test_buffer_pool():
+    pool = BufferPool()
+    block = Block((10, 20), (0, 0), [412, 443], pool=pool)
+    Rprime = block.buffer('Rprime')
+    assert Rprime.dtype == np.float32
+    assert Rprime.shape == (10, 20, 2)
+    assert np.isnan(Rprime).all()
+    niter = block.buffer('niter', fill=0)
+    assert niter.dtype == np.uint32
+    assert (niter == 0).all()
+    Rprime[:] = 1.
+    pool.release(block)
+
+    # the arrays are reused (and initialized) for the next block of the same
+    # size, but not for other keys
+    block = Block((10, 20), (10, 0), [412, 443], pool=pool)
+    assert block.buffer('Rprime') is Rprime
+    assert np.isnan(Rprime).all()
+    assert block.buffer('Rprime', dtype='float64') is not Rprime
+    assert block.buffer('Rprime', (5, 20, 2)).shape == (5, 20, 2)
+    assert block.buffer('Rprime') is not Rprime
+    assert (pool.allocated, pool.reused) == (5, 1)
+
+    # without pool
+    block = Block((10, 20), (0, 0), [412, 443])
+    A = block.buffer('Ci', (10, 20, 4), fill=0)
+    assert A.dtype == np.float32
+    assert (A == 0).all()
+    with pytest.raises(Exception):
+        block.buffer('Ci')
+
+
+def test_block():
+    block = Block((10, 20), (0, 0), [412, 443])
+    block.sza = np.full((10, 20), 60., dtype='float32')
+    block.vza = np.zeros((10, 20), dtype='float32')
+    block.saa = np.zeros((10, 20), dtype='float32')
+    block.vaa = np.full((10, 20), 270., dtype='float32')
+    block.Rw = np.zeros((10, 20, 2), dtype='float32')
+    block.jday = 120
+    assert block['jday'] == 120
+    assert 'Rw' in block
+    assert not hasattr(block, 'Rtoa')
+    with pytest.raises(AttributeError):
+        block.__dict__
+
+    # cached geometry
+    assert np.allclose(block.mus, 0.5)
+    assert block.mus is block.mus
+    assert np.allclose(block.raa, 90.)
+    assert np.allclose(block.air_mass, 3.)
+    assert set(block.datasets()) >= {'_mus', '_muv', '_raa', '_air_mass'}
+
+    # output datasets
+    assert block.lookup('sza') == ('sza', None)
+    assert block.lookup('Rw') == ('Rw', None)
+    assert block.lookup('Rw443') == ('Rw', 1)
+    assert block.lookup('Rw560') is None
+    assert block.lookup('jday') is None
+    assert block.lookup('sza412') is None
+
+    # memory
+    mem = block.memory()
+    assert list(mem)[0] == 'Rw'
+    assert mem['Rw'] == 1600
+    assert block.nbytes() == sum(mem.values())
+    assert 'Rw' in block.memory_report()
+
+    # transfer: the derived geometry is not included
+    b = pickle.loads(pickle.dumps(block))
+    assert b.size == (10, 20) and b.bands == [412, 443]
+    assert '_raa' in b.datasets()
+    assert '_mus' not in b.datasets()
+    assert np.allclose(b.mus, 0.5)
+    assert b.jday == 120
+    del b.jday
+    assert 'jday' not in b
+
+
+
+def test_band_runs():
+    indices = [65, 64, 60, 10, 11, 13]
+    runs = band_runs(indices)
+    assert runs == [(10, 12, [3, 4]), (13, 14, [5]), (60, 61, [2]), (64, 66, [1, 0])]
+    for (start, stop, positions) in runs:
+        assert [indices[p] for p in positions] == list(range(start, stop))
+
+
+class Level1_test(Level1_base):
+    def __init__(self):
+        self.init_shape(100, 30, sline=5)
+        self.blocksize = 20
+        self.valid = np.zeros((100, 30), dtype='bool')
+        self.valid[50:60, 10] = True
+
+    def block_valid(self, size, offset):
+        return self.valid[self.sline+offset[0]:self.sline+offset[0]+size[0]]
+
+    def read_block(self, size, offset, bands, read_bands=True):
+        return (offset[0], read_bands)
+
+    def coarse_latlon(self, step=10):
+        rows = np.arange(0, self.totalheight, step)
+        cols = np.arange(0, self.totalwidth, step)
+        lon, lat = np.meshgrid(cols, rows)
+        return lat + 0.5*lon, lon, rows, cols
+
+
+def test_prescan():
+    l1 = Level1_test()
+    assert [b[1] for b in l1.blocks([])] == [True]*5
+    res = list(l1.blocks([], prescan=True))
+    assert res == [(0, False), (20, False), (40, True), (60, False), (80, False)]
+    assert l1.coverage['valid_pixels'] == 10
+    assert l1.coverage['pixels'] == 95*30
+    assert l1.coverage['empty_blocks'] == 4
+
+
+def test_schedule_blocks():
+    layout = plan_blocks(400, 100, (100, 100))
+    profiles = [np.zeros(100, dtype='int'),       # land
+                np.zeros(100, dtype='int') + 100, # open ocean
+                None,                             # unknown
+                np.zeros(100, dtype='int')]
+    profiles[3][50:] = 10
+
+    # no splitting
+    schedule = schedule_blocks(layout, profiles, nworkers=2, split=0)
+    assert [x[1] for x in schedule] == [(100, 0), (200, 0), (300, 0), (0, 0)]
+    assert [x[2] for x in schedule] == [10000, None, 500, 0]
+    assert schedule[0][3] == schedule[1][3] > schedule[2][3] > schedule[3][3] > 0
+
+    # the expensive blocks of known cost are split, the whole area is
+    # covered once
+    schedule = schedule_blocks(layout, profiles, nworkers=2, split=4, min_rows=10)
+    assert len(schedule) > len(layout)
+    total = sum([x[3] for x in schedule])
+    assert max([x[3] for x in schedule if x[2] is not None]) <= total/8.
+    assert [x[:3] for x in schedule if x[2] is None] == [((100, 100), (200, 0), None)]
+    assert (coverage([x[:2] for x in schedule], (400, 100)) == 1).all()
+    costs = [x[3] for x in schedule]
+    assert costs == sorted(costs, reverse=True)
+    assert sum([x[2] for x in schedule if x[1][0] < 100]) == 0
+
+    # not below min_rows
+    schedule = schedule_blocks(layout, profiles, nworkers=100, min_rows=30)
+    assert min([x[0][0] for x in schedule]) >= 30
+
+
+@pytest.mark.parametrize('origin', [0, 40])
+def test_schedule_blocks_aligned(origin):
+    # MSI at 10m: blocks aligned on the 60m pixels, split only at multiples
+    # of 6 rows in the product grid
+    layout = plan_blocks(1200, 300, (600, 300), origin=(origin, 0), align=(6, 6))
+    profiles = [np.zeros(size[0], dtype='int') + 300 for (size, _) in layout]
+    schedule = schedule_blocks(layout, profiles, nworkers=4, split=4,
+                               period=6, origin=origin)
+    assert len(schedule) > len(layout)
+    assert (coverage([x[:2] for x in schedule], (1200, 300)) == 1).all()
+    for (ysize, _), (yoffset, _), _, _ in schedule:
+        for y in [yoffset, yoffset+ysize]:
+            assert (y in [0, 1200]) or ((origin + y) % 6 == 0)
+
+    # blocks of one tile: no split
+    tiles = [(510, 300)]
+    layout = plan_blocks(1200, 300, (600, 300), tiles=tiles,
+                         origin=(origin, 0), align=(6, 6))
+    profiles = [np.zeros(size[0], dtype='int') + 300 for (size, _) in layout]
+    schedule = schedule_blocks(layout, profiles, nworkers=4, split=4,
+                               period=axis_period(600, [510], 6), origin=origin)
+    assert sorted([x[:2] for x in schedule]) == sorted(layout)
+
+
+class Level1_schedule(Level1_test):
+    def read_block(self, size, offset, bands, read_bands=True):
+        block = Block(size, offset, bands)
+        block.read_bands = read_bands
+        return block
+
+
+def test_schedule():
+    l1 = Level1_schedule()
+    blocks = list(l1.blocks([], nworkers=2, split=0))
+    assert [b.offset for b in blocks][:1] == [(40, 0)]
+    assert [b.read_bands for b in blocks] == [True, False, False, False, False]
+    assert blocks[0].estimated_cost > blocks[1].estimated_cost
+    assert l1.coverage['valid_pixels'] == 10
+
+
+def test_roi_mask():
+    lat, lon = np.meshgrid(np.arange(-10, 11), (np.arange(170, 191) + 180) % 360 - 180)
+    assert roi_mask((-180, -2, -170, 3), lat, lon).sum() == 11*6
+    # across the antimeridian
+    assert roi_mask((175, -2, -175, 3), lat, lon).sum() == 11*6
+    # polygon
+    square = roi_mask([(171.5, -2.5), (178.5, -2.5), (178.5, 3.5), (171.5, 3.5)], lat, lon)
+    assert (square == roi_mask((171.5, -2.5, 178.5, 3.5), lat, lon)).all()
+    assert square.sum() == 7*6
+    triangle = roi_mask([(0, 0), (10, 0), (0, 10)], np.array([1, 5, 6]), np.array([1, 4, 5]))
+    assert list(triangle) == [True, True, False]
+
+
+def test_roi():
+    # samples at rows 0, 10, ... and cols 0, 10, 20, with lat = row + col/2
+    l1 = Level1_test()
+    l1.init_roi((5, 44, 15, 56))
+    assert (l1.sline, l1.height, l1.scol, l1.width) == (30, 31, 0, 21)
+
+    # diagonal roi containing the samples (40, 0) and (50, 20)
+    l1 = Level1_test()
+    l1.blocksize = (10, 10)
+    l1.init_roi([(-1, 39), (1, 39), (21, 61), (19, 61)])
+    assert (l1.sline, l1.height, l1.scol, l1.width) == (30, 31, 0, 30)
+    blocks = l1.roi_blocks(l1.block_layout([]))
+    assert len(blocks) < len(l1.block_layout([]))
+    assert ((10, 10), (0, 20)) not in blocks
+    assert ((1, 10), (30, 0)) not in blocks
+    assert ((10, 10), (0, 0)) in blocks
+
+    l1 = Level1_test()
+    with pytest.raises(Exception):
+        l1.init_roi((40, 0, 50, 10))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from os.path import join
+from tempfile import TemporaryDirectory
+from netCDF4 import Dataset
+from polymer.level1 import ConcurrentReader
+
+
+@pytest.mark.parametrize('mask', [False, True])
+def test_read_nc(mask):
+    np.random.seed(0)
+    attrs = [
+        {'scale_factor': 0.01, 'add_offset': 1.},
+        {'scale_factor': np.float32(0.02)},
+        {'add_offset': -5.},
+        {'scale_factor': 1., 'add_offset': 0.},
+        {},
+        {'scale_factor': 0.5, '_Unsigned': 'true'},
+        ]
+    with TemporaryDirectory() as tmpdir:
+        roots = []
+        for i, a in enumerate(attrs):
+            root = Dataset(join(tmpdir, 'f{}.nc'.format(i)), 'w')
+            root.createDimension('rows', 60)
+            root.createDimension('columns', 40)
+            var = root.createVariable('v', 'u2', ('rows', 'columns'),
+                                      zlib=True, fill_value=65535)
+            var.setncatts(a)
+            var.set_auto_scale(False)
+            var[:] = np.random.randint(0, 65536, (60, 40))
+            root.close()
+
+            root = Dataset(join(tmpdir, 'f{}.nc'.format(i)))
+            root.set_auto_mask(mask)
+            roots.append(root)
+
+        reader = ConcurrentReader()
+        rows, cols = slice(10, 45), slice(3, 38)
+        data = reader.map(lambda r: reader.read_nc(r.variables['v'], rows, cols), roots)
+        reader.close()
+
+        for root, x in zip(roots, data):
+            ref = root.variables['v'][rows, cols]
+            assert x.dtype == ref.dtype
+            assert (np.ma.getmaskarray(x) == np.ma.getmaskarray(ref)).all()
+            assert (np.array(x) == np.array(ref)).all()
+            assert root.variables['v'].scale
+            root.close()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from polymer.luts import MLUT, read_mlut_hdf, read_mlut_cached, Idx
+
+
+def sample_mlut():
+    m = MLUT()
+    m.add_axis('a', np.linspace(100, 150, 5))
+    m.add_axis('b', np.linspace(5, 8, 6))
+    np.random.seed(0)
+    m.add_dataset('data1', np.random.randn(5, 6).astype('float32'), ['a', 'b'])
+    m.add_dataset('data2', np.random.randn(5, 6, 7), ['a', 'b', None])
+    m.set_attr('x', 12)
+    return m
+
+
+def test_mlut_cache():
+    with TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir)/'LUT.hdf')
+        sample_mlut().save(filename)
+        ref = read_mlut_hdf(filename)
+
+        # first call writes the cache, second call reads it
+        for _ in range(2):
+            m = read_mlut_cached(filename)
+            assert (Path(tmpdir)/'LUT.mlut').exists()
+            assert isinstance(m['data1'].data, np.memmap)
+            assert m.equal(ref, show_diff=True)
+
+        # interpolation is unchanged
+        idx = (Idx(np.array([110., 120.])), Idx(np.array([5.5, 7.2])))
+        assert np.allclose(m['data1'][idx], ref['data1'][idx])
+
+
+def test_mlut_cache_dir():
+    with TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir)/'LUT.hdf')
+        sample_mlut().save(filename)
+        cache_dir = Path(tmpdir)/'cache'
+        cache_dir.mkdir()
+        m = read_mlut_cached(filename, cache_dir=str(cache_dir))
+        assert (cache_dir/'LUT.mlut'/'mlut.json').exists()
+        assert m.equal(read_mlut_hdf(filename))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+from os.path import join
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from collections import namedtuple
+from polymer.level1 import Level1_base
+from polymer.block import Block
+from polymer.matchups import (read_targets, locate_targets, matchup_blocks,
+                              Level2_Matchups)
+
+
+def geolocation(rows, cols):
+    # a rotated grid of about 1km
+    lat = 45. - 0.009*rows + 0.002*cols
+    lon = 3. + 0.002*rows + 0.0125*cols
+    return lat, lon
+
+
+class Level1_test(Level1_base):
+    def __init__(self):
+        self.filename = 'test'
+        self.init_shape(500, 400, sline=20)
+        self.date = datetime(2020, 5, 3)
+
+    def coarse_latlon(self):
+        rows = np.arange(0, self.totalheight, 16)
+        cols = np.arange(0, self.totalwidth, 16)
+        C, R = np.meshgrid(cols, rows)
+        lat, lon = geolocation(R, C)
+        return lat, lon, rows, cols
+
+    def read_block(self, size, offset, bands):
+        block = Block(offset=offset, size=size, bands=bands)
+        C, R = np.meshgrid(np.arange(size[1]) + offset[1] + self.scol,
+                           np.arange(size[0]) + offset[0] + self.sline)
+        block.latitude, block.longitude = geolocation(R, C)
+        block.Rw = np.zeros(size+(len(bands),), dtype='float32') + R[:,:,None]
+        block.bitmask = np.zeros(size, dtype='uint16')
+        block.bitmask[R == 101] = 1
+        return block
+
+
+@pytest.mark.parametrize('align', [1, 6])
+def test_matchups(align):
+    pixels = [(100, 50), (300, 397), (21, 200), (10, 10)]
+    targets = []
+    for r, c in pixels:
+        lat, lon = geolocation(r, c)
+        targets.append((lat+0.001, lon-0.001))
+    targets = read_targets(targets)
+    targets['time_start'] = datetime(2020, 5, 1)
+    targets['time_end'] = datetime(2020, 5, 5)
+    targets.loc[2, 'box'] = 5
+    targets['station'] = ['A', 'B', 'C', 'D']
+    targets = pd.concat([targets, targets.iloc[:1].assign(
+        time_end=datetime(2020, 5, 2), station='E')], ignore_index=True)
+
+    l1 = Level1_test()
+    l1.align = align
+    windows = locate_targets(l1, targets)
+    # D is outside the level1 window, E outside the time window
+    assert [w[0]['station'] for w in windows] == ['A', 'B', 'C']
+    for _, size, offset in windows:
+        for i, (s0, s1) in enumerate([(l1.sline, l1.height), (l1.scol, l1.width)]):
+            for x in [offset[i], offset[i]+size[i]]:
+                assert (x in [0, s1]) or ((s0 + x) % align == 0)
+
+    l2 = Level2_Matchups(datasets=['latitude', 'Rw', 'bitmask'])
+    with TemporaryDirectory() as tmpdir:
+        l2.outdir = tmpdir
+        l2.init(l1)
+        for block in matchup_blocks(l1, windows, [443, 560]):
+            l2.write(block)
+        l2.finish(namedtuple('Params', 'BITMASK_REJECT')(1023))
+        res = pd.read_csv(join(tmpdir, 'test.polymer.csv'))
+
+    assert list(res.station) == ['A', 'B', 'C']
+    assert list(zip(res.row, res.col)) == [(r, c) for (r, c) in pixels[:3]]
+    assert (res.distance < 0.2).all()
+    assert list(res.Rw443) == [100., 300., 21.]
+    # box of C clipped to the level1 window
+    assert list(res.n_valid) == [6, 9, 20]
+    assert np.allclose(res.Rw560_mean, [99.5, 300., 21.5])
+    assert 'bitmask_mean' not in res.columns
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pickle
+import numpy as np
+import pytest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from polymer.luts import MLUT
+from polymer.no2 import NO2Climatology
+
+
+def sample_no2(dirname, months=[1, 5]):
+    '''
+    Write sample NO2 climatology files in dirname
+    '''
+    np.random.seed(0)
+    clim = MLUT()
+    for m in months:
+        trop = np.random.rand(720, 1440).astype('float32')
+        clim.add_dataset('trop_no2_{:02d}'.format(m), trop)
+        clim.add_dataset('tot_no2_{:02d}'.format(m),
+                         trop + np.random.rand(720, 1440).astype('float32'))
+    frac = MLUT()
+    frac.add_dataset('f_no2_200m', np.random.rand(90, 180).astype('float32'))
+    clim.save(str(Path(dirname)/'no2_climatology.hdf'))
+    frac.save(str(Path(dirname)/'trop_f_no2_200m.hdf'))
+    return (str(Path(dirname)/'no2_climatology.hdf'),
+            str(Path(dirname)/'trop_f_no2_200m.hdf'))
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_no2(cache):
+    with TemporaryDirectory() as tmpdir:
+        no2 = NO2Climatology(*sample_no2(tmpdir), cache=cache)
+        no2 = pickle.loads(pickle.dumps(no2))
+        lat = np.random.uniform(-90, 90, (30, 40))
+        lon = np.random.uniform(-180, 180, (30, 40))
+        ok = np.random.rand(30, 40) > 0.2
+        month = np.where(lat > 0, 1, 5)
+
+        frac, tropo, strat = no2.get(lat, lon, month, ok)
+        assert (frac[~ok] == 0).all()
+
+        # reference: nearest neighbour in the full arrays
+        ilat = (4*(90 - lat)).astype('int')
+        ilon = (4*lon).astype('int')
+        ilon[ilon<0] += 4*360
+        for m in [1, 5]:
+            sel = ok & (month == m)
+            total_data, tropo_data = no2.month(m)
+            assert np.allclose(tropo[sel], tropo_data[ilat, ilon][sel]*1e15)
+            assert np.allclose(strat[sel], (total_data[ilat, ilon]
+                                            - tropo_data[ilat, ilon])[sel]*1e15)
+        ilat = (0.5*(90 - lat)).astype('int')
+        ilon = (0.5*lon).astype('int')
+        ilon[ilon<0] += 180
+        assert np.allclose(frac[ok], no2.frac()[ilat, ilon][ok])
+
+        # bilinear interpolation of a linear field
+        no2.interp = 'bilinear'
+        data = np.add.outer(np.arange(720), np.arange(1440)).astype('float64')
+        lat = np.random.uniform(-89, 89, 100)
+        lon = np.random.uniform(0.2, 359.7, 100)
+        assert np.allclose(no2.lookup(data, lat, lon),
+                           4*(90-lat) - 0.5 + 4*lon - 0.5)
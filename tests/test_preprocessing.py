@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+from copy import deepcopy
+from tempfile import TemporaryDirectory
+from polymer.main import InitCorr
+from polymer.params import Params
+from polymer.block import Block
+from polymer.no2 import NO2Climatology
+from .test_rayleigh import generic_mlut
+from .test_no2 import sample_no2
+
+
+def sample_block(bands, reflectance):
+    np.random.seed(0)
+    sh = (40, 50)
+    nb = len(bands)
+    b = Block(offset=(0, 0), size=sh, bands=bands)
+    b.month = 5
+    for name, vmin, vmax in [('sza', 0, 85), ('vza', 0, 60),
+                             ('saa', 0, 360), ('vaa', 0, 360),
+                             ('ozone', 250, 400), ('wind_speed', 0, 25),
+                             ('surf_press', 980, 1030),
+                             ('latitude', -60, 60), ('longitude', -180, 180)]:
+        setattr(b, name, np.random.uniform(vmin, vmax, sh).astype('float32'))
+    b.sza[-2:] = 100   # night pixels
+    b.altitude = np.zeros(sh, dtype='float32')
+    b.Ltoa = np.random.uniform(1, 8, sh+(nb,)).astype('float32')
+    b.F0 = np.random.uniform(1000, 2000, sh+(nb,)).astype('float32')
+    if reflectance:
+        b.Rtoa = (b.Ltoa*np.pi/(b.mus[:,:,None]*b.F0)).astype('float32')
+    b.wavelen = np.zeros(sh+(nb,), dtype='float32') + np.array(bands)
+    b.cwavelen = np.array(bands, dtype='float32')
+    b.bitmask = np.zeros(sh, dtype='uint16')
+    b.bitmask[:3] = 4
+    return b
+
+
+@pytest.mark.parametrize('rayleigh_lut', [False, True])
+@pytest.mark.parametrize('reflectance', [False, True])
+def test_fused_corrections(rayleigh_lut, reflectance):
+    bands = [412, 443, 490, 510, 555, 670, 765, 865]
+    p = Params('SeaWiFS', bands_corr=bands, bands_oc=bands, bands_rw=bands,
+               calib={b: 1+0.01*i for i, b in enumerate(bands)},
+               thres_Rcloud_std=10., rayleigh_lut=rayleigh_lut,
+               lut_cache=False)
+
+    c = InitCorr.__new__(InitCorr)
+    c.params = p
+    # descending mu axis, as in the polymer LUT (see cloudmask)
+    c.mlut = generic_mlut(mu=np.linspace(1, 0.1, 10))
+    c.rlut = None
+
+    block = sample_block(bands, reflectance)
+    c.preprocessing(block)
+    block.bitmask[-2:] = 0   # let the night pixels through preprocessing
+    b1, b2 = deepcopy(block), deepcopy(block)
+
+    with TemporaryDirectory() as tmpdir:
+        c.no2 = NO2Climatology(*sample_no2(tmpdir), cache=False)
+
+        c.convert_reflectance(b1)
+        c.apply_calib(b1)
+        c.gas_correction(b1)
+        c.cloudmask(b1)
+        c.rayleigh_correction(b1)
+
+        c.fused_corrections(b2)
+
+    assert (b1.bitmask == b2.bitmask).all()
+    # night pixels are converted to reflectance
+    assert not np.isnan(b2.Rtoa[-2:]).any()
+    for name in ['Rtoa', 'Rtoa_gc', 'Rnir', 'Rprime', 'Rprime_noglint',
+                 'Rmol', 'Rmolgli', 'Tmol']:
+        x, y = getattr(b1, name), getattr(b2, name)
+        ok = ~np.isnan(x)
+        assert (np.isnan(y) == ~ok).all()
+        assert np.allclose(x[ok], y[ok], rtol=1e-6, atol=1e-7), name
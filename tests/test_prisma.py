@@ -121,3 +121,22 @@ def test_prisma(level1, request):
 # TODO: check results identical with different offsets
 # TODO: spectrum visualization
 
+
+
+def test_read_cube():
+    import h5py
+    np.random.seed(0)
+    l1 = Level1_PRISMA.__new__(Level1_PRISMA)
+    l1.buffer = None
+    indices = np.array([65, 64, 60, 10, 11, 13, 0])
+    SY, SX = slice(5, 35), slice(3, 38)
+    with TemporaryDirectory() as tmpdir:
+        with h5py.File(Path(tmpdir)/'cube.h5', 'w') as h:
+            cube = h.create_dataset(
+                'VNIR_Cube', chunks=(10, 66, 40),
+                data=np.random.randint(0, 65535, (50, 66, 40)).astype('uint16'))
+            ref = cube[SY, :, SX].transpose([0, 2, 1])[:, :, indices]
+            for _ in range(2):  # the staging buffer is reused
+                out = np.zeros(ref.shape, dtype='float32')
+                l1.read_cube(cube, indices, SY, SX, out)
+                assert (out == ref).all()
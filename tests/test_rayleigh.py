@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pickle
+import numpy as np
+from tempfile import TemporaryDirectory
+from polymer.luts import MLUT, Idx
+from polymer.bodhaine import rod, RayleighODTable
+from polymer.rayleigh import RayleighLUT, tau_ref, pressure_scaling
+
+
+def generic_mlut(mu=np.linspace(0.1, 1, 10)):
+    '''
+    A generic Rayleigh LUT, linear with respect to tau_ray
+    '''
+    m = MLUT()
+    phi = np.linspace(0, 180, 13)
+    tau = np.linspace(0, 0.6, 13)
+    wind = np.array([0., 5., 10., 20.])
+    m.add_axis('dim_mu', mu)
+    m.add_axis('dim_phi', phi)
+    m.add_axis('dim_tauray', tau)
+    m.add_axis('dim_wind', wind)
+    np.random.seed(0)
+    a = np.random.rand(10, 13, 10)
+    b = np.random.rand(10, 13, 10, 4)
+    c = np.random.rand(10, 4)
+    m.add_dataset('Rmol', a[:,:,:,None]*tau[None,None,None,:],
+                  ['dim_mu', 'dim_phi', 'dim_mu', 'dim_tauray'])
+    m.add_dataset('Rmolgli', b[:,:,:,None,:]*tau[None,None,None,:,None],
+                  ['dim_mu', 'dim_phi', 'dim_mu', 'dim_tauray', 'dim_wind'])
+    m.add_dataset('Tmolgli', 1 - c[:,None,:]*tau[None,:,None],
+                  ['dim_mu', 'dim_tauray', 'dim_wind'])
+    return m
+
+
+def test_rayleigh_lut():
+    mlut = generic_mlut()
+    bands = [443, 560, 865]
+    wav = [442.3, 559.8, 864.7]
+    N = 100
+    np.random.seed(1)
+    muv = np.random.uniform(0.2, 1, N)
+    mus = np.random.uniform(0.2, 1, N)
+    raa = np.random.uniform(0, 180, N)
+    wind = np.random.uniform(0, 20, N)
+    surf_press = np.random.uniform(800, 1040, N)
+    altitude = np.random.uniform(0, 2000, N)
+
+    with TemporaryDirectory() as tmpdir:
+        for _ in range(2):  # calculate, then read from cache
+            rlut = RayleighLUT(mlut, 'MSI', bands, wav, cache_dir=tmpdir)
+            rlut = pickle.loads(pickle.dumps(rlut))
+            index = rlut.index(muv, raa, mus, wind)
+            index_s = rlut.index_press(pressure_scaling(surf_press, altitude))
+
+            for i, w in enumerate(wav):
+                tau_ray = rod(w/1000., 400., 45., altitude, surf_press)
+                assert np.allclose(tau_ray, tau_ref(w)*pressure_scaling(surf_press, altitude))
+
+                Rmol, Rmolgli, Tmol = rlut.get(i, index, index_s)
+                assert np.allclose(Rmol, mlut['Rmol'][
+                    Idx(muv), Idx(raa), Idx(mus), Idx(tau_ray)])
+                assert np.allclose(Rmolgli, mlut['Rmolgli'][
+                    Idx(muv), Idx(raa), Idx(mus), Idx(tau_ray), Idx(wind)])
+                assert np.allclose(Tmol,
+                    mlut['Tmolgli'][Idx(mus), Idx(tau_ray), Idx(wind)]
+                    * mlut['Tmolgli'][Idx(muv), Idx(tau_ray), Idx(wind)])
+
+
+def test_rod_table():
+    np.random.seed(2)
+    surf_press = np.random.uniform(800, 1040, (20, 30))
+    altitude = np.random.uniform(0, 3000, (20, 30))
+    wav = np.array([412., 560., 865., 2130.])
+    ref = np.stack([rod(w/1000., 400., 45., altitude, surf_press) for w in wav], axis=-1)
+
+    # per band wavelengths
+    rodt = RayleighODTable(wav)
+    assert rodt.coef.shape == (4,)
+    assert np.allclose(rodt.tau_ray(surf_press, altitude), ref)
+
+    # per pixel wavelengths
+    wavelen = wav + np.random.uniform(-1, 1, (20, 30, 4))
+    rodt = RayleighODTable(wavelen)
+    f = rodt.factor(surf_press, altitude)
+    for i in range(4):
+        assert np.allclose(rodt.band(i, f),
+                           rod(wavelen[:,:,i]/1000., 400., 45., altitude, surf_press))
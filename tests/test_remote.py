@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import threading
+import numpy as np
+import pytest
+from os.path import join, exists
+from functools import partial
+from contextlib import contextmanager
+from pathlib import PurePosixPath
+from tempfile import TemporaryDirectory
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from netCDF4 import Dataset
+from polymer.remote import RemoteFile, RemoteProduct, NCFile, is_url
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    '''
+    serves the files with support of the range requests
+    '''
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        if 'Range' in self.headers:
+            start, stop = self.headers['Range'].split('=')[1].split('-')
+            data = data[int(start):int(stop)+1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        return io.BytesIO(data)
+
+
+@contextmanager
+def serve(directory, handler=RangeHandler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('handler', [RangeHandler, SimpleHTTPRequestHandler])
+def test_remote_file(handler):
+    np.random.seed(0)
+    data = np.random.bytes(100000)
+    with TemporaryDirectory() as tmpdir:
+        with open(join(tmpdir, 'file.bin'), 'wb') as fp:
+            fp.write(data)
+        with serve(tmpdir, handler) as url:
+            assert is_url(url)
+            f = RemoteFile(url + '/file.bin', blocksize=1000, readahead=4, cachesize=20)
+            assert f.size == len(data)
+            for start, n in [(5500, 10), (5990, 30), (0, 3000), (99990, 100), (42000, 0)]:
+                f.seek(start)
+                assert f.read(n) == data[start:start+n]
+            f.seek(-5, io.SEEK_END)
+            assert f.read() == data[-5:]
+
+            # sequential read: one request for 5 blocks
+            f.seek(20000)
+            requests = f.requests
+            for i in range(5):
+                assert f.read(1000) == data[20000+i*1000:21000+i*1000]
+            assert f.requests == requests + 2
+            assert len(f.cache) <= 20
+            f.close()
+
+
+def test_ncfile():
+    np.random.seed(0)
+    specs = {
+        'a': ('u2', {'scale_factor': 0.01, 'add_offset': 1.}),
+        'b': ('i2', {'_FillValue': -32767, 'scale_factor': np.float32(0.5)}),
+        'c': ('f4', {'missing_value': -999.}),
+        'd': ('i2', {'valid_min': -100, 'valid_max': 100}),
+        'e': ('i1', {'_Unsigned': 'true', 'scale_factor': 2.}),
+        }
+    with TemporaryDirectory() as tmpdir:
+        filename = join(tmpdir, 'file.nc')
+        root = Dataset(filename, 'w')
+        root.title = 'test'
+        root.createDimension('rows', 120)
+        root.createDimension('columns', 80)
+        group = root.createGroup('data')
+        for name, (dtype, attrs) in specs.items():
+            attrs = dict(attrs)
+            fill_value = attrs.pop('_FillValue', None)
+            var = group.createVariable(name, dtype, ('rows', 'columns'), zlib=True,
+                                       chunksizes=(32, 40), fill_value=fill_value)
+            var.setncatts(attrs)
+            var.set_auto_maskandscale(False)
+            if dtype == 'f4':
+                x = np.random.rand(120, 80)
+                x[::7, ::3] = -999.
+            else:
+                x = np.random.randint(-128, 128, (120, 80))
+                x[::5, ::11] = -32767
+            var[:] = x.astype(dtype)
+        root.close()
+
+        with serve(tmpdir) as url:
+            nc = NCFile(RemoteFile(url + '/file.nc', blocksize=4096))
+            ref = Dataset(filename)
+            assert nc.getncattr('title') == 'test'
+            assert list(nc.groups) == ['data']
+            assert list(nc.groups['data'].variables) == list(specs)
+            for mask in [True, False]:
+                nc.set_auto_mask(mask)
+                ref.set_auto_mask(mask)
+                for name in specs:
+                    var = nc.groups['data'].variables[name]
+                    rvar = ref.groups['data'].variables[name]
+                    assert var.ncattrs() == rvar.ncattrs()
+                    assert var.chunking() == rvar.chunking()
+                    for key in [(slice(None), slice(None)), (slice(10, 50), slice(3, 70, 4))]:
+                        x, y = var[key], rvar[key]
+                        assert type(x) == type(y)
+                        assert x.dtype == y.dtype
+                        assert (np.ma.getmaskarray(x) == np.ma.getmaskarray(y)).all()
+                        assert (np.ma.getdata(x) == np.ma.getdata(y)).all()
+
+            # only a part of the file is fetched for a small window
+            nc = NCFile(RemoteFile(url + '/file.nc', blocksize=4096))
+            nc.groups['data'].variables['a'][:32, :40]
+            assert nc.fileobj.fetched < nc.fileobj.size
+            nc.close()
+            ref.close()
+
+
+def test_remote_product():
+    with TemporaryDirectory() as tmpdir:
+        root = join(tmpdir, 'S2A_MSIL1C_TEST.SAFE')
+        imgdir = join(root, 'GRANULE', 'L1C_T31', 'IMG_DATA')
+        os.makedirs(imgdir)
+        hrefs = ['./MTD_MSIL1C.xml']
+        for b in ['B01', 'B02', 'B8A']:
+            with open(join(imgdir, 'T31_{}.jp2'.format(b)), 'w') as fp:
+                fp.write(b)
+            hrefs.append('./GRANULE/L1C_T31/IMG_DATA/T31_{}.jp2'.format(b))
+        with open(join(root, 'MTD_MSIL1C.xml'), 'w') as fp:
+            fp.write('<a/>')
+        with open(join(root, 'manifest.safe'), 'w') as fp:
+            fp.write('<manifest>\n')
+            for href in hrefs:
+                fp.write('<fileLocation locatorType="URL" href="{}"/>\n'.format(href))
+            fp.write('</manifest>\n')
+
+        with serve(tmpdir) as url:
+            p = RemoteProduct(url + '/S2A_MSIL1C_TEST.SAFE/', tmpdir=tmpdir)
+            root = p.root
+            assert root == PurePosixPath('S2A_MSIL1C_TEST.SAFE')
+            assert p.exists(root/'GRANULE')
+            assert not p.exists(root/'AUX_DATA')
+            assert p.glob(root/'GRANULE'/'*') == [root/'GRANULE'/'L1C_T31']
+            jp2 = p.glob(root/'GRANULE'/'*'/'IMG_DATA'/'*_B0?.jp2')
+            assert [x.name for x in jp2] == ['T31_B01.jp2', 'T31_B02.jp2']
+            assert p.read(jp2[1]) == b'B02'
+            with p.open(root/'MTD_MSIL1C.xml') as fp:
+                assert fp.read() == b'<a/>'
+
+            f = p.extract(jp2[0])
+            assert p.extract(jp2[0]) == f
+            assert open(f).read() == 'B01'
+            p.close()
+            assert not exists(f)
+
+            # without manifest
+            os.remove(join(tmpdir, 'S2A_MSIL1C_TEST.SAFE', 'manifest.safe'))
+            p = RemoteProduct(url + '/S2A_MSIL1C_TEST.SAFE')
+            assert p.exists(root/'MTD_MSIL1C.xml')
+            assert not p.exists(root/'manifest.safe')
+            with pytest.raises(IOError):
+                p.glob(root/'*')
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from polymer.level1_safe import TiePoints
+
+
+def test_tiepoints():
+    al, ac = 64, 64
+    y, x = np.meshgrid(np.arange(40), np.arange(77), indexing='ij')
+    lin = 2.*y + 0.5*x
+    # azimuth crossing the -180/180 boundary
+    azi = (170 + lin + 180) % 360 - 180
+    tp = TiePoints({'lin': lin, 'azi': azi}, al, ac, angles=['azi'])
+
+    res = tp.interp((1000, 100), (30, 2000))
+    Y, X = np.meshgrid(np.arange(1000, 1100)/al, np.arange(30, 2030)/ac,
+                       indexing='ij')
+    expected = 2.*Y + 0.5*X
+    assert res['lin'].shape == (100, 2000)
+    assert np.allclose(res['lin'], expected, atol=1e-4)
+    assert np.allclose((res['azi'] - (170 + expected) + 180) % 360 - 180, 0, atol=1e-3)
+    assert res['azi'].min() >= -180
+    assert res['azi'].max() <= 180
@@ -8,7 +8,10 @@ from os import system, rmdir, statvfs, walk
 import tempfile
 import warnings
 from shutil import rmtree
+from concurrent.futures import ThreadPoolExecutor
 import fnmatch
+import tarfile
+import zipfile
 
 
 class TmpManager(object):
@@ -49,6 +52,9 @@ class TmpManager(object):
             # the archive
             file_list = tm.input('/data/file.tar.gz')
 
+            # extract only the archive members matching a pattern
+            file_list = tm.input('/data/file.zip', members='*/Oa0[1-9]_radiance.nc')
+
             # returns a temporary file that will be cleaned up
             tmp = tm.file('filename.txt')
 
@@ -83,15 +89,22 @@ class TmpManager(object):
         available = int(res.f_frsize*res.f_bavail/(1024.**2))   # available space in MB
         return available
 
-    def check_free_space(self):
+    def check_free_space(self, required_mb=0):
         '''
-        Check that available space is sufficient in tmpdir
+        Check that available space is sufficient in tmpdir: the space
+        required_mb for the files to be written, in addition to the margin
+        freespace_mb
         '''
+        if self.__freespace_mb <= 0:
+            return
+
+        required_mb += self.__freespace_mb
+
         available = self.df(self.__tmpdir)
 
-        if (self.__freespace_mb > 0) and (available < self.__freespace_mb):
+        if available < required_mb:
             raise IOError('Not enough free space in {} ({} MB remaining, {} MB required)'.format(
-                self.__tmpdir, available, self.__freespace_mb))
+                self.__tmpdir, available, required_mb))
 
     def mkdirtmp(self):
         '''
@@ -110,11 +123,23 @@ class TmpManager(object):
         if system(cmd):
             raise Exception('Error executing command "{}"'.format(cmd))
 
-    def input(self, filename):
+    def input(self, filename, members=None, threads=None):
         '''
         Copy filename to temporary location
         with on-the-fly decompression, and cleanup on __exit__ (end of TmpManager context)
+
+        members: for zip and tar archives, extract only the members matching
+            members, given as a pattern on the member names
+            (example: '*/Oa0[1-9]_radiance.nc') or as a function
+            name -> boolean. Returns the list of extracted files.
+            The free disk space is checked against the size of the selected
+            members.
+        threads: number of threads for extracting the zip members in
+            parallel (None: default of ThreadPoolExecutor)
         '''
+        if members is not None:
+            return self.input_members(filename, members, threads=threads)
+
         self.check_free_space()
         if self.__verbose:
             v = 'v'
@@ -182,6 +207,55 @@ class TmpManager(object):
 
         return tmpfile
 
+    def input_members(self, filename, members, threads=None):
+        '''
+        Extract the members of archive filename matching members to a
+        temporary location (see input)
+
+        zip members are extracted in parallel. tar archives are read as a
+        stream, in a single pass.
+        '''
+        if callable(members):
+            match = members
+        else:
+            match = lambda name: fnmatch.fnmatch(name, members)
+
+        if filename.endswith('.zip'):
+            with zipfile.ZipFile(filename) as z:
+                infos = [i for i in z.infolist()
+                         if (not i.is_dir()) and match(i.filename)]
+            self.check_free_space(sum([i.file_size for i in infos])/1024.**2)
+            tmpd = self.mkdirtmp()
+
+            def extract(info):
+                # one ZipFile per member, for a parallel decompression
+                with zipfile.ZipFile(filename) as z:
+                    return z.extract(info, tmpd)
+
+            with ThreadPoolExecutor(threads) as executor:
+                files = list(executor.map(extract, infos))
+
+        elif (filename.endswith('.tgz') or filename.endswith('.tar.gz')
+                or filename.endswith('.tar.bz2') or filename.endswith('.tbz2')
+                or filename.endswith('.tar')):
+            tmpd = self.mkdirtmp()
+            kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+            files = []
+            with tarfile.open(filename, 'r|*') as tar:
+                for m in tar:
+                    if m.isfile() and match(m.name):
+                        self.check_free_space(m.size/1024.**2)
+                        tar.extract(m, tmpd, **kwargs)
+                        files.append(join(tmpd, m.name))
+
+        else:
+            raise IOError('Cannot extract members from "{}" (not a zip or tar archive)'.format(filename))
+
+        if self.__verbose:
+            print('Extracted {} members of "{}"'.format(len(files), filename))
+
+        return sorted(files)
+
     def output(self, target):
         '''
         Generate a temporary filename that will be moved to target location
@@ -753,6 +827,26 @@ def test_input():
     # clean all
     Tmp.cleanAll()
 
+def test_input_members():
+    with TmpManager(cfg.tmpdir, freespace_mb=1) as tm:
+        d = tm.directory()
+        names = ['prod/Oa{:02d}_radiance.nc'.format(i) for i in range(1, 22)]
+        archives = [join(d, 'prod.zip'), join(d, 'prod.tar.gz')]
+        with zipfile.ZipFile(archives[0], 'w', zipfile.ZIP_DEFLATED) as z:
+            for n in names:
+                z.writestr(n, n)
+        with tarfile.open(archives[1], 'w:gz') as tar:
+            for n in names:
+                fname = tm.file(basename(n))
+                open(fname, 'w').write(n)
+                tar.add(fname, arcname=n)
+        for archive in archives:
+            files = tm.input(archive, members='*/Oa0[1-9]_radiance.nc')
+            assert [basename(f) for f in files] == [basename(n) for n in names[:9]]
+            assert open(files[2]).read() == names[2]
+            files = tm.input(archive, members=lambda n: n.endswith('21_radiance.nc'))
+            assert len(files) == 1
+
 def test_output():
     cfg.verbose=True
     cfg.freespace = 10
@@ -777,5 +871,6 @@ if __name__ == '__main__':
     test_tmp()
     test_tmp2()
     test_input()
+    test_input_members()
     test_output()
     test_dir()